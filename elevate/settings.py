@@ -238,3 +238,175 @@ SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
 SECURE_COOKIE = True
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
+# --- Chatbot configuration ---
+# Load the embedding model in the gunicorn master so workers share it (see gunicorn.conf.py)
+CHATBOT_PRELOAD_MODELS = os.getenv("CHATBOT_PRELOAD_MODELS", "false").lower() == "true"
+
+# Embedding model used for ingestion and queries, run on CPU. Backends: "sentence-transformers"
+# (set CHATBOT_EMBEDDING_QUANTIZE for int8 dynamic quantization) or "onnx", which loads
+# CHATBOT_EMBEDDING_ONNX_FILE and the tokenizer from CHATBOT_EMBEDDING_ONNX_DIR (needs
+# onnxruntime). CHATBOT_EMBEDDING_DIMENSION > 0 truncates vectors to that many dimensions.
+# The model and dimension are stored with every vector; namespaces embedded with another
+# model are re-embedded on their next ingestion and refused at query time until then.
+# A Pinecone index has a single dimension, so a new dimension needs a new CHATBOT_INDEX_NAME.
+CHATBOT_INDEX_NAME = os.getenv("CHATBOT_INDEX_NAME", "english-book-index")
+CHATBOT_EMBEDDING_MODEL = os.getenv("CHATBOT_EMBEDDING_MODEL", "BAAI/bge-large-en-v1.5")
+CHATBOT_EMBEDDING_BACKEND = os.getenv("CHATBOT_EMBEDDING_BACKEND", "sentence-transformers")
+CHATBOT_EMBEDDING_QUANTIZE = os.getenv("CHATBOT_EMBEDDING_QUANTIZE", "false").lower() == "true"
+CHATBOT_EMBEDDING_DIMENSION = int(os.getenv("CHATBOT_EMBEDDING_DIMENSION", "0"))
+CHATBOT_EMBEDDING_ONNX_DIR = os.getenv("CHATBOT_EMBEDDING_ONNX_DIR", "")
+CHATBOT_EMBEDDING_ONNX_FILE = os.getenv("CHATBOT_EMBEDDING_ONNX_FILE", "model.onnx")
+CHATBOT_EMBEDDING_POOLING = os.getenv("CHATBOT_EMBEDDING_POOLING", "cls")  # "cls" (bge) or "mean"
+CHATBOT_EMBEDDING_THREADS = int(os.getenv("CHATBOT_EMBEDDING_THREADS", "0"))  # 0 = library default
+
+# Optional embedding server (manage.py run_embedding_server) that holds the model once per
+# host: "unix:/path/to.sock" or "http://127.0.0.1:8765". Workers then load no weights. If it
+# is down they fall back to an in-process model (unless CHATBOT_EMBEDDING_SERVER_FALLBACK is
+# false) and retry the server every CHATBOT_EMBEDDING_SERVER_RETRY seconds.
+CHATBOT_EMBEDDING_SERVER = os.getenv("CHATBOT_EMBEDDING_SERVER", "")
+CHATBOT_EMBEDDING_SERVER_TIMEOUT = float(os.getenv("CHATBOT_EMBEDDING_SERVER_TIMEOUT", "5"))
+CHATBOT_EMBEDDING_SERVER_RETRY = float(os.getenv("CHATBOT_EMBEDDING_SERVER_RETRY", "30"))
+CHATBOT_EMBEDDING_SERVER_FALLBACK = os.getenv("CHATBOT_EMBEDDING_SERVER_FALLBACK", "true").lower() == "true"
+
+# Concurrent query embeddings are coalesced into batches of up to CHATBOT_QUERY_BATCH_MAX_SIZE,
+# waiting at most CHATBOT_QUERY_BATCH_MAX_WAIT_MS for the batch to fill (0 = take only what is
+# already queued). CHATBOT_QUERY_BATCH_MAX_SIZE=1 disables batching.
+CHATBOT_QUERY_BATCH_MAX_SIZE = int(os.getenv("CHATBOT_QUERY_BATCH_MAX_SIZE", "32"))
+CHATBOT_QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("CHATBOT_QUERY_BATCH_MAX_WAIT_MS", "5"))
+
+# Query-embedding cache in front of search_book. Set CHATBOT_QUERY_CACHE_ALIAS to
+# a CACHES alias backed by Redis/Memcached to share vectors across workers.
+CHATBOT_QUERY_CACHE_SIZE = int(os.getenv("CHATBOT_QUERY_CACHE_SIZE", "2048"))
+CHATBOT_QUERY_CACHE_TTL = int(os.getenv("CHATBOT_QUERY_CACHE_TTL", "86400"))
+CHATBOT_QUERY_CACHE_ALIAS = os.getenv("CHATBOT_QUERY_CACHE_ALIAS") or None
+
+# Semantic answer cache for ChatbotQueryView. Answers are reused when a new query is
+# within CHATBOT_ANSWER_CACHE_THRESHOLD cosine similarity of a cached one for the same
+# course. Re-ingesting or deleting a course records a new generation in the database;
+# workers check it at most every CHATBOT_ANSWER_CACHE_GENERATION_TTL seconds.
+CHATBOT_ANSWER_CACHE_ENABLED = os.getenv("CHATBOT_ANSWER_CACHE_ENABLED", "true").lower() == "true"
+CHATBOT_ANSWER_CACHE_THRESHOLD = float(os.getenv("CHATBOT_ANSWER_CACHE_THRESHOLD", "0.95"))
+CHATBOT_ANSWER_CACHE_TTL = int(os.getenv("CHATBOT_ANSWER_CACHE_TTL", "3600"))
+CHATBOT_ANSWER_CACHE_SIZE = int(os.getenv("CHATBOT_ANSWER_CACHE_SIZE", "512"))
+CHATBOT_ANSWER_CACHE_GENERATION_TTL = float(os.getenv("CHATBOT_ANSWER_CACHE_GENERATION_TTL", "5"))
+
+# Vector store used by chatbot_core: "pinecone" (default) or "local", which keeps
+# memory-mapped per-namespace matrices under CHATBOT_LOCAL_VECTOR_DIR. Namespaces with
+# at least CHATBOT_LOCAL_ANN_THRESHOLD vectors are searched through an IVF index.
+CHATBOT_VECTOR_BACKEND = os.getenv("CHATBOT_VECTOR_BACKEND", "pinecone")
+CHATBOT_LOCAL_VECTOR_DIR = os.getenv("CHATBOT_LOCAL_VECTOR_DIR", str(BASE_DIR / "vector_store"))
+CHATBOT_LOCAL_VECTOR_DTYPE = os.getenv("CHATBOT_LOCAL_VECTOR_DTYPE", "float32")  # or "float16"
+CHATBOT_LOCAL_ANN_THRESHOLD = int(os.getenv("CHATBOT_LOCAL_ANN_THRESHOLD", "20000"))
+CHATBOT_LOCAL_ANN_NPROBE = int(os.getenv("CHATBOT_LOCAL_ANN_NPROBE", "10"))
+# Simulated network round trip added to every local query (ms); lets load tests
+# stand the local backend in for Pinecone. Leave at 0 in production.
+CHATBOT_LOCAL_VECTOR_LATENCY_MS = float(os.getenv("CHATBOT_LOCAL_VECTOR_LATENCY_MS", "0"))
+
+# Pinecone: each process keeps one index client with up to CHATBOT_PINECONE_POOL_MAXSIZE
+# keep-alive connections; index existence, host and dimension are cached for
+# CHATBOT_INDEX_METADATA_TTL seconds
+CHATBOT_INDEX_METADATA_TTL = int(os.getenv("CHATBOT_INDEX_METADATA_TTL", "300"))
+CHATBOT_PINECONE_POOL_THREADS = int(os.getenv("CHATBOT_PINECONE_POOL_THREADS", "1"))
+CHATBOT_PINECONE_POOL_MAXSIZE = int(os.getenv("CHATBOT_PINECONE_POOL_MAXSIZE", "10"))
+
+# PDF ingestion jobs. Uploads are saved under CHATBOT_INGEST_UPLOAD_DIR (default: the
+# system temp dir). With CHATBOT_INGEST_IN_PROCESS the web process that received an upload
+# runs its job in a pool of CHATBOT_INGEST_WORKERS threads, which needs every web worker
+# on one host. Otherwise turn it off, point CHATBOT_INGEST_UPLOAD_DIR at storage shared
+# with the job runner and run `manage.py run_ingestion_jobs --poll` there; it checks for
+# queued jobs every CHATBOT_INGEST_POLL_INTERVAL seconds.
+# A running job's runner records a heartbeat every CHATBOT_INGEST_HEARTBEAT_INTERVAL
+# seconds. A job without one for CHATBOT_INGEST_LEASE seconds is considered abandoned (its
+# runner crashed or was killed) and queued again, up to CHATBOT_INGEST_MAX_ATTEMPTS runs.
+CHATBOT_INGEST_UPLOAD_DIR = os.getenv("CHATBOT_INGEST_UPLOAD_DIR") or None
+CHATBOT_INGEST_IN_PROCESS = os.getenv("CHATBOT_INGEST_IN_PROCESS", "true").lower() == "true"
+CHATBOT_INGEST_WORKERS = int(os.getenv("CHATBOT_INGEST_WORKERS", "1"))
+CHATBOT_INGEST_POLL_INTERVAL = float(os.getenv("CHATBOT_INGEST_POLL_INTERVAL", "5"))
+CHATBOT_INGEST_HEARTBEAT_INTERVAL = float(os.getenv("CHATBOT_INGEST_HEARTBEAT_INTERVAL", "30"))
+CHATBOT_INGEST_LEASE = float(os.getenv("CHATBOT_INGEST_LEASE", "120"))
+CHATBOT_INGEST_MAX_ATTEMPTS = int(os.getenv("CHATBOT_INGEST_MAX_ATTEMPTS", "3"))
+
+# PDF text extraction: with more than one worker, page ranges of CHATBOT_PDF_SHARD_PAGES
+# pages are extracted in parallel processes and merged back in page order
+CHATBOT_PDF_WORKERS = int(os.getenv("CHATBOT_PDF_WORKERS", "1"))
+CHATBOT_PDF_SHARD_PAGES = int(os.getenv("CHATBOT_PDF_SHARD_PAGES", "16"))
+
+# Ingestion embed/upsert pipeline: chunks are embedded CHATBOT_EMBED_BATCH_SIZE at a time
+# while up to CHATBOT_UPSERT_WORKERS threads upload finished batches. At most
+# CHATBOT_UPSERT_MAX_PENDING embedded batches wait for upload; failed upserts are retried
+# up to CHATBOT_UPSERT_ATTEMPTS times.
+CHATBOT_EMBED_BATCH_SIZE = int(os.getenv("CHATBOT_EMBED_BATCH_SIZE", "100"))
+CHATBOT_UPSERT_WORKERS = int(os.getenv("CHATBOT_UPSERT_WORKERS", "4"))
+CHATBOT_UPSERT_MAX_PENDING = int(os.getenv("CHATBOT_UPSERT_MAX_PENDING", "8"))
+CHATBOT_UPSERT_ATTEMPTS = int(os.getenv("CHATBOT_UPSERT_ATTEMPTS", "5"))
+
+# The query endpoints can save the question/answer pair (``save_messages``). When
+# deferred, non-streamed answers are sent before the INSERT and come back without ids.
+CHATBOT_DEFER_MESSAGE_SAVE = os.getenv("CHATBOT_DEFER_MESSAGE_SAVE", "false").lower() == "true"
+
+# Messages per page of chat history (ChatMessageViewSet.by_course), newest first
+CHATBOT_HISTORY_PAGE_SIZE = int(os.getenv("CHATBOT_HISTORY_PAGE_SIZE", "50"))
+
+# The query endpoints time each stage (embedding, vector search, context, LLM) per request.
+# Timings are logged as JSON to the "user_extras.chatbot" logger at CHATBOT_QUERY_LOG_LEVEL,
+# aggregated per namespace for chatbot/stats/ and, unless disabled, sent to the client
+# in a Server-Timing header.
+CHATBOT_SERVER_TIMING_HEADER = os.getenv("CHATBOT_SERVER_TIMING_HEADER", "true").lower() == "true"
+CHATBOT_QUERY_LOG_LEVEL = os.getenv("CHATBOT_QUERY_LOG_LEVEL", "INFO")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "user_extras.chatbot": {
+            "handlers": ["console"],
+            "level": CHATBOT_QUERY_LOG_LEVEL,
+            "propagate": False,
+        },
+        "user_extras.ingestion": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
+# Each chatbot request must be answered within CHATBOT_REQUEST_DEADLINE seconds (0 = no
+# deadline); a Groq call gets at most CHATBOT_LLM_TIMEOUT of what is left. Failed calls are
+# tried up to CHATBOT_LLM_ATTEMPTS times with jittered backoff, while retries stay within
+# CHATBOT_LLM_RETRY_BUDGET of all calls (plus a reserve of CHATBOT_LLM_RETRY_BURST).
+# CHATBOT_LLM_HEDGE_AFTER > 0 sends a duplicate of a non-streamed call that hasn't answered
+# after that many seconds; hedged calls run on CHATBOT_LLM_HEDGE_WORKERS threads per process
+# and calls that find them all busy go unhedged. The circuit breaker fails calls fast for
+# CHATBOT_LLM_BREAKER_COOLDOWN seconds once CHATBOT_LLM_BREAKER_FAILURE_RATE of at least
+# CHATBOT_LLM_BREAKER_MIN_CALLS calls in the last CHATBOT_LLM_BREAKER_WINDOW seconds have failed.
+CHATBOT_REQUEST_DEADLINE = float(os.getenv("CHATBOT_REQUEST_DEADLINE", "30"))
+CHATBOT_LLM_TIMEOUT = float(os.getenv("CHATBOT_LLM_TIMEOUT", "20"))
+CHATBOT_LLM_ATTEMPTS = int(os.getenv("CHATBOT_LLM_ATTEMPTS", "3"))
+CHATBOT_LLM_RETRY_BUDGET = float(os.getenv("CHATBOT_LLM_RETRY_BUDGET", "0.1"))
+CHATBOT_LLM_RETRY_BURST = int(os.getenv("CHATBOT_LLM_RETRY_BURST", "10"))
+CHATBOT_LLM_HEDGE_AFTER = float(os.getenv("CHATBOT_LLM_HEDGE_AFTER", "0"))
+CHATBOT_LLM_HEDGE_WORKERS = int(os.getenv("CHATBOT_LLM_HEDGE_WORKERS", "32"))
+CHATBOT_LLM_BREAKER_FAILURE_RATE = float(os.getenv("CHATBOT_LLM_BREAKER_FAILURE_RATE", "0.5"))
+CHATBOT_LLM_BREAKER_MIN_CALLS = int(os.getenv("CHATBOT_LLM_BREAKER_MIN_CALLS", "10"))
+CHATBOT_LLM_BREAKER_WINDOW = float(os.getenv("CHATBOT_LLM_BREAKER_WINDOW", "30"))
+CHATBOT_LLM_BREAKER_COOLDOWN = float(os.getenv("CHATBOT_LLM_BREAKER_COOLDOWN", "15"))
+
+# Domain-wide questions (``domain_id``) search every course namespace of the domain, at most
+# CHATBOT_MULTI_SEARCH_CONCURRENCY at a time per process; namespaces that haven't answered
+# within CHATBOT_MULTI_SEARCH_TIMEOUT seconds (0 = only the request deadline) are left out.
+CHATBOT_MULTI_SEARCH_CONCURRENCY = int(os.getenv("CHATBOT_MULTI_SEARCH_CONCURRENCY", "8"))
+CHATBOT_MULTI_SEARCH_TIMEOUT = float(os.getenv("CHATBOT_MULTI_SEARCH_TIMEOUT", "2"))
+
+# Threads that run query embeddings for the async (ASGI) chatbot endpoint
+CHATBOT_EMBED_THREADS = int(os.getenv("CHATBOT_EMBED_THREADS", "2"))
+
+# RAG prompt context: up to CHATBOT_RETRIEVAL_TOP_K chunks are retrieved, overlapping
+# chunks merged, and passages added in relevance order until the token budget is used
+CHATBOT_RETRIEVAL_TOP_K = int(os.getenv("CHATBOT_RETRIEVAL_TOP_K", "5"))
+CHATBOT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHATBOT_CONTEXT_TOKEN_BUDGET", "1500"))
+CHATBOT_CONTEXT_ENCODING = os.getenv("CHATBOT_CONTEXT_ENCODING", "o200k_base")
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
 from content.views import DomainViewSet, CourseViewSet, AnnouncementViewSet, ChapterViewSet, SubtopicViewSet, FlashcardViewSet, QuestionViewSet, UserDomainCoursesAPIView, CourseDetailAPIView, PaidDomainsAPIView, UnpaidDomainsAPIView
-from user_extras.views import FavoriteViewSet, NotificationViewSet, ChatMessageViewSet, AdminProcessPDFView, AdminDeleteNamespaceView, ChatbotQueryView
+from user_extras.views import FavoriteViewSet, NotificationViewSet, ChatMessageViewSet, AdminProcessPDFView, AdminProcessPDFStatusView, AdminDeleteNamespaceView, ChatbotQueryView, ChatbotStatsView, chatbot_query_async
 
 router = DefaultRouter()
 # Content Routes (admin-only CRUD, authenticated read)
@@ -29,6 +29,9 @@ urlpatterns = [
     
     # Chatbot
     path('process_pdf/', AdminProcessPDFView.as_view(), name='process_pdf'),  # Added basename
+    path('process_pdf/<int:job_id>/', AdminProcessPDFStatusView.as_view(), name='process_pdf_status'),
     path('delete_namespace/', AdminDeleteNamespaceView.as_view(), name='delete_namespace'),  # Added basename
-    path('query/', ChatbotQueryView.as_view(), name='query')  # Added basename
+    path('query/', ChatbotQueryView.as_view(), name='query'),  # Added basename
+    path('query/async/', chatbot_query_async, name='query_async'),  # Serve from ASGI (uvicorn) workers
+    path('chatbot/stats/', ChatbotStatsView.as_view(), name='chatbot_stats'),
 ]
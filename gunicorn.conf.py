@@ -0,0 +1,21 @@
+# Gunicorn configuration, picked up automatically from the working directory.
+import os
+
+from django.conf import settings
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "elevate.settings")
+
+# With CHATBOT_PRELOAD_MODELS, import the Django app in the master process before
+# forking, so anything loaded there (e.g. the embedding model) is shared
+# copy-on-write by workers. Otherwise each worker imports the app itself and
+# creates its own models and clients.
+preload_app = settings.CHATBOT_PRELOAD_MODELS
+
+
+def when_ready(server):
+    """Warm the chatbot models in the master once the app has been loaded."""
+    if settings.CHATBOT_PRELOAD_MODELS:
+        from user_extras.chatbot_core import preload_models
+
+        server.log.info("Preloading chatbot embedding models")
+        preload_models()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Favorite, Notification, ChatMessage
+from .models import Favorite, Notification, ChatMessage, IngestionJob, IngestedBook
 
 # Register your models here.
-admin.site.register([Favorite, Notification, ChatMessage])
\ No newline at end of file
+admin.site.register([Favorite, Notification, ChatMessage, IngestionJob, IngestedBook])
\ No newline at end of file
@@ -0,0 +1,114 @@
+import itertools
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "the answer depends on the chapter you are reading and the examples it gives so "
+    "start from the definition then work through each step before checking the summary"
+).split()
+
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    """OpenAI-style ``/chat/completions`` endpoint, as spoken by the Groq SDK."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in payload.get("messages", [])) // 4
+        tokens = list(itertools.islice(itertools.cycle(WORDS), server.completion_tokens))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        completion = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+        }
+
+        time.sleep(server.latency)
+        if not payload.get("stream"):
+            time.sleep(len(tokens) / server.tokens_per_second)
+            self._send_json(200, {
+                **completion,
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(tokens)},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk = {**completion, "object": "chat.completion.chunk"}
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(1 / server.tokens_per_second)
+            delta = {"content": token if i == 0 else f" {token}"}
+            if i == 0:
+                delta["role"] = "assistant"
+            self._send_event({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        # Groq sends the usage on the last chunk, under ``x_groq``
+        self._send_event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                          "x_groq": {"id": completion["id"], "usage": usage}})
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, data):
+        self._write_chunk(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def make_fake_llm_server(address=("127.0.0.1", 0), latency=0.3, tokens_per_second=200.0, completion_tokens=64):
+    """Create (but don't start) a stand-in for the Groq chat completions API.
+
+    Every completion waits ``latency`` seconds (the time to first token), then
+    produces ``completion_tokens`` words at ``tokens_per_second``, streamed as
+    SSE chunks when the request asks for ``stream``. Point ``GROQ_BASE_URL``
+    at ``http://host:port``; any path ending in ``/chat/completions`` works.
+    """
+    server = ThreadingHTTPServer(address, FakeChatHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.tokens_per_second = tokens_per_second
+    server.completion_tokens = completion_tokens
+    server.requests = 0
+    server.lock = threading.Lock()
+    return server
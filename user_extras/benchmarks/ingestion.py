@@ -0,0 +1,297 @@
+import gc
+import hashlib
+import json
+import os
+import platform
+import re
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import psutil
+
+from .synthetic_pdf import make_synthetic_pdf
+
+STAGES = ("extract", "classify", "clean", "split", "chunk", "embed", "upsert", "pipeline")
+
+
+class HashingEmbedder:
+    """Offline stand-in for the HuggingFace embedder.
+
+    Builds signed bag-of-hashed-words vectors, so the benchmark exercises real
+    float work and realistic vector sizes without downloading model weights.
+    """
+
+    def __init__(self, dimension=1024, model_name="hashing"):
+        self.dimension = dimension
+        self.model_name = model_name
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dimension] += 1.0 if digest & (1 << 63) else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    def embed_queries(self, texts):
+        return [self._embed(text) for text in texts]
+
+
+class _RssSampler(threading.Thread):
+    """Samples this process's resident set size until stopped; keeps the peak."""
+
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = self.process.memory_info().rss
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+        return self.peak
+
+
+def measure(func, repeat=3):
+    """Time ``func()`` and profile its memory.
+
+    ``func`` runs ``repeat`` times for timing, then once more under tracemalloc
+    (which slows allocation-heavy code, so it is kept out of the timings) while
+    RSS is sampled in the background. Returns ``(result, measurements)``.
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    sampler = _RssSampler()
+    rss_before = sampler.peak
+    sampler.start()
+    tracemalloc.start()
+    try:
+        func()
+        _current, alloc_peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        rss_peak = sampler.stop()
+
+    return result, {
+        "seconds_best": min(timings),
+        "seconds_median": statistics.median(timings),
+        "rss_before_bytes": rss_before,
+        "rss_peak_bytes": rss_peak,
+        "rss_growth_bytes": rss_peak - rss_before,
+        "alloc_peak_bytes": alloc_peak,
+        "alloc_retained_blocks": sum(stat.count for stat in snapshot.statistics("filename")),
+    }
+
+
+def _rates(stats, pages=None, chunks=None):
+    seconds = stats["seconds_best"] or float("nan")
+    if pages is not None:
+        stats["pages"] = pages
+        stats["pages_per_second"] = pages / seconds
+    if chunks is not None:
+        stats["chunks"] = chunks
+        stats["chunks_per_second"] = chunks / seconds
+    return stats
+
+
+def run_ingestion_benchmark(pages=200, lines_per_page=45, words_per_line=12, repeat=3,
+                            batch_size=100, embedder=None, stages=STAGES, seed=0, log=print):
+    """Benchmark each ingestion stage in isolation on a synthetic book.
+
+    Every stage gets its input precomputed by the previous stages outside the
+    timed region, so its numbers reflect that stage alone. ``split`` times the
+    whole-text splitter and ``chunk`` the page-streaming one ingestion uses
+    (``iter_document_chunks``). ``pipeline`` times what ``process_pdf_book``
+    runs after extraction: chunks streamed from the cleaned pages into
+    ``embed_documents_in_pinecone``, which embeds while earlier batches are
+    upserted. Upserts go to a ``LocalVectorBackend`` in a temporary directory.
+
+    Args:
+        pages: Number of pages in the synthetic PDF
+        lines_per_page: Text lines on each body page
+        words_per_line: Words on each line (with ``lines_per_page``, the text density)
+        repeat: Timed runs per stage; the best run is used for throughput
+        batch_size: Chunks per embedding/upsert batch
+        embedder: Object with ``embed_documents``; defaults to ``HashingEmbedder``
+        stages: Subset of ``STAGES`` to report
+        seed: Seed for the synthetic text
+        log: Callable receiving progress lines
+
+    Returns:
+        Dict with the run configuration, environment and per-stage results.
+    """
+    import PyPDF2
+    from django.conf import settings
+    from ..chatbot_core import (
+        CHUNK_OVERLAP, CHUNK_SIZE, embed_documents_in_pinecone, extract_text_from_pdf,
+        iter_document_chunks, split_document,
+    )
+    from ..pdf_extraction import clean_text, is_likely_index_or_toc
+    from ..vector_backends import LocalVectorBackend
+
+    embedder = embedder or HashingEmbedder(settings.CHATBOT_EMBEDDING_DIMENSION or 1024)
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix="bench-ingest-") as workdir:
+        pdf_path = os.path.join(workdir, "synthetic.pdf")
+        make_synthetic_pdf(pdf_path, pages, lines_per_page, words_per_line, seed=seed)
+        log(f"Generated {pages}-page synthetic PDF ({os.path.getsize(pdf_path)} bytes)")
+
+        # Inputs for the later stages, computed once outside any timed region
+        raw_pages = [page.extract_text() or "" for page in PyPDF2.PdfReader(pdf_path).pages]
+        kept_pages = [text for text in raw_pages if text and not is_likely_index_or_toc(text)]
+        # (page number, cleaned text) as iter_pdf_pages yields them
+        page_stream = [
+            (page_number, clean_text(page_text)) for page_number, page_text in enumerate(raw_pages, 1)
+            if page_text and not is_likely_index_or_toc(page_text)
+        ]
+        text = " ".join(clean_text(page_text) for page_text in kept_pages)
+        metadata = {"source": pdf_path, "title": "synthetic"}
+        docs = split_document(text, metadata, CHUNK_SIZE, CHUNK_OVERLAP)
+        contents = [doc["content"] for doc in docs]
+        batches = [contents[i:i + batch_size] for i in range(0, len(contents), batch_size)]
+
+        if "extract" in stages:
+            log("Timing extract_text_from_pdf...")
+            _, stats = measure(lambda: extract_text_from_pdf(pdf_path), repeat)
+            results["extract"] = _rates(stats, pages=len(raw_pages))
+
+        if "classify" in stages:
+            log("Timing is_likely_index_or_toc...")
+            _, stats = measure(lambda: [is_likely_index_or_toc(page_text) for page_text in raw_pages], repeat)
+            results["classify"] = _rates(stats, pages=len(raw_pages))
+
+        if "clean" in stages:
+            log("Timing clean_text...")
+            _, stats = measure(lambda: [clean_text(page_text) for page_text in kept_pages], repeat)
+            results["clean"] = _rates(stats, pages=len(kept_pages))
+
+        if "split" in stages:
+            log("Timing split_document...")
+            _, stats = measure(lambda: split_document(text, metadata, CHUNK_SIZE, CHUNK_OVERLAP), repeat)
+            results["split"] = _rates(stats, pages=len(kept_pages), chunks=len(docs))
+
+        if "chunk" in stages:
+            log("Timing iter_document_chunks...")
+            chunks, stats = measure(
+                lambda: list(iter_document_chunks(page_stream, metadata, CHUNK_SIZE, CHUNK_OVERLAP)), repeat,
+            )
+            results["chunk"] = _rates(stats, pages=len(page_stream), chunks=len(chunks))
+
+        vectors = None
+        if "embed" in stages or "upsert" in stages:
+            log(f"Timing embedding ({type(embedder).__name__})...")
+            vectors, stats = measure(
+                lambda: [vector for batch in batches for vector in embedder.embed_documents(batch)], repeat,
+            )
+            if "embed" in stages:
+                results["embed"] = _rates(stats, chunks=len(docs))
+
+        if "upsert" in stages:
+            log("Timing upsert into a local vector store...")
+            backend = LocalVectorBackend(os.path.join(workdir, "vector_store"))
+            ids = [doc["id"] for doc in docs]
+            metadatas = [doc["metadata"] for doc in docs]
+
+            def upsert():
+                backend.delete_namespace("bench")
+                for start in range(0, len(docs), batch_size):
+                    stop = start + batch_size
+                    backend.upsert("bench", ids[start:stop], vectors[start:stop],
+                                   contents[start:stop], metadatas[start:stop])
+
+            _, stats = measure(upsert, repeat)
+            results["upsert"] = _rates(stats, chunks=len(docs))
+
+        if "pipeline" in stages:
+            log("Timing the streamed chunk/embed/upsert pipeline (embed_documents_in_pinecone)...")
+            backend = LocalVectorBackend(os.path.join(workdir, "pipeline_store"))
+            counted = []
+
+            def pipeline():
+                backend.delete_namespace("bench")
+                chunks = iter_document_chunks(page_stream, metadata, CHUNK_SIZE, CHUNK_OVERLAP)
+                # One write per ingestion, as in process_pdf_book
+                with backend.batch("bench"):
+                    embed_documents_in_pinecone(chunks, "bench", "bench", batch_size=batch_size,
+                                                embedder=embedder, vector_backend=backend)
+                counted.append(len(backend.list_ids("bench")))
+
+            _, stats = measure(pipeline, repeat)
+            results["pipeline"] = _rates(stats, pages=len(page_stream), chunks=counted[-1])
+
+    return {
+        "created_at": datetime.now().isoformat(),
+        "config": {
+            "pages": pages,
+            "lines_per_page": lines_per_page,
+            "words_per_line": words_per_line,
+            "repeat": repeat,
+            "batch_size": batch_size,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "embedder": type(embedder).__name__,
+            "seed": seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "stages": results,
+    }
+
+
+def compare_results(current, baseline, tolerance=0.10):
+    """Compare two benchmark results stage by stage.
+
+    Returns a list of ``(stage, metric, baseline, current, change, regressed)``
+    rows; ``change`` is the relative change in throughput and a stage has
+    regressed when it got slower by more than ``tolerance``.
+    """
+    rows = []
+    for stage, stats in current["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base:
+            continue
+        metric = "chunks_per_second" if "chunks_per_second" in stats else "pages_per_second"
+        if metric not in base or not base[metric]:
+            continue
+        change = stats[metric] / base[metric] - 1.0
+        rows.append((stage, metric, base[metric], stats[metric], change, change < -tolerance))
+    return rows
+
+
+def save_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,358 @@
+import http.client
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+
+from .fake_llm import make_fake_llm_server
+from .ingestion import HashingEmbedder
+from .synthetic_pdf import generate_pages, make_vocabulary
+
+# App server setups: the sync view on gthread (WSGI) workers and the async view on uvicorn (ASGI) workers
+PATHS = {
+    "wsgi": {
+        "endpoint": "/query/",
+        "args": ["elevate.wsgi", "--worker-class", "gthread"],
+        "requires": ("gunicorn",),
+    },
+    "asgi": {
+        "endpoint": "/query/async/",
+        "args": ["elevate.asgi:application", "--worker-class", "uvicorn_worker.UvicornWorker"],
+        "requires": ("gunicorn", "uvicorn_worker"),
+    },
+}
+MODES = ("json", "stream")
+NAMESPACE = "bench"
+BENCH_USER_EMAIL = "bench@example.com"
+
+
+def create_bench_user():
+    """Create the benchmark user with the token in ``BENCH_TOKEN`` (run inside the app's settings)."""
+    from django.contrib.auth import get_user_model
+    from rest_framework.authtoken.models import Token
+
+    user = get_user_model().objects.create_user(email=BENCH_USER_EMAIL, name="Benchmark")
+    Token.objects.create(user=user, key=os.environ["BENCH_TOKEN"])
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve_in_thread(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _build_vector_store(root, embedder, pages, seed, log):
+    """Index a synthetic book into a ``LocalVectorBackend`` laid out like ``get_vector_backend``'s."""
+    from ..chatbot_core import INDEX_NAME, embedding_metadata, iter_document_chunks
+    from ..vector_backends import LocalVectorBackend
+
+    book = generate_pages(pages, toc_pages=0, index_pages=0, seed=seed)
+    docs = list(iter_document_chunks(
+        ((number, "\n".join(lines)) for number, lines in enumerate(book, start=1)),
+        {"source": "synthetic.pdf", "title": "synthetic"},
+    ))
+    backend = LocalVectorBackend(os.path.join(root, INDEX_NAME))
+    recorded = embedding_metadata(embedder)
+    for start in range(0, len(docs), 100):
+        batch = docs[start:start + 100]
+        contents = [doc["content"] for doc in batch]
+        backend.upsert(NAMESPACE, [doc["id"] for doc in batch], embedder.embed_documents(contents),
+                       contents, [{**doc["metadata"], **recorded} for doc in batch])
+    log(f"Indexed {len(docs)} chunks of a {pages}-page synthetic book")
+    return len(docs)
+
+
+def _manage(env, *args):
+    subprocess.run([sys.executable, "manage.py", *args], cwd=settings.BASE_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+class AppServer:
+    """A gunicorn process serving one of ``PATHS`` on a local port."""
+
+    def __init__(self, path, env, workers, threads, log_path):
+        self.path = path
+        self.port = _free_port()
+        self.log_path = log_path
+        command = [
+            sys.executable, "-m", "gunicorn", *PATHS[path]["args"],
+            "--bind", f"127.0.0.1:{self.port}", "--workers", str(workers), "--threads", str(threads),
+            "--graceful-timeout", "5",
+        ]
+        with open(log_path, "wb") as log_file:
+            # Started from the project root so gunicorn.conf.py applies, as in production
+            self.process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env,
+                                            stdout=log_file, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout=120.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.path} server exited with {self.process.returncode}:\n{self.log_tail()}")
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"{self.path} server didn't start within {timeout:.0f}s:\n{self.log_tail()}")
+
+    def log_tail(self, lines=20):
+        with open(self.log_path, "rb") as f:
+            return b"\n".join(f.read().splitlines()[-lines:]).decode("utf-8", "replace")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def _request(connection, endpoint, body, headers, stream):
+    """Send one query; returns ``(ok, latency, ttft)`` in seconds (``ttft`` only for streams)."""
+    start = time.perf_counter()
+    connection.request("POST", endpoint, body, headers)
+    response = connection.getresponse()
+    if not stream:
+        response.read()
+        return response.status == 200, time.perf_counter() - start, None
+    ttft, done = None, False
+    for line in response:
+        if ttft is None and line.startswith(b"event: token"):
+            ttft = time.perf_counter() - start
+        elif line.startswith(b"event: done"):
+            done = True
+    return response.status == 200 and done, time.perf_counter() - start, ttft
+
+
+def _percentiles(seconds):
+    if not seconds:
+        return None
+    p50, p95, p99 = np.percentile(np.asarray(seconds) * 1000, [50, 95, 99])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2),
+            "mean": round(float(np.mean(seconds)) * 1000, 2)}
+
+
+def run_load(port, endpoint, token, concurrency, duration, stream, queries):
+    """Closed-loop load: ``concurrency`` clients each send their next query as soon as the last is answered.
+
+    Every client keeps one keep-alive connection and stops starting queries
+    after ``duration`` seconds. ``queries`` is a shared iterator of question
+    texts (unique questions keep the query and answer caches cold).
+    """
+    results = []
+    lock = threading.Lock()
+    headers = {"Content-Type": "application/json", "Authorization": f"Token {token}"}
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        while time.perf_counter() < stop_at:
+            with lock:
+                query = next(queries)
+            body = json.dumps({"course_id": NAMESPACE, "query": query, "stream": stream})
+            try:
+                result = _request(connection, endpoint, body, headers, stream)
+            except (OSError, http.client.HTTPException):
+                connection.close()  # Reconnects on the next request
+                result = (False, None, None)
+            results.append(result)
+        connection.close()
+
+    started = time.perf_counter()
+    stop_at = started + duration
+    clients = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    succeeded = [result for result in results if result[0]]
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(succeeded),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": len(succeeded) / elapsed,
+        "latency_ms": _percentiles([latency for _ok, latency, _ttft in succeeded]),
+        "ttft_ms": _percentiles([ttft for _ok, _latency, ttft in succeeded if ttft is not None]),
+    }
+
+
+def _questions(seed):
+    vocabulary = make_vocabulary(seed=seed)
+    for n in itertools.count():
+        words = [vocabulary[(n * step + offset) % len(vocabulary)] for step, offset in ((7, 1), (13, 5), (31, 11))]
+        yield f"What does the book say about {' and '.join(words)}? ({n})"
+
+
+def run_rag_load_benchmark(levels=(1, 8, 32), duration=10.0, warmup=3.0, paths=tuple(PATHS), modes=MODES,
+                           workers=2, threads=8, llm_latency=0.3, tokens_per_second=200.0, completion_tokens=64,
+                           vector_latency_ms=20.0, pages=50, seed=0, log=print):
+    """Load-test the chatbot query endpoints end to end, fully offline.
+
+    The real app runs in gunicorn processes against local stand-ins: a fake
+    Groq API (``fake_llm``), an embedding server with a ``HashingEmbedder``,
+    a ``LocalVectorBackend`` holding a synthetic book with
+    ``vector_latency_ms`` added per query in place of Pinecone's round trip,
+    and a temporary SQLite database with a benchmark user.
+
+    Args:
+        levels: Concurrency levels (simultaneous clients) to measure
+        duration: Seconds of load per level
+        warmup: Seconds of unrecorded load before each path and mode
+        paths: Subset of ``PATHS``: "wsgi" (``/query/`` on gthread workers) and/or
+            "asgi" (``/query/async/`` on uvicorn workers)
+        modes: Subset of ``MODES``: "json" answers and/or "stream"ed (SSE) answers
+        workers: gunicorn worker processes
+        threads: Threads per gthread worker (WSGI only)
+        llm_latency: Fake LLM seconds before the first token
+        tokens_per_second: Fake LLM generation speed
+        completion_tokens: Tokens in every fake answer
+        vector_latency_ms: Simulated vector store round trip
+        pages: Pages in the synthetic book
+        seed: Seed for the synthetic text and questions
+        log: Callable receiving progress lines
+
+    Returns:
+        Dict with the run configuration, environment and, per path and mode,
+        the results of each concurrency level.
+    """
+    from ..embedding_server import make_server
+    from ..embeddings import BatchingEmbedder
+
+    embedder = HashingEmbedder(settings.CHATBOT_EMBEDDING_DIMENSION or 1024, model_name=settings.CHATBOT_EMBEDDING_MODEL)
+    runs = {}
+
+    with tempfile.TemporaryDirectory(prefix="bench-rag-") as workdir:
+        chunks = _build_vector_store(os.path.join(workdir, "vector_store"), embedder, pages, seed, log)
+
+        socket_path = os.path.join(workdir, "embeddings.sock")
+        query_embedder = None
+        if settings.CHATBOT_QUERY_BATCH_MAX_SIZE > 1:
+            query_embedder = BatchingEmbedder(embedder, max_batch=settings.CHATBOT_QUERY_BATCH_MAX_SIZE,
+                                              max_wait=settings.CHATBOT_QUERY_BATCH_MAX_WAIT_MS / 1000)
+        embedding_server = _serve_in_thread(make_server(f"unix:{socket_path}", embedder,
+                                                        query_embedder=query_embedder))
+        llm_server = _serve_in_thread(make_fake_llm_server(
+            latency=llm_latency, tokens_per_second=tokens_per_second, completion_tokens=completion_tokens,
+        ))
+        token = secrets.token_hex(20)
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "user_extras.benchmarks.settings",
+            "BENCH_DATABASE_PATH": os.path.join(workdir, "db.sqlite3"),
+            "BENCH_TOKEN": token,
+            "CHATBOT_VECTOR_BACKEND": "local",
+            "CHATBOT_LOCAL_VECTOR_DIR": os.path.join(workdir, "vector_store"),
+            "CHATBOT_LOCAL_VECTOR_LATENCY_MS": str(vector_latency_ms),
+            "CHATBOT_EMBEDDING_SERVER": f"unix:{socket_path}",
+            "CHATBOT_EMBEDDING_SERVER_FALLBACK": "false",
+            "CHATBOT_PRELOAD_MODELS": "false",
+            "CHATBOT_ANSWER_CACHE_ENABLED": "false",
+            "CHATBOT_QUERY_LOG_LEVEL": "WARNING",
+            "GROQ_BASE_URL": f"http://127.0.0.1:{llm_server.server_address[1]}",
+            "GROQ_API_KEY": "bench",
+        }
+        try:
+            log("Creating the benchmark database...")
+            _manage(env, "migrate", "--noinput")
+            _manage(env, "shell", "-c",
+                    "from user_extras.benchmarks.rag_load import create_bench_user; create_bench_user()")
+
+            questions = _questions(seed)
+            for path in paths:
+                missing = [module for module in PATHS[path]["requires"] if importlib.util.find_spec(module) is None]
+                if missing:
+                    log(f"Skipping {path}: {', '.join(missing)} not installed")
+                    continue
+                log(f"Starting the {path} app server...")
+                server = AppServer(path, env, workers, threads, os.path.join(workdir, f"{path}.log"))
+                try:
+                    server.wait_ready()
+                    for mode in modes:
+                        stream = mode == "stream"
+                        endpoint = PATHS[path]["endpoint"]
+                        if warmup:
+                            run_load(server.port, endpoint, token, max(levels), warmup, stream, questions)
+                        runs[f"{path}-{mode}"] = []
+                        for concurrency in levels:
+                            log(f"{path} {mode}: {concurrency} concurrent clients for {duration:.0f}s...")
+                            runs[f"{path}-{mode}"].append(
+                                run_load(server.port, endpoint, token, concurrency, duration, stream, questions)
+                            )
+                finally:
+                    server.stop()
+        finally:
+            embedding_server.shutdown()
+            embedding_server.server_close()
+            llm_server.shutdown()
+            llm_server.server_close()
+
+    return {
+        "created_at": datetime.now().isoformat(),
+        "config": {
+            "levels": list(levels),
+            "duration": duration,
+            "warmup": warmup,
+            "workers": workers,
+            "threads": threads,
+            "llm_latency": llm_latency,
+            "tokens_per_second": tokens_per_second,
+            "completion_tokens": completion_tokens,
+            "vector_latency_ms": vector_latency_ms,
+            "pages": pages,
+            "chunks": chunks,
+            "seed": seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "runs": runs,
+    }
+
+
+def compare_results(current, baseline, tolerance=0.10):
+    """Compare two load benchmark results run by run and level by level.
+
+    Returns a list of ``(run, metric, baseline, current, change, regressed)``
+    rows for throughput and p95 latency; a row has regressed when it got worse
+    (less throughput, more latency) by more than ``tolerance``.
+    """
+    rows = []
+    for run, levels in current["runs"].items():
+        base_levels = {level["concurrency"]: level for level in baseline.get("runs", {}).get(run, [])}
+        for level in levels:
+            base = base_levels.get(level["concurrency"])
+            if not base:
+                continue
+            label = f"{run}@{level['concurrency']}"
+            if base["requests_per_second"]:
+                change = level["requests_per_second"] / base["requests_per_second"] - 1.0
+                rows.append((label, "requests_per_second", base["requests_per_second"],
+                             level["requests_per_second"], change, change < -tolerance))
+            if base["latency_ms"] and level["latency_ms"]:
+                change = level["latency_ms"]["p95"] / base["latency_ms"]["p95"] - 1.0
+                rows.append((label, "latency_p95_ms", base["latency_ms"]["p95"],
+                             level["latency_ms"]["p95"], change, change > tolerance))
+    return rows
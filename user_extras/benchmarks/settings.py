@@ -0,0 +1,17 @@
+"""Settings for the app servers started by ``bench_rag_load``.
+
+The project's settings with a throwaway SQLite database (``BENCH_DATABASE_PATH``),
+so a load test never touches the real database.
+"""
+import os
+
+from elevate.settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ["BENCH_DATABASE_PATH"],
+    }
+}
@@ -0,0 +1,96 @@
+import random
+import string
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_vocabulary(size=5000, seed=0):
+    """Deterministic list of pseudo-words with English-like lengths."""
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 10)))
+        for _ in range(size)
+    ]
+
+
+def generate_pages(num_pages, lines_per_page=45, words_per_line=12, toc_pages=2, index_pages=2, seed=0):
+    """Build the text lines of a synthetic book.
+
+    The first ``toc_pages`` pages look like a table of contents and the last
+    ``index_pages`` like an index, so the page classifier has work to do.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(seed=seed)
+    pages = []
+    for page_num in range(num_pages):
+        if page_num < toc_pages:
+            lines = ["Table of Contents"] + [
+                f"Chapter {i} {rng.choice(vocabulary).title()} ........ {i * 10}"
+                for i in range(1, lines_per_page)
+            ]
+        elif page_num >= num_pages - index_pages:
+            lines = ["Index"] + [
+                f"{rng.choice(vocabulary)}, {rng.randint(1, num_pages)}, {rng.randint(1, num_pages)}"
+                for _ in range(lines_per_page - 1)
+            ]
+        else:
+            lines = []
+            for _ in range(lines_per_page):
+                words = [rng.choice(vocabulary) for _ in range(words_per_line)]
+                words[0] = words[0].capitalize()
+                lines.append(" ".join(words) + rng.choice([".", ",", ";", ""]))
+            lines.append(str(page_num + 1))  # Page number footer
+        pages.append(lines)
+    return pages
+
+
+def write_pdf(path, pages, font_size=10):
+    """Write ``pages`` (lists of text lines) as a minimal, valid PDF file.
+
+    Uses only the standard Helvetica font, so no third-party PDF writer is needed.
+    """
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    # Pages tree object comes after every content and page object
+    pages_id = len(objects) + 2 * len(pages) + 1
+    page_ids = []
+    leading = font_size + 2
+    for lines in pages:
+        operators = " ".join(f"({_escape(line)}) '" for line in lines)
+        content = f"BT /F1 {font_size} Tf {leading} TL 50 780 Td {operators} ET".encode("latin-1", "replace")
+        content_id = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font_id, content_id)
+        ))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids)))
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog_id, xref_offset,
+    )
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def make_synthetic_pdf(path, num_pages, lines_per_page=45, words_per_line=12, seed=0):
+    """Generate a synthetic book PDF at ``path``."""
+    write_pdf(path, generate_pages(num_pages, lines_per_page, words_per_line, seed=seed))
+    return path
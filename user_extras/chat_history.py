@@ -0,0 +1,57 @@
+from django.db import DatabaseError
+
+from .models import ChatMessage
+
+
+def _turn_messages(user, course_id, question, answer):
+    return [
+        ChatMessage(user=user, course_id=course_id, content=question, is_from_user=True),
+        ChatMessage(user=user, course_id=course_id, content=answer, is_from_user=False),
+    ]
+
+
+def save_chat_turn(user, course_id, question, answer):
+    """Store a question and the chatbot's answer with a single INSERT.
+
+    Returns ``{'user': id, 'bot': id}``, or ``{'error': ...}`` if the write
+    failed (e.g. an unknown course), so the answer itself is never lost.
+    """
+    try:
+        question_message, answer_message = ChatMessage.objects.bulk_create(
+            _turn_messages(user, course_id, question, answer)
+        )
+    except (DatabaseError, ValueError) as e:
+        print(f"❌ Could not save chat turn for course {course_id}: {e}")
+        return {'error': str(e)}
+    return {'user': question_message.id, 'bot': answer_message.id}
+
+
+async def asave_chat_turn(user, course_id, question, answer):
+    """Async ``save_chat_turn``."""
+    try:
+        question_message, answer_message = await ChatMessage.objects.abulk_create(
+            _turn_messages(user, course_id, question, answer)
+        )
+    except (DatabaseError, ValueError) as e:
+        print(f"❌ Could not save chat turn for course {course_id}: {e}")
+        return {'error': str(e)}
+    return {'user': question_message.id, 'bot': answer_message.id}
+
+
+def call_after_response(response, func, *args):
+    """Run ``func(*args)`` once ``response`` has been sent to the client.
+
+    The WSGI server (or Django's ASGI handler) calls ``response.close()``
+    after the last byte is written; ``func`` runs just before the original
+    ``close``, while the request's database connection is still open.
+    """
+    close = response.close
+
+    def close_after_call():
+        try:
+            func(*args)
+        finally:
+            close()
+
+    response.close = close_after_call
+    return response
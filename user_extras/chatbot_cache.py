@@ -0,0 +1,220 @@
+import hashlib
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from django.core.cache import caches
+
+from .models import AnswerCacheGeneration
+
+
+def normalize_query(text):
+    """Normalize a query so trivially different spellings share a cache entry."""
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU cache of query vectors with per-entry expiry.
+
+    Entries are keyed by (model name, normalized query). When ``shared_alias``
+    names a Django cache (e.g. Redis or Memcached), misses in the local LRU fall
+    through to it so every gunicorn worker benefits from vectors computed by
+    the others.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600, shared_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self._entries = OrderedDict()  # key -> (expires_at, vector)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query, model_name):
+        digest = hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+        return f"query-embedding:{model_name}:{digest}"
+
+    def get(self, query, model_name):
+        """Return the cached vector for ``query`` or None."""
+        key = self.make_key(query, model_name)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, vector = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+
+        if self.shared_alias:
+            raw = caches[self.shared_alias].get(key)
+            if raw is not None:
+                vector = np.frombuffer(raw, dtype=np.float32)
+                self._store_local(key, vector)
+                with self._lock:
+                    self.shared_hits += 1
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, query, model_name, vector):
+        """Cache ``vector`` for ``query`` locally and in the shared backend."""
+        key = self.make_key(query, model_name)
+        vector = np.asarray(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        self._store_local(key, vector)
+        if self.shared_alias:
+            caches[self.shared_alias].set(key, vector.tobytes(), timeout=self.ttl)
+        return vector
+
+    def get_or_compute(self, query, model_name, compute):
+        """Return the cached vector, calling ``compute(query)`` on a miss."""
+        vector = self.get(query, model_name)
+        if vector is None:
+            vector = self.set(query, model_name, compute(query))
+        return vector
+
+    def _store_local(self, key, vector):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the current size of the local cache."""
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+
+class _NamespaceAnswers:
+    """Fixed-capacity ring buffer of (unit query vector, answer) pairs."""
+
+    def __init__(self, capacity, dim, generation):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.expires_at = np.zeros(capacity, dtype=np.float64)
+        self.answers = [None] * capacity
+        self.count = 0
+        self.next_slot = 0
+        self.generation = generation
+
+
+class SemanticAnswerCache:
+    """Cache of chatbot answers looked up by query-embedding similarity.
+
+    A stored answer is returned when a new query's embedding has cosine
+    similarity >= ``threshold`` with a cached query in the same namespace.
+    Entries live in this process; invalidation goes through a per-namespace
+    generation kept in the database (``AnswerCacheGeneration``), so
+    re-ingesting or deleting a namespace clears the cached answers in every
+    worker. Each process re-reads a namespace's generation at most every
+    ``generation_ttl`` seconds, which bounds how long other workers may still
+    serve answers of the previous version.
+    """
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=512, generation_ttl=5.0):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.generation_ttl = generation_ttl
+        self._namespaces = {}
+        self._generations = {}  # namespace -> (checked_until, generation)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _generation(self, namespace):
+        now = time.monotonic()
+        with self._lock:
+            known = self._generations.get(namespace)
+        if known is not None and known[0] > now:
+            return known[1]
+        generation = (AnswerCacheGeneration.objects.filter(namespace=namespace)
+                      .values_list("generation", flat=True).first())
+        with self._lock:
+            self._generations[namespace] = (now + self.generation_ttl, generation)
+        return generation
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, namespace, query_vector):
+        """Return the cached answer for a similar query in ``namespace`` or None."""
+        generation = self._generation(namespace)
+        query_vector = self._unit(query_vector)
+        with self._lock:
+            entries = self._namespaces.get(namespace)
+            if entries is None or entries.generation != generation:
+                self._namespaces.pop(namespace, None)
+                self.misses += 1
+                return None
+
+            scores = entries.vectors[:entries.count] @ query_vector
+            scores[entries.expires_at[:entries.count] <= time.monotonic()] = -1.0
+            best = int(np.argmax(scores)) if entries.count else -1
+            if best < 0 or scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entries.answers[best]
+
+    def store(self, namespace, query_vector, answer):
+        """Remember ``answer`` for ``query_vector`` in ``namespace``."""
+        generation = self._generation(namespace)
+        query_vector = self._unit(query_vector)
+        with self._lock:
+            entries = self._namespaces.get(namespace)
+            if entries is None or entries.generation != generation:
+                entries = _NamespaceAnswers(self.max_entries, query_vector.shape[0], generation)
+                self._namespaces[namespace] = entries
+
+            slot = entries.next_slot
+            entries.vectors[slot] = query_vector
+            entries.expires_at[slot] = time.monotonic() + self.ttl
+            entries.answers[slot] = answer
+            entries.next_slot = (slot + 1) % self.max_entries
+            entries.count = min(entries.count + 1, self.max_entries)
+
+    def invalidate(self, namespace):
+        """Drop every cached answer for ``namespace`` (in all workers)."""
+        AnswerCacheGeneration.objects.update_or_create(namespace=namespace, defaults={"generation": uuid.uuid4()})
+        with self._lock:
+            self._namespaces.pop(namespace, None)
+            self._generations.pop(namespace, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "namespaces": len(self._namespaces),
+                "entries": sum(entries.count for entries in self._namespaces.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
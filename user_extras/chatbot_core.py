@@ -1,59 +1,224 @@
 import os
-import re
-import json
+import asyncio
 import time
-import uuid
+import hashlib
+import heapq
+import functools
+import itertools
+import multiprocessing
+import weakref
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 from tqdm import tqdm
 import PyPDF2
-import numpy as np
-from langchain_core.documents import Document as LangChainDocument
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from pinecone import Pinecone, ServerlessSpec
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_pinecone import PineconeVectorStore
 from datetime import datetime
+from .embeddings import get_embedder, get_query_embedder, preload_embedders
+from .chatbot_cache import QueryEmbeddingCache, SemanticAnswerCache
+from .vector_backends import PineconeVectorBackend, LocalVectorBackend, EmbeddingMismatchError
+from .query_metrics import span, count
+from .ingestion import hash_file, normalize_namespace, record_ingestion
+from .models import IngestedBook
+from .llm_resilience import CircuitBreaker, ResilientCaller, RetryBudget, current_deadline, is_retryable
+from .pdf_extraction import iter_page_texts, extract_page_range
 from dotenv import load_dotenv
+from django.conf import settings
 
 load_dotenv()
 
 # Configuration
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")  # Replace with your Pinecone API key
 PINECONE_ENVIRONMENT = "us-east-1"  # Use your Pinecone environment
-INDEX_NAME = "english-book-index"
+INDEX_NAME = settings.CHATBOT_INDEX_NAME
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
-HF_MODEL_NAME = "BAAI/bge-large-en-v1.5"  # A good model for English text
+HF_MODEL_NAME = settings.CHATBOT_EMBEDDING_MODEL  # bge-large-en-v1.5 by default
+# Vectors stored before the model was recorded in their metadata came from this model
+UNRECORDED_EMBEDDING = ("BAAI/bge-large-en-v1.5", 1024)
 DEFAULT_NAMESPACE = "default"  # Default namespace for general use
 
-# Initialize Pinecone
-pc = Pinecone(api_key=PINECONE_API_KEY)
+@functools.lru_cache(maxsize=None)
+def get_pinecone_client():
+    """Pinecone client, created on first use (ingestion or a Pinecone-backed query)."""
+    from pinecone import Pinecone
+    return Pinecone(api_key=PINECONE_API_KEY)
+
+# Vector-store backends, one per (backend, index name), selected by CHATBOT_VECTOR_BACKEND
+_vector_backends = {}
+
+def get_vector_backend(index_name=INDEX_NAME):
+    """Return the configured vector-store backend for ``index_name``."""
+    backend_name = settings.CHATBOT_VECTOR_BACKEND
+    key = (backend_name, index_name)
+    backend = _vector_backends.get(key)
+    if backend is None:
+        if backend_name == "pinecone":
+            backend = PineconeVectorBackend(
+                get_pinecone_client(), index_name, region=PINECONE_ENVIRONMENT,
+                metadata_ttl=settings.CHATBOT_INDEX_METADATA_TTL,
+                pool_threads=settings.CHATBOT_PINECONE_POOL_THREADS,
+                pool_maxsize=settings.CHATBOT_PINECONE_POOL_MAXSIZE,
+            )
+        elif backend_name == "local":
+            backend = LocalVectorBackend(
+                os.path.join(settings.CHATBOT_LOCAL_VECTOR_DIR, index_name),
+                dtype=settings.CHATBOT_LOCAL_VECTOR_DTYPE,
+                ann_threshold=settings.CHATBOT_LOCAL_ANN_THRESHOLD,
+                nprobe=settings.CHATBOT_LOCAL_ANN_NPROBE,
+                latency=settings.CHATBOT_LOCAL_VECTOR_LATENCY_MS / 1000,
+            )
+        else:
+            raise ValueError(f"Unknown CHATBOT_VECTOR_BACKEND: {backend_name!r}")
+        _vector_backends[key] = backend
+    return backend
+
+# Cache of query vectors so repeated questions skip the embedding forward pass
+query_embedding_cache = QueryEmbeddingCache(
+    max_size=settings.CHATBOT_QUERY_CACHE_SIZE,
+    ttl=settings.CHATBOT_QUERY_CACHE_TTL,
+    shared_alias=settings.CHATBOT_QUERY_CACHE_ALIAS,
+)
+
+# Answers reused for near-identical questions within a namespace; invalidated on
+# re-ingest (process_pdf_book) and deletion (delete_namespace)
+answer_cache = SemanticAnswerCache(
+    threshold=settings.CHATBOT_ANSWER_CACHE_THRESHOLD,
+    ttl=settings.CHATBOT_ANSWER_CACHE_TTL,
+    max_entries=settings.CHATBOT_ANSWER_CACHE_SIZE,
+    generation_ttl=settings.CHATBOT_ANSWER_CACHE_GENERATION_TTL,
+)
 
 
-from groq import Groq
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-# Initialize the Groq client
-client = Groq(
-    api_key=GROQ_API_KEY  # Replace with your actual API key
+# Timeouts and retries are applied per call by ``llm_caller``, so the SDK's own retries are off
+@functools.lru_cache(maxsize=None)
+def get_groq_client():
+    """Groq client, created on the first LLM call."""
+    from groq import Groq
+    return Groq(api_key=GROQ_API_KEY, max_retries=0, timeout=settings.CHATBOT_LLM_TIMEOUT)
+
+_async_groq_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncGroq
+
+def get_async_groq_client():
+    """Async Groq client for the ASGI query path, one per event loop.
+
+    Its connection pool belongs to the loop that created it, so a client is
+    never shared with another loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_groq_clients.get(loop)
+    if client is None:
+        from groq import AsyncGroq
+        client = AsyncGroq(api_key=GROQ_API_KEY, max_retries=0, timeout=settings.CHATBOT_LLM_TIMEOUT)
+        _async_groq_clients[loop] = client
+    return client
+
+# Every Groq call goes through this: bounded by the request deadline, retried within
+# the retry budget, optionally hedged, and refused while the circuit breaker is open
+llm_caller = ResilientCaller(
+    breaker=CircuitBreaker(
+        "Groq",
+        failure_rate=settings.CHATBOT_LLM_BREAKER_FAILURE_RATE,
+        min_calls=settings.CHATBOT_LLM_BREAKER_MIN_CALLS,
+        window=settings.CHATBOT_LLM_BREAKER_WINDOW,
+        cooldown=settings.CHATBOT_LLM_BREAKER_COOLDOWN,
+    ),
+    budget=RetryBudget(ratio=settings.CHATBOT_LLM_RETRY_BUDGET, burst=settings.CHATBOT_LLM_RETRY_BURST),
+    attempts=settings.CHATBOT_LLM_ATTEMPTS,
+    timeout=settings.CHATBOT_LLM_TIMEOUT,
+    hedge_after=settings.CHATBOT_LLM_HEDGE_AFTER,
+    hedge_workers=settings.CHATBOT_LLM_HEDGE_WORKERS,
 )
 
+LLM_MODEL_NAME = "openai/gpt-oss-20b"
+
+def _llm_messages(question):
+    prompt = f"Question: {question}"
+    return [
+        {"role": "user", "content": prompt}
+    ]
+
+def _record_usage(usage):
+    """Add a completion's token usage to the current request's counters."""
+    if usage is not None:
+        count("prompt_tokens", usage.prompt_tokens or 0)
+        count("completion_tokens", usage.completion_tokens or 0)
+
+def _stream_usage(chunk):
+    # Groq reports usage on the last chunk, under ``x_groq``
+    x_groq = getattr(chunk, "x_groq", None)
+    return getattr(chunk, "usage", None) or getattr(x_groq, "usage", None)
+
 # LLM function using Groq API
 def llm( question):
     """Simulate the HuggingFacePipeline using Groq API."""
-    prompt = f"Question: {question}"
-    response = client.chat.completions.create(
-        messages=[
-            {"role": "user", "content": prompt}
-        ],
-        model="openai/gpt-oss-20b",
-    )
+    response = llm_caller.call(lambda timeout: get_groq_client().chat.completions.create(
+        messages=_llm_messages(question),
+        model=LLM_MODEL_NAME,
+        timeout=timeout,
+    ))
+    _record_usage(response.usage)
     # Extract and return the content from the Groq API response
     return response.choices[0].message.content  # Adjust based on Groq's API response format
 
+def llm_stream(questions):
+    """Streaming counterpart of ``llm``: yield completion tokens as Groq sends them.
+
+    Takes an iterator of inputs (as ``RunnableGenerator`` passes them) and makes
+    one streamed completion for the assembled prompt. Opening the stream is
+    retried like ``llm`` but not hedged; once tokens flow, the request deadline
+    is checked between chunks.
+    """
+    question = None
+    for question in questions:
+        pass  # The prompt arrives as a single, complete value
+    stream = llm_caller.call(lambda timeout: get_groq_client().chat.completions.create(
+        messages=_llm_messages(question),
+        model=LLM_MODEL_NAME,
+        stream=True,
+        timeout=timeout,
+    ), hedge=False)
+    deadline = current_deadline()
+    for chunk in stream:
+        deadline.check()
+        _record_usage(_stream_usage(chunk))
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def allm(question):
+    """Async ``llm`` using the async Groq client."""
+    response = await llm_caller.acall(lambda timeout: get_async_groq_client().chat.completions.create(
+        messages=_llm_messages(question),
+        model=LLM_MODEL_NAME,
+        timeout=timeout,
+    ))
+    _record_usage(response.usage)
+    return response.choices[0].message.content
+
+async def allm_stream(questions):
+    """Async ``llm_stream`` using the async Groq client."""
+    question = None
+    async for question in questions:
+        pass
+    stream = await llm_caller.acall(lambda timeout: get_async_groq_client().chat.completions.create(
+        messages=_llm_messages(question),
+        model=LLM_MODEL_NAME,
+        stream=True,
+        timeout=timeout,
+    ), hedge=False)
+    deadline = current_deadline()
+    async for chunk in stream:
+        deadline.check()
+        _record_usage(_stream_usage(chunk))
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
 # memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
 # Prompt template
 prompt_template = """
@@ -78,212 +243,512 @@ prompt = PromptTemplate(
 )
 
 
-llm_chain = prompt | llm | StrOutputParser()
-
-def clean_text(text):
-    """Clean and preprocess English text by removing irrelevant content."""
-    # Remove page numbers
-    text = re.sub(r'\n\s*\d+\s*\n', '\n', text)
-
-    # Remove headers and footers (common patterns in books)
-    text = re.sub(r'\n\s*[A-Z\s]+\s*\n', '\n', text)
-
-    # Remove references to index, table of contents sections
-    text = re.sub(r'(?i)index\s+\d+', '', text)
-    text = re.sub(r'(?i)table\s+of\s+contents', '', text)
-
-    # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text)
-    text = re.sub(r'\n\s*\n', '\n\n', text)
-
-    # Remove non-alphabetic characters except punctuation
-    text = re.sub(r'[^\w\s.,;:!?\'"-]', '', text)
-
-    return text.strip()
+# ``ainvoke``/``astream`` use the native async Groq calls instead of a thread
+llm_chain = prompt | RunnableLambda(llm, afunc=allm) | StrOutputParser()
 
-def is_likely_index_or_toc(text):
-    """Detect if a page is likely an index or table of contents."""
-    # Check for patterns that suggest index or TOC
-    if re.search(r'(?i)index|contents|appendix', text):
-        return True
+# Same chain with a streaming LLM step: ``llm_stream_chain.stream(inputs)`` yields tokens
+llm_stream_chain = prompt | RunnableGenerator(llm_stream, allm_stream) | StrOutputParser()
 
-    # Check for patterns like "Topic........123" which are common in TOCs
-    if re.search(r'\w+\s*\.{3,}\s*\d+', text):
-        return True
+def preload_models():
+    """Load the embedding model(s) used by search and ingest into this process."""
+    preload_embedders([HF_MODEL_NAME])
 
-    # Check for dense number patterns typical in indexes
-    if len(re.findall(r'\d+', text)) > len(text.split()) / 5:  # If >20% of tokens are numbers
-        return True
+def track_progress(iterable, total, stage, progress=None, done_field=None, total_field=None):
+    """Iterate with a tqdm bar and report its counters to ``progress``.
 
-    return False
-
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF file excluding index and table of contents."""
+    After each item ``progress`` is called as
+    ``progress(stage, **{done_field: bar.n, total_field: total})``; the total is
+    left out when it is not known up front.
+    """
+    def report(done):
+        counters = {done_field: done}
+        if total is not None:
+            counters[total_field] = total
+        progress(stage, **counters)
+
+    with tqdm(total=total, desc=stage) as bar:
+        if progress:
+            report(0)
+        for item in iterable:
+            yield item
+            bar.update(1)
+            if progress:
+                report(bar.n)
+
+def _iter_page_texts_parallel(pdf_path, num_pages, workers, shard_pages):
+    """Extract page shards in a process pool, yielding pages back in page order."""
+    # Spawned (not forked) workers: the parent may hold model weights, DB
+    # connections and threads that must not be duplicated into children
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [
+            pool.submit(extract_page_range, pdf_path, start, min(start + shard_pages, num_pages))
+            for start in range(0, num_pages, shard_pages)
+        ]
+        for future in futures:
+            yield from future.result()
+
+def iter_pdf_pages(pdf_path, skipped_pages=None, progress=None, workers=None):
+    """Yield ``(page_number, cleaned_text)`` for each PDF page worth indexing.
+
+    Pages are read and cleaned one at a time, so the book is never held in
+    memory as a single string. With ``workers`` > 1 (default
+    ``CHATBOT_PDF_WORKERS``) page ranges are extracted in parallel processes
+    and merged back in page order. Page numbers of skipped index/TOC/empty
+    pages are appended to ``skipped_pages`` when a list is given.
+    """
     print(f"Extracting text from {pdf_path}...")
 
     pdf_reader = PyPDF2.PdfReader(pdf_path)
     num_pages = len(pdf_reader.pages)
+    if skipped_pages is None:
+        skipped_pages = []
+    if workers is None:
+        workers = settings.CHATBOT_PDF_WORKERS
+    workers = min(workers, os.cpu_count() or 1)
+    shard_pages = settings.CHATBOT_PDF_SHARD_PAGES
+
+    if workers > 1 and num_pages > shard_pages:
+        print(f"Extracting {num_pages} pages with {workers} worker processes...")
+        page_texts = _iter_page_texts_parallel(pdf_path, num_pages, workers, shard_pages)
+    else:
+        page_texts = iter_page_texts(pdf_reader, 0, num_pages)
+
+    for page_number, cleaned in track_progress(page_texts, num_pages, "extracting", progress,
+                                               done_field="pages_extracted", total_field="pages_total"):
+        if cleaned is None:
+            skipped_pages.append(page_number)
+        elif cleaned:
+            yield page_number, cleaned
 
-    full_text = ""
-    skipped_pages = []
+    print(f"Skipped {len(skipped_pages)} pages that appear to be index/TOC/irrelevant")
 
-    for page_num in tqdm(range(num_pages)):
-        page = pdf_reader.pages[page_num]
-        text = page.extract_text()
+def extract_text_from_pdf(pdf_path, progress=None):
+    """Extract text from PDF file excluding index and table of contents."""
+    return " ".join(text for _page_number, text in iter_pdf_pages(pdf_path, progress=progress))
 
-        if text and not is_likely_index_or_toc(text):
-            full_text += text + "\n\n"
-        else:
-            skipped_pages.append(page_num + 1)
+def _make_splitter(chunk_size, chunk_overlap, add_start_index=False):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", " ", ""],
+        add_start_index=add_start_index,
+    )
 
-    print(f"Skipped {len(skipped_pages)} pages that appear to be index/TOC/irrelevant")
+def chunk_id(content):
+    """Content-addressed chunk id: unchanged text keeps its id across re-uploads."""
+    return f"chunk-{hashlib.sha256(content.encode('utf-8')).hexdigest()[:32]}"
 
-    return clean_text(full_text)
+def _make_chunk(chunk, i, metadata):
+    return {
+        "id": chunk_id(chunk),
+        "content": chunk,
+        "metadata": {**metadata, "chunk": i}
+    }
 
 def split_document(text, metadata, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
     """Split document into chunks."""
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        separators=["\n\n", "\n", " ", ""]
-    )
+    splitter = _make_splitter(chunk_size, chunk_overlap)
 
     chunks = splitter.split_text(text)
     docs = []
 
     for i, chunk in enumerate(chunks):
         if len(chunk.strip()) > 50:  # Only keep chunks with substantial content
-            docs.append({
-                "id": f"{metadata['title']}-chunk-{i}",
-                "content": chunk,
-                "metadata": {**metadata, "chunk": i}
-            })
+            docs.append(_make_chunk(chunk, i, metadata))
 
     return docs
 
-def embed_documents_in_pinecone(docs, index_name, namespace=None):
-    """Embed documents in Pinecone using dense vector embeddings.
+def iter_document_chunks(pages, metadata, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Incrementally split a stream of ``(page_number, text)`` into chunk dicts.
+
+    Each page is split on its own, prefixed with the last ``chunk_overlap``
+    characters of the previous page so the overlap carries across page
+    boundaries. Anchoring chunk boundaries at page starts means an edit on one
+    page changes only that page's chunks (and the next page's first chunk),
+    which keeps content-addressed ids stable for delta re-ingestion. Each
+    chunk's metadata records the pages it starts and ends on.
+    """
+    splitter = _make_splitter(chunk_size, chunk_overlap, add_start_index=True)
+    tail = ""
+    tail_page = None
+    i = 0
+
+    for page_number, text in pages:
+        buffer = f"{tail} {text}" if tail else text
+        text_start = len(tail) + 1 if tail else 0
+
+        for piece in splitter.create_documents([buffer]):
+            if len(piece.page_content.strip()) > 50:  # Only keep chunks with substantial content
+                start = piece.metadata["start_index"]
+                chunk = _make_chunk(piece.page_content, i, metadata)
+                chunk["metadata"]["page_start"] = tail_page if start < text_start else page_number
+                chunk["metadata"]["page_end"] = page_number
+                yield chunk
+            i += 1
+
+        # Carry the end of this page (cut at a word boundary) into the next one
+        tail = text[-chunk_overlap:] if chunk_overlap else ""
+        if len(text) > chunk_overlap and " " in tail:
+            tail = tail.split(" ", 1)[1]
+        tail_page = page_number
+
+def iter_batches(iterable, batch_size):
+    """Group an iterable into lists of at most ``batch_size`` items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def get_namespace_manifest(namespace, index_name=INDEX_NAME):
+    """Return the set of chunk ids currently stored in ``namespace``."""
+    return set(get_vector_backend(index_name).list_ids(normalize_namespace(namespace)))
+
+@retry(
+    stop=stop_after_attempt(settings.CHATBOT_UPSERT_ATTEMPTS),
+    wait=wait_exponential_jitter(initial=1, max=30),
+    retry=retry_if_exception(is_retryable),
+    reraise=True,
+)
+def _upsert_batch(vector_backend, namespace, ids, vectors, texts, metadatas):
+    """Upsert one embedded batch, retrying transient failures (network, 429, 5xx) with the same vectors."""
+    vector_backend.upsert(namespace, ids, vectors, texts, metadatas)
+
+def embed_documents_in_pinecone(docs, index_name, namespace=None, progress=None, batch_size=None,
+                                upsert_workers=None, embedder=None, vector_backend=None):
+    """Embed documents into the configured vector store (Pinecone by default).
+
+    Embedding and upserting are pipelined: this thread embeds batch after
+    batch while a pool of ``upsert_workers`` threads sends finished batches
+    to the vector store. At most ``CHATBOT_UPSERT_MAX_PENDING`` embedded
+    batches wait for upload at any time, which bounds memory, and a failed
+    upsert is retried without embedding the batch again.
 
     Args:
-        docs: List of document dictionaries
+        docs: List or iterator of document dictionaries; an iterator is consumed
+            batch by batch, so embedding starts before it is exhausted
         index_name: Name of the Pinecone index
         namespace: Optional namespace for organizing documents (e.g., by book title)
+        progress: Optional callback receiving the stage name and progress counters
+        batch_size: Number of chunks embedded and upserted together
+            (default ``CHATBOT_EMBED_BATCH_SIZE``)
+        upsert_workers: Number of concurrent upserts (default ``CHATBOT_UPSERT_WORKERS``)
+        embedder: Embedder to use instead of the shared ``HF_MODEL_NAME`` model
+        vector_backend: Backend to write to instead of ``get_vector_backend(index_name)``
     """
+    batch_size = batch_size or settings.CHATBOT_EMBED_BATCH_SIZE
+    upsert_workers = upsert_workers or settings.CHATBOT_UPSERT_WORKERS
+    max_pending = max(settings.CHATBOT_UPSERT_MAX_PENDING, upsert_workers)
+
+    docs_iter = iter(docs)
+    first_doc = next(docs_iter, None)
+    if first_doc is not None:
+        docs_iter = itertools.chain([first_doc], docs_iter)
+
     # Use book title as namespace if not provided
     if namespace is None:
         # Try to get the title from the first document's metadata
-        if docs and 'metadata' in docs[0] and 'title' in docs[0]['metadata']:
-            namespace = docs[0]['metadata']['title']
+        if first_doc and 'metadata' in first_doc and 'title' in first_doc['metadata']:
+            namespace = first_doc['metadata']['title']
         else:
             # Use default namespace with timestamp for uniqueness
             namespace = f"{DEFAULT_NAMESPACE}-{int(time.time())}"
 
-    namespace = namespace.lower().replace(" ", "-")[:63]  # Ensure namespace is valid for Pinecone
+    namespace = normalize_namespace(namespace)
     print(f"Using namespace: {namespace}")
 
-    # Check if index exists, otherwise create it
-    existing_indexes = [index_info["name"] for index_info in pc.list_indexes()]
-
-    if index_name not in existing_indexes:
-        print(f"Creating new Pinecone index: {index_name}")
-        pc.create_index(
-            name=index_name,
-            dimension=1024,  # Dimension size for BAAI/bge-large-en-v1.5
-            metric="cosine",  # Changed from dotproduct to cosine for better similarity
-            spec=ServerlessSpec(cloud="aws", region=PINECONE_ENVIRONMENT),
-        )
-
-        # Wait for index to be ready
-        while not pc.describe_index(index_name).status["ready"]:
-            time.sleep(1)
-
-    # Initialize HuggingFace embeddings
-    embedder = HuggingFaceEmbeddings(model_name=HF_MODEL_NAME)
-
-    # Initialize Pinecone index
-    index = pc.Index(index_name)
-
-    # Extract content and metadata
-    all_chunks = [doc["content"] for doc in docs]
-    all_metadatas = [doc["metadata"] for doc in docs]
-    all_ids = [doc["id"] for doc in docs]
-
-    print(f"Embedding {len(all_chunks)} chunks into Pinecone namespace '{namespace}'...")
-
-    # Create PineconeVectorStore with text_key to match data format
-    vectorstore = PineconeVectorStore(
-        index=index,
-        embedding=embedder,
-        namespace=namespace,
-        text_key="content"  # Store text in 'content' field for consistency
-    )
-
-    # Add texts in batches to avoid memory issues
-    batch_size = 100
-    for i in tqdm(range(0, len(all_chunks), batch_size)):
-        end_idx = min(i + batch_size, len(all_chunks))
-        batch_chunks = all_chunks[i:end_idx]
-        batch_metadata = all_metadatas[i:end_idx]
-        batch_ids = all_ids[i:end_idx]
-
-        vectorstore.add_texts(
-            texts=batch_chunks,
-            metadatas=batch_metadata,
-            ids=batch_ids
-        )
+    if vector_backend is None:
+        vector_backend = get_vector_backend(index_name)
+
+    total_chunks = len(docs) if isinstance(docs, (list, tuple)) else None
+    total_batches = -(-total_chunks // batch_size) if total_chunks is not None else None
+    print(f"Embedding {total_chunks if total_chunks is not None else 'streamed'} chunks into namespace '{namespace}'...")
+
+    recorded = None
+    chunks_embedded = 0
+    batches_upserted = 0
+    pending = deque()  # upsert futures, oldest first
+
+    def report(stage, **counters):
+        if progress:
+            if total_chunks is not None:
+                counters.update(chunks_total=total_chunks, batches_total=total_batches)
+            progress(stage, **counters)
+
+    def collect(block):
+        """Wait for finished upserts (the oldest one at least, if ``block``)."""
+        nonlocal batches_upserted
+        while pending and (block or pending[0].done()):
+            pending.popleft().result()  # Re-raises once retries are exhausted
+            batches_upserted += 1
+            block = False
+            upsert_bar.update(1)
+            report("upserting", batches_upserted=batches_upserted)
+
+    with ThreadPoolExecutor(max_workers=upsert_workers, thread_name_prefix="upsert") as pool, \
+            tqdm(total=total_chunks, desc="embedding") as embed_bar, \
+            tqdm(total=total_batches, desc="upserting") as upsert_bar:
+        try:
+            for batch in iter_batches(docs_iter, batch_size):
+                if recorded is None:
+                    # Reuse the process-wide embedder (loaded only if there is work), and
+                    # create the index, or check its dimension, before the first upsert
+                    embedder = embedder or get_embedder(HF_MODEL_NAME)
+                    vector_backend.ensure_index(embedder.dimension)
+                    recorded = embedding_metadata(embedder)
+
+                batch_chunks = [doc["content"] for doc in batch]
+                batch_metadata = [{**doc["metadata"], **recorded} for doc in batch]
+                batch_ids = [doc["id"] for doc in batch]
+
+                batch_vectors = embedder.embed_documents(batch_chunks)
+                chunks_embedded += len(batch)
+                embed_bar.update(len(batch))
+                report("embedding", chunks_embedded=chunks_embedded)
+
+                # Backpressure: don't let embedded batches pile up faster than they upload
+                collect(block=len(pending) >= max_pending)
+                pending.append(pool.submit(
+                    _upsert_batch, vector_backend, namespace,
+                    batch_ids, batch_vectors, batch_chunks, batch_metadata,
+                ))
+
+            if total_chunks is None:
+                # Streamed chunks: the totals are known once the chunk iterator is exhausted
+                total_chunks = chunks_embedded
+                total_batches = batches_upserted + len(pending)
+                upsert_bar.total = total_batches
+                report("upserting", chunks_embedded=chunks_embedded, batches_upserted=batches_upserted)
+            while pending:
+                collect(block=True)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
 
     print(f"Embedding completed in namespace '{namespace}'!")
-    return vectorstore, namespace
+    return vector_backend, namespace
 
-def process_pdf_book(pdf_path, namespace=None):
+def refresh_chunk_metadata(vector_backend, namespace, chunk_metadata, batch_size=100):
+    """Rewrite the stored metadata of chunks where it differs from ``chunk_metadata`` (``{id: metadata}``).
+
+    ``processed_date`` is ignored in the comparison, so re-ingesting an
+    unchanged book writes nothing. Returns the number of chunks updated.
+    """
+    changed = {}
+    ids = list(chunk_metadata)
+    for start in range(0, len(ids), batch_size):
+        stored = vector_backend.fetch_metadata(namespace, ids[start:start + batch_size])
+        for chunk_id, metadata in stored.items():
+            wanted = chunk_metadata[chunk_id]
+            if any(metadata.get(key) != value for key, value in wanted.items() if key != "processed_date"):
+                changed[chunk_id] = wanted
+    if changed:
+        print(f"Updating the metadata of {len(changed)} unchanged chunks...")
+        vector_backend.update_metadata(namespace, changed)
+    return len(changed)
+
+def embedding_metadata(embedder):
+    """Metadata recording which model and dimension produced a vector."""
+    return {"embedding_model": embedder.model_name, "embedding_dimension": embedder.dimension}
+
+def recorded_embedding(metadata):
+    """Return the ``(model, dimension)`` recorded in a vector's metadata."""
+    if "embedding_model" not in metadata:
+        return UNRECORDED_EMBEDDING
+    return metadata["embedding_model"], int(metadata["embedding_dimension"])
+
+def check_embedding(results, namespace, query_vector, model_name=HF_MODEL_NAME):
+    """Raise ``EmbeddingMismatchError`` if ``results`` were embedded with another model.
+
+    Scores between vectors of different models are meaningless, so such a
+    namespace must be re-ingested before it can be searched.
+    """
+    expected = (model_name, len(query_vector))
+    for doc, _score in results:
+        found = recorded_embedding(doc.metadata)
+        if found != expected:
+            raise EmbeddingMismatchError(
+                f"Namespace '{namespace}' was embedded with {found[0]} ({found[1]} dimensions) "
+                f"but queries use {expected[0]} ({expected[1]} dimensions); re-ingest it"
+            )
+
+def process_pdf_book(pdf_path, namespace=None, progress=None, title=None, file_name=None, file_hash=None,
+                     job_id=None):
     """Process a PDF book: extract text, split into chunks, and embed.
 
+    Pages stream through cleaning, splitting and embedding, so the first batches
+    are embedded while later pages are still being parsed. Chunks the namespace
+    already holds are not embedded again, but their stored metadata is
+    rewritten when it changed (e.g. the title, or the pages after an edit
+    shifted them); ``processed_date`` alone doesn't count as a change. The
+    result is recorded in the ingestion catalog (``IngestedBook``).
+
     Args:
         pdf_path: Path to the PDF file
-        namespace: Optional namespace for storing in Pinecone
+        namespace: Optional namespace for storing in the vector store
+        progress: Optional callback ``progress(stage, **counters)`` used to report
+            pages extracted, chunks embedded and batches upserted
+        title: Optional book title (defaults to the file name without extension)
+        file_name: Optional original file name, e.g. of an upload saved under a temporary name
+        file_hash: Optional SHA-256 of the file, if already computed
+        job_id: Optional IngestionJob running this ingestion
     """
+    started = time.monotonic()
     # Extract filename without extension for use as title
-    filename = os.path.basename(pdf_path)
-    title = os.path.splitext(filename)[0]
+    filename = file_name or os.path.basename(pdf_path)
+    if title is None:
+        title = os.path.splitext(filename)[0]
     print(f"Processing book: {title}")
 
     # Use title as namespace if not provided
     if namespace is None:
         namespace = title.lower().replace(" ", "-")
 
-    # Extract and clean text from PDF
-    text = extract_text_from_pdf(pdf_path)
-
     # Create metadata
     metadata = {
         "title": title,
-        "source": pdf_path,
+        "source": file_name or pdf_path,
         "type": "book",
         "processed_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
 
-    # Split document into chunks
-    print(f"Splitting document into chunks (size={CHUNK_SIZE}, overlap={CHUNK_OVERLAP})...")
-    chunks = split_document(text, metadata)
-    print(f"Created {len(chunks)} chunks from the book")
+    # Chunk ids are content hashes, so comparing them with what the namespace
+    # already holds tells us which chunks are new and which have vanished
+    existing_ids = get_namespace_manifest(namespace)
+    if existing_ids:
+        # Vectors from another embedding model can't be mixed with new ones
+        embedder = get_embedder(HF_MODEL_NAME)
+        vector_backend = get_vector_backend(INDEX_NAME)
+        sample = vector_backend.fetch_metadata(normalize_namespace(namespace), [next(iter(existing_ids))])
+        found = recorded_embedding(next(iter(sample.values()), {}))
+        if found != (embedder.model_name, embedder.dimension):
+            print(f"Namespace was embedded with {found[0]} ({found[1]} dimensions); re-embedding every chunk")
+            vector_backend.delete_namespace(normalize_namespace(namespace))
+            existing_ids = set()
+        else:
+            print(f"Namespace already holds {len(existing_ids)} chunks; only changes will be embedded")
 
+    timings = {"manifest": time.monotonic() - started}
 
+    # Stream pages -> cleaned text -> chunks -> embedding batches
+    phase_started = time.monotonic()
+    print(f"Splitting document into chunks (size={CHUNK_SIZE}, overlap={CHUNK_OVERLAP})...")
+    skipped_pages = []
+    chunk_ids = set()
+    kept_metadata = {}  # id -> current metadata of chunks the namespace already holds
+
+    def new_chunks(chunks):
+        for chunk in chunks:
+            if chunk["id"] in chunk_ids:
+                continue  # Identical text seen earlier in this book
+            chunk_ids.add(chunk["id"])
+            if chunk["id"] not in existing_ids:
+                yield chunk
+            else:
+                kept_metadata[chunk["id"]] = chunk["metadata"]
+
+    pages = iter_pdf_pages(pdf_path, skipped_pages, progress=progress)
+    chunks = new_chunks(iter_document_chunks(pages, metadata))
+
+    # One batch per ingestion: the local store writes the new version of the book once
+    with get_vector_backend(INDEX_NAME).batch(normalize_namespace(namespace)):
+        # Create embeddings for new chunks and store them in the vector store
+        vs, used_namespace = embed_documents_in_pinecone(chunks, INDEX_NAME, namespace, progress=progress)
+        timings["pipeline"] = time.monotonic() - phase_started
+
+        if kept_metadata:
+            recorded = embedding_metadata(get_embedder(HF_MODEL_NAME))
+            refresh_chunk_metadata(vs, used_namespace, {
+                chunk_id: {**chunk_metadata, **recorded} for chunk_id, chunk_metadata in kept_metadata.items()
+            })
 
-    # Create embeddings and store in Pinecone
-    vs, used_namespace = embed_documents_in_pinecone(chunks, INDEX_NAME, namespace)
+        # Remove chunks that are no longer part of the book
+        vanished_ids = existing_ids - chunk_ids
+        if vanished_ids:
+            print(f"Deleting {len(vanished_ids)} chunks that are no longer in the book...")
+            vs.delete(used_namespace, vanished_ids)
+
+    added = len(chunk_ids - existing_ids)
+    print(f"Created {len(chunk_ids)} chunks from the book ({added} new, {len(vanished_ids)} removed)")
+
+    # Answers cached for the previous version of this book are now stale
+    if added or vanished_ids:
+        answer_cache.invalidate(used_namespace)
+        if used_namespace != namespace:
+            answer_cache.invalidate(namespace)
+
+    # Record what the namespace now holds in the ingestion catalog
+    embedder = get_embedder(HF_MODEL_NAME)
+    record_ingestion(
+        used_namespace,
+        title=title,
+        file_name=filename,
+        file_hash=file_hash or hash_file(pdf_path),
+        file_size=os.path.getsize(pdf_path),
+        chunk_count=len(chunk_ids),
+        chunks_added=added,
+        chunks_removed=len(vanished_ids),
+        embedding_model=embedder.model_name,
+        embedding_dimension=embedder.dimension,
+        timings={phase: round(seconds, 3) for phase, seconds in timings.items()},
+        ingest_seconds=round(time.monotonic() - started, 3),
+        job_id=job_id,
+    )
 
-    # Save namespace information for later retrieval
-    namespace_info = {
-        "title": title,
-        "namespace": used_namespace,
-        "chunk_count": len(chunks),
-        "processed_date": metadata["processed_date"]
-    }
+    return vs, used_namespace
 
-    # Save namespace info to a file
+def query_cache_model(model_name):
+    # The configured dimension is part of the key: truncated vectors differ from full ones
+    return f"{model_name}@{settings.CHATBOT_EMBEDDING_DIMENSION or 'full'}"
 
+def embed_query(query, model_name=HF_MODEL_NAME):
+    """Return the embedding of a search query, served from the cache when possible.
 
-    return vs, used_namespace
+    Misses go through the query batcher, so concurrent requests share one forward pass.
+    """
+    cache_model = query_cache_model(model_name)
+    with span("embed"):
+        vector = query_embedding_cache.get(query, cache_model)
+    if vector is None:
+        with span("embedder"):
+            embedder = get_query_embedder(model_name)
+        with span("embed"):
+            vector = query_embedding_cache.set(query, cache_model, embedder.embed_query(query))
+    return vector.tolist()
+
+# Dedicated threads for CPU-bound query embedding on the async path, so the
+# event loop (and the default executor used for I/O) is never blocked by it
+_embedding_executor = ThreadPoolExecutor(
+    max_workers=settings.CHATBOT_EMBED_THREADS, thread_name_prefix="embed"
+)
+
+def _cached_query_or_embedder(query, model_name):
+    vector = query_embedding_cache.get(query, query_cache_model(model_name))
+    return vector, (get_query_embedder(model_name) if vector is None else None)
+
+async def aembed_query(query, model_name=HF_MODEL_NAME):
+    """Async ``embed_query``: cache lookups and embedding run on the embedding executor."""
+    loop = asyncio.get_running_loop()
+    # Spans are timed here: executor threads don't see the request's context
+    with span("embedder"):
+        vector, embedder = await loop.run_in_executor(
+            _embedding_executor, _cached_query_or_embedder, query, model_name
+        )
+    if vector is None:
+        with span("embed"):
+            if hasattr(embedder, "submit"):
+                # Await the batcher directly: holding an executor thread per query would
+                # cap each batch at CHATBOT_EMBED_THREADS
+                computed = await asyncio.wrap_future(embedder.submit(query))
+            else:
+                computed = await loop.run_in_executor(_embedding_executor, embedder.embed_query, query)
+            vector = await loop.run_in_executor(
+                _embedding_executor, query_embedding_cache.set, query, query_cache_model(model_name), computed
+            )
+    return vector.tolist()
 
 def search_book(query, namespace=None, top_k=5):
     """Search the book using vector similarity search.
@@ -293,56 +758,165 @@ def search_book(query, namespace=None, top_k=5):
         namespace: Optional namespace to search within (specific book)
         top_k: Number of results to return
     """
-    # Initialize embeddings
-    embedder = HuggingFaceEmbeddings(model_name=HF_MODEL_NAME)
-
-    # Initialize Pinecone index
-    index = pc.Index(INDEX_NAME)
     print(f'Searching in namespace: {namespace if namespace else "all namespaces"}')
 
-    # Create vector store with text_key parameter to match existing data
-    vectorstore = PineconeVectorStore(
-        index=index,
-        embedding=embedder,
-        namespace=namespace,
-        text_key="content"  # Use 'content' to match existing hybrid search data format
-    )
+    # Embed the query (cached) and search by vector
+    query_vector = embed_query(query)
+    with span("vector"):
+        results = get_vector_backend(INDEX_NAME).query(namespace, query_vector, top_k=top_k)
+    check_embedding(results, namespace, query_vector)
+    count("chunks", len(results))
+
+    return [doc for doc, _score in results]
+
+async def asearch_book(query, namespace=None, top_k=5, query_vector=None):
+    """Async ``search_book`` for the ASGI query path."""
+    if query_vector is None:
+        query_vector = await aembed_query(query)
+    with span("vector"):
+        results = await get_vector_backend(INDEX_NAME).aquery(namespace, query_vector, top_k=top_k)
+    check_embedding(results, namespace, query_vector)
+    count("chunks", len(results))
+    return [doc for doc, _score in results]
+
+# Threads for the per-namespace vector queries of search_namespaces; their number
+# bounds how many namespaces this process queries at once
+_search_executor = ThreadPoolExecutor(
+    max_workers=settings.CHATBOT_MULTI_SEARCH_CONCURRENCY, thread_name_prefix="search"
+)
 
-    # Search using similarity search
-    results = vectorstore.similarity_search(query, k=top_k)
+def _search_timeout(timeout):
+    """Seconds to wait for namespace queries: ``timeout`` (or the default), capped by the request deadline."""
+    timeout = timeout or settings.CHATBOT_MULTI_SEARCH_TIMEOUT or None
+    remaining = max(current_deadline().remaining(), 0)
+    if remaining == float("inf"):
+        return timeout
+    return min(timeout, remaining) if timeout else remaining
+
+def _merge_hits(namespaces, hits, top_k, skipped):
+    """Global top-k of the per-namespace hits, each tagged with its namespace."""
+    if skipped:
+        print(f"⚠️ Skipped {len(skipped)} of {len(namespaces)} namespaces: "
+              + ", ".join(f"{namespace} ({reason})" for namespace, reason in skipped.items()))
+    count("namespaces", len(namespaces))
+    count("namespaces_skipped", len(skipped))
+    merged = []
+    for namespace in namespaces:
+        for doc, score in hits.get(namespace, ()):
+            # Tag a copy: the backend's documents may be shared (e.g. by a cache)
+            tagged = doc.model_copy(update={"metadata": {**doc.metadata, "namespace": namespace}})
+            merged.append((score, tagged))
+    docs = [doc for _score, doc in heapq.nlargest(top_k, merged, key=lambda hit: hit[0])]
+    count("chunks", len(docs))
+    return docs
 
+def _query_namespace(vector_backend, namespace, query_vector, top_k):
+    results = vector_backend.query(namespace, query_vector, top_k=top_k)
+    check_embedding(results, namespace, query_vector)
     return results
 
+def search_namespaces(query, namespaces, top_k=5, timeout=None, query_vector=None):
+    """Search several namespaces (e.g. every course of a domain) at once.
+
+    The query is embedded once and each namespace is queried for ``top_k``
+    hits concurrently; the hits are merged by score into a global top-k. A
+    namespace that fails (e.g. was embedded with another model) or hasn't
+    answered within ``timeout`` seconds (``CHATBOT_MULTI_SEARCH_TIMEOUT`` by
+    default, never past the request deadline) is left out.
+
+    Args:
+        query: Search query string
+        namespaces: Namespaces to search
+        top_k: Number of results to return in total
+        timeout: Optional override of ``CHATBOT_MULTI_SEARCH_TIMEOUT``
+        query_vector: Optional precomputed query embedding
+
+    Returns:
+        ``(documents, skipped)``, where ``skipped`` maps each left-out namespace to the reason
+    """
+    namespaces = list(dict.fromkeys(namespaces))
+    if query_vector is None:
+        query_vector = embed_query(query)
+    vector_backend = get_vector_backend(INDEX_NAME)
+    hits, skipped = {}, {}
+    with span("vector"):
+        futures = {
+            _search_executor.submit(_query_namespace, vector_backend, namespace, query_vector, top_k): namespace
+            for namespace in namespaces
+        }
+        done, pending = wait(futures, timeout=_search_timeout(timeout))
+    for future in pending:
+        # A query already running can't be interrupted; it ends at the client's own timeout
+        future.cancel()
+        skipped[futures[future]] = "timeout"
+    for future in done:
+        try:
+            hits[futures[future]] = future.result()
+        except Exception as e:
+            skipped[futures[future]] = str(e)
+    return _merge_hits(namespaces, hits, top_k, skipped), skipped
+
+async def asearch_namespaces(query, namespaces, top_k=5, timeout=None, query_vector=None):
+    """Async ``search_namespaces``: at most ``CHATBOT_MULTI_SEARCH_CONCURRENCY`` queries in flight, slow ones cancelled."""
+    namespaces = list(dict.fromkeys(namespaces))
+    if not namespaces:
+        return [], {}
+    if query_vector is None:
+        query_vector = await aembed_query(query)
+    vector_backend = get_vector_backend(INDEX_NAME)
+    limit = asyncio.Semaphore(settings.CHATBOT_MULTI_SEARCH_CONCURRENCY)
+
+    async def query_namespace(namespace):
+        async with limit:
+            results = await vector_backend.aquery(namespace, query_vector, top_k=top_k)
+        check_embedding(results, namespace, query_vector)
+        return results
+
+    hits, skipped = {}, {}
+    tasks = {asyncio.ensure_future(query_namespace(namespace)): namespace for namespace in namespaces}
+    with span("vector"):
+        done, pending = await asyncio.wait(tasks, timeout=_search_timeout(timeout))
+    for task in pending:
+        task.cancel()
+        skipped[tasks[task]] = "timeout"
+    for task in done:
+        if task.exception() is None:
+            hits[tasks[task]] = task.result()
+        else:
+            skipped[tasks[task]] = str(task.exception())
+    return _merge_hits(namespaces, hits, top_k, skipped), skipped
+
 def list_book_namespaces():
-    """List all available book namespaces."""
-    namespaces_file = "book_namespaces.json"
-    if not os.path.exists(namespaces_file):
+    """List all available book namespaces from the ingestion catalog."""
+    namespaces = list(IngestedBook.objects.order_by("namespace").values(
+        "namespace", "title", "chunk_count", "file_hash", "embedding_model", "embedding_dimension", "ingested_at",
+    ))
+    if not namespaces:
         print("No books have been processed yet.")
         return []
 
-    with open(namespaces_file, "r") as f:
-        try:
-            namespaces = json.load(f)
-            print("\nAvailable books:")
-            for i, ns in enumerate(namespaces):
-                print(f"{i+1}. {ns['title']} (Namespace: {ns['namespace']}, Chunks: {ns['chunk_count']})")
-            return namespaces
-        except json.JSONDecodeError:
-            print("Error reading namespaces file.")
-            return []
+    print("\nAvailable books:")
+    for i, ns in enumerate(namespaces):
+        print(f"{i+1}. {ns['title']} (Namespace: {ns['namespace']}, Chunks: {ns['chunk_count']})")
+    return namespaces
 
 
 def delete_namespace(index_name, namespace_to_delete):
-    """Delete a specific namespace from Pinecone and remove it from local record."""
+    """Delete a specific namespace from the vector store and remove it from local record.
+
+    Errors are re-raised after being logged, so callers can report them.
+    """
+    namespace = normalize_namespace(namespace_to_delete)
     try:
         # Delete from Pinecone
-        print(f"Deleting namespace '{namespace_to_delete}' from Pinecone index '{index_name}'...")
-        index = pc.Index(index_name)
-        index.delete(delete_all=True, namespace=namespace_to_delete)
-        print("✅ Successfully deleted namespace data from Pinecone.")
-
-        # Delete from local record
+        print(f"Deleting namespace '{namespace}' from index '{index_name}'...")
+        get_vector_backend(index_name).delete_namespace(namespace)
+        print("✅ Successfully deleted namespace data from the vector store.")
+        answer_cache.invalidate(namespace)
 
+        # Delete from the ingestion catalog
+        IngestedBook.objects.filter(namespace=namespace).delete()
 
     except Exception as e:
-        print(f"❌ Error deleting namespace: {e}")
\ No newline at end of file
+        print(f"❌ Error deleting namespace: {e}")
+        raise
\ No newline at end of file
@@ -0,0 +1,131 @@
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger("user_extras.chatbot")
+
+# tiktoken encoding, loaded on first use (it may need to fetch its BPE file)
+_encoding = None
+_encoding_lock = threading.Lock()
+
+PASSAGE_SEPARATOR = "\n\n---\n\n"
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(settings.CHATBOT_CONTEXT_ENCODING)
+                except Exception as e:
+                    # No tiktoken or no cached BPE file (offline): fall back to an estimate
+                    logger.warning("Token counting falls back to ~4 characters per token: %s", e)
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """Number of tokens in ``text`` for the configured tiktoken encoding."""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut ``text`` to at most ``max_tokens`` tokens, ending on a word boundary."""
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        text = encoding.decode(tokens[:max_tokens])
+    elif len(text) > max_tokens * 4:
+        text = text[:max_tokens * 4]
+    else:
+        return text
+    return text.rsplit(" ", 1)[0] if " " in text else text
+
+
+def merge_overlapping(first, second, min_overlap=30, max_overlap=1000):
+    """Join two passages when the end of ``first`` repeats the start of ``second``.
+
+    Returns the merged text, or None when they do not overlap.
+    """
+    if len(second) < min_overlap:
+        return None
+    anchor = second[:min_overlap]
+    search_from = max(0, len(first) - max_overlap)
+    position = first.find(anchor, search_from)
+    while position != -1:
+        overlap = len(first) - position
+        if second.startswith(first[position:]) and overlap >= min_overlap:
+            return first[:position] + second
+        position = first.find(anchor, position + 1)
+    return None
+
+
+def pack_context(docs, token_budget=None):
+    """Assemble retrieved chunks into prompt context within a token budget.
+
+    ``docs`` are in relevance order. Chunks contained in another are dropped,
+    and chunks whose text overlaps (the ``CHUNK_OVERLAP`` shared by adjacent
+    chunks of a book) are merged into one passage, so repeated spans are sent
+    once. Passages are then added in order of their best-ranked chunk until
+    ``token_budget`` (default ``CHATBOT_CONTEXT_TOKEN_BUDGET``) is reached; the
+    passage that crosses the budget is truncated.
+    """
+    if token_budget is None:
+        token_budget = settings.CHATBOT_CONTEXT_TOKEN_BUDGET
+
+    # (rank, source, text) with rank = position of the best chunk in the passage
+    passages = []
+    for rank, doc in enumerate(docs):
+        text = doc.page_content.strip()
+        if not text:
+            continue
+        source = doc.metadata.get("source") or doc.metadata.get("title")
+        if any(source == other_source and text in other for _, other_source, other in passages):
+            continue
+        contained = [passage for passage in passages if passage[1] == source and passage[2] in text]
+        if contained:
+            rank = min([rank] + [passage[0] for passage in contained])
+            passages = [passage for passage in passages if passage not in contained]
+        passages.append((rank, source, text))
+
+    merged = True
+    while merged:
+        merged = False
+        for i, (rank_i, source_i, text_i) in enumerate(passages):
+            for j, (rank_j, source_j, text_j) in enumerate(passages):
+                if i == j or source_i != source_j:
+                    continue
+                joined = merge_overlapping(text_i, text_j)
+                if joined is not None:
+                    passages[i] = (min(rank_i, rank_j), source_i, joined)
+                    del passages[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    separator_tokens = count_tokens(PASSAGE_SEPARATOR)
+    packed = []
+    used = 0
+    for _rank, _source, text in sorted(passages, key=lambda passage: passage[0]):
+        remaining = token_budget - used - (separator_tokens if packed else 0)
+        if remaining <= 0:
+            break
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            if remaining < 50:  # Not worth sending a fragment
+                break
+            text = truncate_to_tokens(text, remaining)
+            tokens = count_tokens(text)
+        packed.append(text)
+        used += tokens + (separator_tokens if len(packed) > 1 else 0)
+
+    return PASSAGE_SEPARATOR.join(packed)
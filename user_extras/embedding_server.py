@@ -0,0 +1,278 @@
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+
+# A small HTTP service that owns the embedding model so gunicorn workers don't
+# each load a copy. It listens on a Unix socket ("unix:/path/to.sock") or on
+# local TCP ("http://127.0.0.1:8765"):
+#
+#   GET  /health  -> {"status": "ok", "model": ..., "dimension": ...}
+#   POST /embed   {"texts": [...], "kind": "query" | "documents"}
+#                 -> little-endian float32 matrix, one row per text
+
+
+class EmbeddingServerError(Exception):
+    """The embedding server could not be reached or returned an error."""
+
+
+def parse_address(address):
+    """Split ``unix:/path`` or ``http://host:port`` into ``("unix", path)`` or ``("tcp", (host, port))``."""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    parts = urlsplit(address if "://" in address else f"http://{address}")
+    return "tcp", (parts.hostname or "127.0.0.1", parts.port or 8765)
+
+
+# -- server ---------------------------------------------------------------------
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive: workers reuse their connection
+
+    def address_string(self):
+        # Unix-socket peers have no (host, port) address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data).encode("utf-8"))
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": "not found"})
+            return
+        embedder = self.server.embedder
+        self._send_json(200, {
+            "status": "ok",
+            "model": embedder.model_name,
+            "dimension": embedder.dimension,
+            "pid": os.getpid(),
+            "uptime": time.monotonic() - self.server.started_at,
+            "query_batching": self.server.query_embedder.stats() if self.server.query_embedder else None,
+        })
+
+    def do_POST(self):
+        if self.path != "/embed":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            texts = [str(text) for text in payload["texts"]]
+            kind = payload.get("kind", "documents")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"invalid request: {e}"})
+            return
+
+        embedder = self.server.embedder
+        try:
+            if kind == "query" and len(texts) == 1 and self.server.query_embedder:
+                # Single queries from many workers are batched together
+                vectors = [self.server.query_embedder.embed_query(texts[0])]
+            elif kind == "query":
+                vectors = embedder.embed_queries(texts)
+            else:
+                vectors = embedder.embed_documents(texts)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        body = np.asarray(vectors, dtype="<f4").reshape(len(texts), -1).tobytes()
+        self._send(200, body, "application/octet-stream", {
+            "X-Embedding-Model": embedder.model_name,
+            "X-Embedding-Dimension": str(embedder.dimension),
+        })
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(address, embedder, verbose=False, query_embedder=None):
+    """Create (but don't start) a threaded embedding server bound to ``address``.
+
+    ``query_embedder`` (e.g. a ``BatchingEmbedder`` around ``embedder``)
+    handles single-query requests.
+    """
+    kind, target = parse_address(address)
+    if kind == "unix":
+        if os.path.exists(target):
+            os.remove(target)  # Stale socket from a previous run
+        server = _UnixHTTPServer(target, EmbeddingRequestHandler)
+    else:
+        server = ThreadingHTTPServer(target, EmbeddingRequestHandler)
+        server.daemon_threads = True
+    server.embedder = embedder
+    server.query_embedder = query_embedder
+    server.verbose = verbose
+    server.started_at = time.monotonic()
+    return server
+
+
+# -- client ---------------------------------------------------------------------
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class EmbeddingServerClient:
+    """HTTP client for the embedding server, with one keep-alive connection per thread."""
+
+    def __init__(self, address, timeout=5.0):
+        self.address = address
+        self.timeout = timeout
+        self._kind, self._target = parse_address(address)
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self._kind == "unix":
+                connection = _UnixHTTPConnection(self._target, self.timeout)
+            else:
+                connection = http.client.HTTPConnection(*self._target, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in (1, 2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                self._local.connection = None
+                # A kept-alive connection may have been closed by a server restart
+                if attempt == 2 or not isinstance(e, (ConnectionError, http.client.RemoteDisconnected)):
+                    raise EmbeddingServerError(f"{self.address}: {e}") from e
+        if response.status != 200:
+            raise EmbeddingServerError(f"{self.address} returned {response.status}: {data[:200]!r}")
+        return response, data
+
+    def health(self):
+        _response, data = self._request("GET", "/health")
+        return json.loads(data)
+
+    def embed(self, texts, kind="documents"):
+        body = json.dumps({"texts": list(texts), "kind": kind}).encode("utf-8")
+        response, data = self._request("POST", "/embed", body)
+        dimension = int(response.getheader("X-Embedding-Dimension"))
+        return np.frombuffer(data, dtype="<f4").reshape(-1, dimension)
+
+
+class RemoteEmbedder:
+    """Embedder backed by the embedding server, with an in-process fallback.
+
+    The server's ``/health`` is checked before first use and after every
+    failure; a server running a different model counts as unavailable. While
+    it is unavailable, calls go to a locally loaded model (when ``fallback``)
+    and the server is retried every ``retry_interval`` seconds.
+    """
+
+    def __init__(self, model_name, address, build_local, timeout=5.0, retry_interval=30.0, fallback=True):
+        self.model_name = model_name
+        self.client = EmbeddingServerClient(address, timeout)
+        self.build_local = build_local
+        self.retry_interval = retry_interval
+        self.fallback = fallback
+        self._server_dimension = None  # Set once /health has been verified
+        self._last_dimension = None  # Survives the server going down
+        self._retry_at = 0.0
+        self._local = None
+        self._lock = threading.Lock()
+
+    def _local_embedder(self):
+        with self._lock:
+            if self._local is None:
+                print(f"Loading {self.model_name} in-process as the embedding server fallback")
+                self._local = self.build_local(self.model_name)
+        return self._local
+
+    def _check_server(self):
+        health = self.client.health()
+        if health.get("model") != self.model_name:
+            raise EmbeddingServerError(f"server runs {health.get('model')}, expected {self.model_name}")
+        self._server_dimension = self._last_dimension = int(health["dimension"])
+
+    def _server_available(self):
+        if self._server_dimension is not None:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        try:
+            self._check_server()
+            return True
+        except EmbeddingServerError as e:
+            self._mark_down(e)
+            return False
+
+    def _mark_down(self, error):
+        print(f"❌ Embedding server unavailable ({error}); retrying in {self.retry_interval:.0f}s")
+        self._server_dimension = None
+        self._retry_at = time.monotonic() + self.retry_interval
+
+    def _embed(self, texts, kind):
+        if self._server_available():
+            try:
+                return self.client.embed(texts, kind).tolist()
+            except EmbeddingServerError as e:
+                self._mark_down(e)
+        if not self.fallback:
+            raise EmbeddingServerError(f"Embedding server {self.client.address} is unavailable")
+        local = self._local_embedder()
+        return local.embed_documents(texts) if kind == "documents" else local.embed_queries(texts)
+
+    @property
+    def dimension(self):
+        if self._server_available():
+            return self._server_dimension
+        if self.fallback:
+            return self._local_embedder().dimension
+        if self._last_dimension is not None:
+            return self._last_dimension
+        raise EmbeddingServerError(f"Embedding server {self.client.address} is unavailable")
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts), "documents") if texts else []
+
+    def embed_query(self, text):
+        return self._embed([text], "query")[0]
+
+    def embed_queries(self, texts):
+        return self._embed(list(texts), "query") if texts else []
+
+    def health(self):
+        """Current server health as reported by ``/health``, or an error description."""
+        try:
+            return self.client.health()
+        except EmbeddingServerError as e:
+            return {"status": "unavailable", "error": str(e)}
@@ -0,0 +1,375 @@
+import math
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FuturesTimeoutError
+
+import numpy as np
+from django.conf import settings
+
+from .llm_resilience import DeadlineExceeded, current_deadline
+
+# Process-wide registry of loaded embedding models, keyed by model name.
+# Loading bge-large takes seconds and ~1.3 GB, so every caller in a process
+# (search, ingest, warm-up) shares the same instance.
+_embedders = {}
+_embedders_lock = threading.Lock()
+_query_embedders = {}
+
+
+class EmbeddingProvider:
+    """CPU text-embedding model with the ``embed_documents``/``embed_query`` interface.
+
+    Vectors are L2-normalized. With ``dimension`` set, they are cut to their
+    first ``dimension`` components and re-normalized, which suits models
+    trained for truncated (Matryoshka) embeddings. ``model_name`` and
+    ``dimension`` are what the vector store records next to each vector.
+    """
+
+    def __init__(self, model_name, dimension=None):
+        self.model_name = model_name
+        self._dimension = dimension or None
+
+    @property
+    def dimension(self):
+        return self._dimension or self.native_dimension
+
+    @property
+    def native_dimension(self):
+        raise NotImplementedError
+
+    def _encode(self, texts):
+        """Return an (n, native_dimension) float32 array for ``texts``."""
+        raise NotImplementedError
+
+    def _postprocess(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)[:, :self.dimension]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self._postprocess(self._encode(list(texts))).tolist()
+
+    def embed_query(self, text):
+        return self._postprocess(self._encode([text]))[0].tolist()
+
+    def embed_queries(self, texts):
+        """Embed several queries in one forward pass (queries are encoded like documents)."""
+        return self.embed_documents(texts)
+
+
+class SentenceTransformerProvider(EmbeddingProvider):
+    """sentence-transformers model on CPU, optionally int8-quantized.
+
+    With ``quantize`` the model's linear layers are dynamically quantized to
+    int8, which roughly halves resident memory and speeds up CPU inference
+    at a small cost in accuracy.
+    """
+
+    def __init__(self, model_name, dimension=None, quantize=False, batch_size=32, threads=0):
+        super().__init__(model_name, dimension)
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.model.eval()
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    @property
+    def native_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts):
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                 show_progress_bar=False)
+
+
+class OnnxProvider(EmbeddingProvider):
+    """ONNX Runtime inference for a model exported to ONNX (optionally quantized).
+
+    ``model_dir`` holds the exported ``file_name`` and the tokenizer files, as
+    written by e.g. ``optimum-cli export onnx --model BAAI/bge-small-en-v1.5 <dir>``
+    (then ``optimum-cli onnxruntime quantize`` for an int8 ``model_quantized.onnx``).
+    Requires the ``onnxruntime`` package.
+    """
+
+    def __init__(self, model_name, model_dir, dimension=None, file_name="model.onnx", pooling="cls",
+                 max_length=512, batch_size=32, threads=0):
+        super().__init__(model_name, dimension)
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("CHATBOT_EMBEDDING_BACKEND='onnx' requires the onnxruntime package") from e
+        from transformers import AutoTokenizer
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, file_name), options, providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.pooling = pooling
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self._native_dimension = self.session.get_outputs()[0].shape[-1]
+
+    @property
+    def native_dimension(self):
+        if not isinstance(self._native_dimension, int):
+            self._native_dimension = len(self._encode(["dimension probe"])[0])
+        return self._native_dimension
+
+    def _encode(self, texts):
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            tokens = self.tokenizer(
+                texts[start:start + self.batch_size], padding=True, truncation=True,
+                max_length=self.max_length, return_tensors="np",
+            )
+            inputs = {name: value.astype(np.int64) for name, value in tokens.items() if name in self.input_names}
+            hidden = self.session.run(None, inputs)[0]
+            if self.pooling == "mean":
+                mask = tokens["attention_mask"][..., None].astype(np.float32)
+                batches.append((hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9))
+            else:
+                batches.append(hidden[:, 0])
+        return np.concatenate(batches)
+
+
+def build_embedder(model_name):
+    """Construct the provider for ``model_name`` from the CHATBOT_EMBEDDING_* settings."""
+    backend = settings.CHATBOT_EMBEDDING_BACKEND
+    dimension = settings.CHATBOT_EMBEDDING_DIMENSION
+    if backend == "sentence-transformers":
+        return SentenceTransformerProvider(
+            model_name,
+            dimension,
+            quantize=settings.CHATBOT_EMBEDDING_QUANTIZE,
+            threads=settings.CHATBOT_EMBEDDING_THREADS,
+        )
+    if backend == "onnx":
+        return OnnxProvider(
+            model_name,
+            settings.CHATBOT_EMBEDDING_ONNX_DIR,
+            dimension,
+            file_name=settings.CHATBOT_EMBEDDING_ONNX_FILE,
+            pooling=settings.CHATBOT_EMBEDDING_POOLING,
+            threads=settings.CHATBOT_EMBEDDING_THREADS,
+        )
+    raise ValueError(f"Unknown CHATBOT_EMBEDDING_BACKEND: {backend!r}")
+
+
+def get_embedder(model_name):
+    """Return the shared embedder for ``model_name``, loading it on first use.
+
+    With ``CHATBOT_EMBEDDING_SERVER`` set this is a client of the embedding
+    server (see ``run_embedding_server``) instead of an in-process model.
+    """
+    embedder = _embedders.get(model_name)
+    if embedder is not None:
+        return embedder
+
+    with _embedders_lock:
+        # Another thread may have finished loading while we waited for the lock
+        embedder = _embedders.get(model_name)
+        if embedder is None:
+            if settings.CHATBOT_EMBEDDING_SERVER:
+                # The model lives in the shared embedding server; load nothing here
+                from .embedding_server import RemoteEmbedder
+                embedder = RemoteEmbedder(
+                    model_name,
+                    settings.CHATBOT_EMBEDDING_SERVER,
+                    build_embedder,
+                    timeout=settings.CHATBOT_EMBEDDING_SERVER_TIMEOUT,
+                    retry_interval=settings.CHATBOT_EMBEDDING_SERVER_RETRY,
+                    fallback=settings.CHATBOT_EMBEDDING_SERVER_FALLBACK,
+                )
+            else:
+                print(f"Loading embedding model: {model_name} ({settings.CHATBOT_EMBEDDING_BACKEND})")
+                embedder = build_embedder(model_name)
+            _embedders[model_name] = embedder
+    return embedder
+
+
+class BatchingEmbedder:
+    """Coalesces concurrent ``embed_query`` calls into batched forward passes.
+
+    Callers queue their text and block; a background thread takes the first
+    waiting text, keeps collecting for up to ``max_wait`` seconds or until
+    ``max_batch`` texts, embeds them in one call and hands each caller its
+    vector. Requests that arrive while a batch is running form the next one.
+    ``embed_documents`` goes straight to the wrapped embedder.
+    """
+
+    def __init__(self, embedder, max_batch=32, max_wait=0.005):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+        self.batches = 0
+        self.items = 0
+        self.wait_seconds = 0.0
+        self.batch_sizes = Counter()
+
+    @property
+    def model_name(self):
+        return self.embedder.model_name
+
+    @property
+    def dimension(self):
+        return self.embedder.dimension
+
+    def _ensure_worker(self):
+        # Started lazily, and again after a fork (gunicorn workers don't inherit threads)
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._run, args=(self._queue,), name="query-batcher", daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def submit(self, text):
+        """Queue ``text``; returns a ``concurrent.futures.Future`` of its vector."""
+        future = Future()
+        self._ensure_worker().put((text, future, time.monotonic()))
+        return future
+
+    def embed_query(self, text):
+        """Wait for the vector, but no longer than the request deadline allows."""
+        future = self.submit(text)
+        remaining = current_deadline().remaining()
+        try:
+            return future.result(timeout=None if math.isinf(remaining) else max(remaining, 0))
+        except FuturesTimeoutError:
+            future.cancel()  # Dropped from its batch if it hasn't started yet
+            raise DeadlineExceeded("request deadline exceeded while embedding the query") from None
+
+    def embed_queries(self, texts):
+        return self._embed_batch(list(texts))
+
+    def embed_documents(self, texts):
+        return self.embedder.embed_documents(texts)
+
+    def _embed_batch(self, texts):
+        embed_queries = getattr(self.embedder, "embed_queries", None)
+        if embed_queries is not None:
+            return embed_queries(texts)
+        return [self.embedder.embed_query(text) for text in texts]
+
+    def _run(self, requests):
+        while True:
+            try:
+                self._run_batch(requests)
+            except Exception as e:
+                # Never let the worker die: every later embed_query would wait forever
+                print(f"❌ Query batcher error: {e}")
+
+    def _run_batch(self, requests):
+        batch = [requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait())
+            except queue.Empty:
+                break
+
+        # Skip requests whose caller gave up (cancelled, e.g. past its deadline)
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        started = time.monotonic()
+        try:
+            vectors = self._embed_batch([text for text, _future, _queued_at in batch])
+        except Exception as e:
+            for _text, future, _queued_at in batch:
+                _resolve(future.set_exception, e)
+            return
+        for (_text, future, _queued_at), vector in zip(batch, vectors):
+            _resolve(future.set_result, vector)
+
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            self.wait_seconds += sum(started - queued_at for _text, _future, queued_at in batch)
+
+    def stats(self):
+        """Queue depth and batch-size counters."""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+                "max_batch_size": max(self.batch_sizes, default=0),
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "mean_wait_ms": 1000 * self.wait_seconds / self.items if self.items else 0.0,
+                "max_batch": self.max_batch,
+                "max_wait_ms": 1000 * self.max_wait,
+            }
+
+
+def _resolve(set_outcome, value):
+    """Complete a batched request's future; one that is already resolved is left alone."""
+    try:
+        set_outcome(value)
+    except InvalidStateError:
+        pass
+
+
+def get_query_embedder(model_name):
+    """Return the embedder for search queries: ``get_embedder`` behind a shared ``BatchingEmbedder``.
+
+    Batching is off when ``CHATBOT_QUERY_BATCH_MAX_SIZE`` is 1.
+    """
+    if settings.CHATBOT_QUERY_BATCH_MAX_SIZE <= 1:
+        return get_embedder(model_name)
+    batcher = _query_embedders.get(model_name)
+    if batcher is None:
+        embedder = get_embedder(model_name)
+        with _embedders_lock:
+            batcher = _query_embedders.get(model_name)
+            if batcher is None:
+                batcher = BatchingEmbedder(
+                    embedder,
+                    max_batch=settings.CHATBOT_QUERY_BATCH_MAX_SIZE,
+                    max_wait=settings.CHATBOT_QUERY_BATCH_MAX_WAIT_MS / 1000,
+                )
+                _query_embedders[model_name] = batcher
+    return batcher
+
+
+def query_batching_stats():
+    """``BatchingEmbedder.stats()`` for every query embedder created in this process."""
+    return {model_name: batcher.stats() for model_name, batcher in list(_query_embedders.items())}
+
+
+def preload_embedders(model_names):
+    """Load the given models into the registry ahead of the first request.
+
+    Called from the gunicorn master (see ``gunicorn.conf.py``) so forked
+    workers share the weights copy-on-write instead of each loading a copy.
+    """
+    for model_name in model_names:
+        get_embedder(model_name)
+
+
+def loaded_embedders():
+    """Return the names of the models currently held in the registry."""
+    return list(_embedders)
@@ -0,0 +1,286 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from content.models import Course
+from .models import IngestionJob, IngestedBook
+
+logger = logging.getLogger("user_extras.ingestion")
+
+# Bounded pool running ingestion jobs in this process (with CHATBOT_INGEST_IN_PROCESS).
+# Jobs are claimed through the database, so the same job is never run twice even if
+# several processes see it.
+_executor = None
+_executor_lock = threading.Lock()
+
+PROGRESS_FIELDS = (
+    'pages_total', 'pages_extracted',
+    'chunks_total', 'chunks_embedded',
+    'batches_total', 'batches_upserted',
+)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CHATBOT_INGEST_WORKERS,
+                thread_name_prefix="ingestion",
+            )
+    return _executor
+
+
+def normalize_namespace(namespace):
+    """Ensure namespace is valid for Pinecone."""
+    return namespace.lower().replace(" ", "-")[:63]
+
+
+def hash_file(path, block_size=1 << 20):
+    """SHA-256 hex digest of the file at ``path``."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_upload(uploaded_file, suffix=".pdf"):
+    """Stream an uploaded file to a file in ``CHATBOT_INGEST_UPLOAD_DIR``, hashing it on the way.
+
+    Returns ``(path, sha256 hex digest)``. The caller owns the file; it is
+    removed here only if writing fails.
+    """
+    upload_dir = settings.CHATBOT_INGEST_UPLOAD_DIR
+    if upload_dir:
+        os.makedirs(upload_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=upload_dir)
+    try:
+        with tmp:
+            for chunk in uploaded_file.chunks():
+                digest.update(chunk)
+                tmp.write(chunk)
+    except BaseException:
+        os.remove(tmp.name)
+        raise
+    return tmp.name, digest.hexdigest()
+
+
+def find_ingested(namespace, file_hash):
+    """Catalog entry showing ``namespace`` already holds this exact file, embedded with the current model."""
+    book = IngestedBook.objects.filter(
+        namespace=normalize_namespace(namespace),
+        file_hash=file_hash,
+        embedding_model=settings.CHATBOT_EMBEDDING_MODEL,
+    ).first()
+    # Without a configured truncation the dimension is the model's own, which can't have changed
+    if book is not None and settings.CHATBOT_EMBEDDING_DIMENSION not in (0, book.embedding_dimension):
+        return None
+    return book
+
+
+def find_active_job(namespace, file_hash):
+    """Queued or running job already ingesting this exact file into ``namespace``.
+
+    Running jobs whose runner has stopped sending heartbeats don't count.
+    """
+    return IngestionJob.objects.filter(
+        namespace=namespace,
+        file_hash=file_hash,
+        status__in=[IngestionJob.STATUS_QUEUED, IngestionJob.STATUS_RUNNING],
+    ).exclude(_stale(_lease_cutoff())).order_by('-created_at').first()
+
+
+def _lease_cutoff():
+    return timezone.now() - timedelta(seconds=settings.CHATBOT_INGEST_LEASE)
+
+
+def _stale(cutoff):
+    """Running jobs without a heartbeat since ``cutoff`` (rows from before heartbeats: since they started)."""
+    return Q(status=IngestionJob.STATUS_RUNNING) & (
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+
+
+def reclaim_stale_jobs():
+    """Recover running jobs whose runner stopped sending heartbeats (it crashed or was killed).
+
+    Such a job is queued again while its upload still exists and it has been
+    claimed fewer than ``CHATBOT_INGEST_MAX_ATTEMPTS`` times; otherwise it
+    fails and its upload is removed. Returns the number of jobs recovered.
+    """
+    reclaimed = 0
+    for job in IngestionJob.objects.filter(_stale(_lease_cutoff())):
+        # Only if nothing changed since the read: the runner may have revived, or another process reclaimed it
+        still_stale = IngestionJob.objects.filter(
+            pk=job.pk, status=IngestionJob.STATUS_RUNNING, heartbeat_at=job.heartbeat_at,
+        )
+        if job.attempts < settings.CHATBOT_INGEST_MAX_ATTEMPTS and os.path.exists(job.file_path):
+            if still_stale.update(status=IngestionJob.STATUS_QUEUED, stage='', heartbeat_at=None):
+                logger.warning("Ingestion job %s: runner stopped responding, queued again (%s of %s attempts used)",
+                               job.pk, job.attempts, settings.CHATBOT_INGEST_MAX_ATTEMPTS)
+                submit_ingestion_job(job)
+                reclaimed += 1
+        elif still_stale.update(
+            status=IngestionJob.STATUS_FAILED, finished_at=timezone.now(),
+            error=f"Job runner stopped responding after {job.attempts} attempt(s)",
+        ):
+            logger.error("Ingestion job %s: runner stopped responding, giving up after %s attempt(s)",
+                         job.pk, job.attempts)
+            if os.path.exists(job.file_path):
+                os.remove(job.file_path)
+            reclaimed += 1
+    return reclaimed
+
+
+def record_ingestion(namespace, **fields):
+    """Create or replace the catalog entry of ``namespace``."""
+    course = Course.objects.filter(pk=int(namespace)).first() if namespace.isdigit() else None
+    book, _created = IngestedBook.objects.update_or_create(
+        namespace=namespace, defaults={'course': course, **fields},
+    )
+    return book
+
+
+def submit_ingestion_job(job):
+    """Queue ``job`` on this process's worker pool once the surrounding transaction commits.
+
+    Without ``CHATBOT_INGEST_IN_PROCESS`` the job stays queued for the
+    ``run_ingestion_jobs`` command.
+    """
+    if settings.CHATBOT_INGEST_IN_PROCESS:
+        transaction.on_commit(lambda: _get_executor().submit(run_ingestion_job, job.pk))
+
+
+class JobProgressReporter:
+    """``process_pdf_book`` progress callback that saves counters onto the job row.
+
+    Writes are throttled to one UPDATE per ``interval`` seconds, except on stage
+    changes and when a counter reaches its total.
+    """
+
+    def __init__(self, job_id, interval=1.0):
+        self.job_id = job_id
+        self.interval = interval
+        self.stage = None
+        self.counters = {}
+        self._last_write = 0.0
+
+    def __call__(self, stage, **counters):
+        self.counters.update((name, value) for name, value in counters.items() if name in PROGRESS_FIELDS)
+        finished = any(
+            name.endswith(('_extracted', '_embedded', '_upserted')) and value == self._total_for(name)
+            for name, value in counters.items()
+        )
+        now = time.monotonic()
+        if stage != self.stage or finished or now - self._last_write >= self.interval:
+            self.stage = stage
+            self._last_write = now
+            IngestionJob.objects.filter(pk=self.job_id).update(stage=stage, **self.counters)
+
+    def _total_for(self, done_field):
+        prefix = done_field.split('_', 1)[0]
+        return self.counters.get(f"{prefix}_total")
+
+
+@contextmanager
+def job_heartbeat(job_id, interval):
+    """Refresh the job's ``heartbeat_at`` every ``interval`` seconds while the block runs."""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                try:
+                    IngestionJob.objects.filter(pk=job_id, status=IngestionJob.STATUS_RUNNING).update(
+                        heartbeat_at=timezone.now(),
+                    )
+                except Exception:
+                    logger.exception("Ingestion job %s: could not record a heartbeat", job_id)
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, name=f"ingestion-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_ingestion_job(job_id):
+    """Run one queued job to completion, recording its outcome on the job row.
+
+    While it runs the job's heartbeat is kept fresh, so ``reclaim_stale_jobs``
+    can tell it apart from a job whose runner died.
+    """
+    from .chatbot_core import process_pdf_book
+
+    try:
+        now = timezone.now()
+        claimed = IngestionJob.objects.filter(pk=job_id, status=IngestionJob.STATUS_QUEUED).update(
+            status=IngestionJob.STATUS_RUNNING, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            return
+        job = IngestionJob.objects.get(pk=job_id)
+        if not os.path.exists(job.file_path):
+            # Saved on another host: CHATBOT_INGEST_UPLOAD_DIR must be shared with the job runner
+            logger.error("Ingestion job %s: upload %s is not available on this host", job_id, job.file_path)
+            IngestionJob.objects.filter(pk=job_id).update(
+                status=IngestionJob.STATUS_FAILED, finished_at=timezone.now(),
+                error=f"Uploaded file {job.file_path} is not available to the job runner",
+            )
+            return
+
+        try:
+            with job_heartbeat(job_id, settings.CHATBOT_INGEST_HEARTBEAT_INTERVAL):
+                process_pdf_book(
+                    job.file_path, job.namespace, progress=JobProgressReporter(job_id),
+                    title=os.path.splitext(job.file_name)[0] or None, file_name=job.file_name,
+                    file_hash=job.file_hash or None, job_id=job_id,
+                )
+        except Exception as e:
+            logger.exception("Ingestion job %s failed", job_id)
+            IngestionJob.objects.filter(pk=job_id).update(
+                status=IngestionJob.STATUS_FAILED, error=str(e), finished_at=timezone.now(),
+            )
+        else:
+            IngestionJob.objects.filter(pk=job_id).update(
+                status=IngestionJob.STATUS_SUCCEEDED, stage='done', finished_at=timezone.now(),
+            )
+        finally:
+            if os.path.exists(job.file_path):
+                os.remove(job.file_path)
+    finally:
+        # Worker threads open their own DB connections; don't leak them
+        connections.close_all()
+
+
+def run_queued_jobs():
+    """Run every queued job synchronously (used by the ``run_ingestion_jobs`` command).
+
+    Abandoned running jobs are reclaimed first, so they are run again here.
+    """
+    reclaim_stale_jobs()
+    job_ids = list(
+        IngestionJob.objects.filter(status=IngestionJob.STATUS_QUEUED)
+        .order_by('created_at')
+        .values_list('pk', flat=True)
+    )
+    for job_id in job_ids:
+        run_ingestion_job(job_id)
+    return len(job_ids)
@@ -0,0 +1,379 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from tenacity import AsyncRetrying, Retrying, stop_never, wait_exponential_jitter
+
+from .query_metrics import count
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request ran out of time before (or while) calling upstream."""
+
+
+class CircuitOpenError(Exception):
+    """Calls are being refused because the upstream error rate is too high."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable (circuit open); retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+_current_deadline = contextvars.ContextVar("chatbot_request_deadline", default=None)
+
+
+class Deadline:
+    """Point in time by which a request must be answered; ``seconds`` of 0 or None means no deadline."""
+
+    def __init__(self, seconds=None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        if self.expires_at is None:
+            return math.inf
+        return self.expires_at - time.monotonic()
+
+    def check(self):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded("request deadline exceeded")
+
+    @contextmanager
+    def activate(self):
+        """Make this the deadline seen by ``current_deadline()`` for the enclosed block."""
+        token = _current_deadline.set(self)
+        try:
+            yield self
+        finally:
+            _current_deadline.reset(token)
+
+    def iterate(self, tokens):
+        """Consume ``tokens`` under this deadline, failing if it passes mid-stream."""
+        token = _current_deadline.set(self)  # Streams are consumed after the view has returned
+        try:
+            for item in tokens:
+                self.check()
+                yield item
+        finally:
+            _reset(token)
+
+    async def aiterate(self, tokens):
+        """Async ``iterate``."""
+        token = _current_deadline.set(self)
+        try:
+            async for item in tokens:
+                self.check()
+                yield item
+        finally:
+            _reset(token)
+
+
+def _reset(token):
+    try:
+        _current_deadline.reset(token)
+    except ValueError:
+        pass  # Generator closed from another context
+
+
+def current_deadline():
+    """The active request's deadline, or one that never expires."""
+    return _current_deadline.get() or Deadline()
+
+
+def is_retryable(error):
+    """Transient upstream failures: timeouts, connection errors, 408/409/429 and 5xx responses."""
+    if isinstance(error, (DeadlineExceeded, CircuitOpenError)):
+        return False
+    # Groq SDK errors carry ``status_code``, Pinecone's ``status``
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    # The Groq SDK's APIConnectionError/APITimeoutError carry no status code, nor do
+    # the urllib3 transport errors (e.g. MaxRetryError, ProtocolError) Pinecone raises
+    return (
+        isinstance(error, (TimeoutError, ConnectionError))
+        or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+        or type(error).__module__.startswith("urllib3.")
+    )
+
+
+class RetryBudget:
+    """Caps retries (and hedges) at a fraction of calls.
+
+    Every call deposits ``ratio`` tokens, up to ``burst``; every retry spends a
+    whole one. When upstream is failing broadly the budget runs dry and calls
+    fail after one attempt instead of multiplying the load.
+    """
+
+    def __init__(self, ratio=0.1, burst=10):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """Fails fast while the upstream error rate is high.
+
+    Opens when at least ``min_calls`` calls in the last ``window`` seconds
+    failed at ``failure_rate`` or more. After ``cooldown`` seconds a single
+    probe call is let through: success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, name, failure_rate=0.5, min_calls=10, window=30.0, cooldown=15.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self._outcomes = deque()  # (time, succeeded)
+        self._open_until = None
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    @property
+    def state(self):
+        if self._open_until is None:
+            return "closed"
+        return "half-open" if time.monotonic() >= self._open_until else "open"
+
+    def allow(self):
+        """Raise ``CircuitOpenError`` unless a call may go upstream now."""
+        with self._lock:
+            if self._open_until is None:
+                return
+            now = time.monotonic()
+            if now < self._open_until or self._probing:
+                raise CircuitOpenError(self.name, max(self._open_until - now, 1))
+            self._probing = True
+
+    def record(self, succeeded):
+        with self._lock:
+            now = time.monotonic()
+            if self._open_until is not None:
+                if not self._probing:
+                    return  # Admitted before the circuit opened
+                self._probing = False
+                self._open_until = None if succeeded else now + self.cooldown
+                self._outcomes.clear()
+                return
+            self._outcomes.append((now, succeeded))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _time, ok in self._outcomes if not ok)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                print(f"❌ {self.name}: {failures}/{len(self._outcomes)} calls failed; "
+                      f"failing fast for {self.cooldown:.0f}s")
+                self._open_until = now + self.cooldown
+                self._outcomes.clear()
+                self.opened += 1
+
+
+class ResilientCaller:
+    """Calls an upstream API under the request deadline with retries, hedging and a circuit breaker.
+
+    ``func(timeout)`` makes one call and must give up after ``timeout``
+    seconds: the smaller of ``timeout`` and the time left before the request's
+    deadline. Retryable failures are retried up to ``attempts`` times with
+    jittered exponential backoff while the ``RetryBudget`` allows. With
+    ``hedge_after`` > 0, a duplicate call is started if the first hasn't
+    answered after that many seconds and the first answer wins; the slower
+    call is cancelled (on the sync path it can only be abandoned, and ends at
+    its own timeout).
+
+    Hedged sync calls run on a pool of ``hedge_workers`` threads. When the pool
+    is busy a call runs on the caller's thread without a hedge instead of
+    queueing, so the pool never caps how many calls are in flight.
+    """
+
+    def __init__(self, breaker, budget, attempts=3, timeout=20.0, hedge_after=0.0,
+                 backoff_initial=0.25, backoff_max=4.0, hedge_workers=0):
+        self.breaker = breaker
+        self.budget = budget
+        self.attempts = attempts
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.backoff = wait_exponential_jitter(initial=backoff_initial, max=backoff_max)
+        self.executor = None
+        if hedge_after > 0 and hedge_workers > 0:
+            self.executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="llm-hedge")
+            self._free_workers = threading.Semaphore(hedge_workers)
+        self._lock = threading.Lock()  # Guards the counters below
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.unhedged = 0
+
+    def _increment(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _should_retry(self, retry_state):
+        if not retry_state.outcome.failed:
+            return False
+        error = retry_state.outcome.exception()
+        if retry_state.attempt_number >= self.attempts or not is_retryable(error):
+            return False
+        if current_deadline().remaining() <= 0 or not self.budget.withdraw():
+            return False
+        self._increment("retries")
+        count("llm_retries")
+        return True
+
+    def _wait(self, retry_state):
+        # Never sleep past the deadline
+        return max(0.0, min(self.backoff(retry_state), current_deadline().remaining()))
+
+    def _attempt_timeout(self):
+        timeout = min(self.timeout, current_deadline().remaining())
+        if timeout <= 0:
+            raise DeadlineExceeded("request deadline exceeded before the upstream call")
+        return timeout
+
+    def _retrying(self, retrying_class):
+        self._increment("calls")
+        self.budget.deposit()
+        return retrying_class(stop=stop_never, wait=self._wait, retry=self._should_retry, reraise=True)
+
+    def _hedging(self, hedge):
+        return hedge and self.hedge_after > 0
+
+    def call(self, func, hedge=True):
+        for attempt in self._retrying(Retrying):
+            with attempt:
+                timeout = self._attempt_timeout()
+                self.breaker.allow()
+                try:
+                    if self._hedging(hedge) and self.executor is not None:
+                        result = self._hedged(func, timeout)
+                    else:
+                        result = func(timeout)
+                except Exception as e:
+                    # Client errors (e.g. a bad request) say nothing about upstream health
+                    self.breaker.record(not is_retryable(e) and not isinstance(e, TimeoutError))
+                    raise
+                self.breaker.record(True)
+                return result
+
+    async def acall(self, afunc, hedge=True):
+        async for attempt in self._retrying(AsyncRetrying):
+            with attempt:
+                timeout = self._attempt_timeout()
+                self.breaker.allow()
+                try:
+                    if self._hedging(hedge):
+                        result = await self._ahedged(afunc, timeout)
+                    else:
+                        result = await afunc(timeout)
+                except Exception as e:
+                    self.breaker.record(not is_retryable(e) and not isinstance(e, TimeoutError))
+                    raise
+                self.breaker.record(True)
+                return result
+
+    def _reserve_worker(self):
+        return self._free_workers.acquire(blocking=False)
+
+    def _submit(self, func, timeout):
+        """Run ``func(timeout)`` on the pool thread reserved with ``_reserve_worker``."""
+        # Each call runs in a copy of this context so it still records into the request's timings
+        future = self.executor.submit(contextvars.copy_context().run, func, timeout)
+        future.add_done_callback(lambda _future: self._free_workers.release())
+        return future
+
+    def _should_hedge(self):
+        if not self.budget.withdraw():
+            return False
+        self._increment("hedges")
+        count("llm_hedges")
+        return True
+
+    def _hedged(self, func, timeout):
+        started = time.monotonic()
+        if not self._reserve_worker():
+            self._increment("unhedged")
+            return func(timeout)
+        futures = [self._submit(func, timeout)]
+        done, _pending = wait(futures, timeout=min(self.hedge_after, timeout))
+        if not done and self._reserve_worker():
+            if self._should_hedge():
+                remaining = timeout - (time.monotonic() - started)
+                futures.append(self._submit(func, remaining))
+            else:
+                self._free_workers.release()
+
+        pending, error = set(futures), None
+        while pending:
+            remaining = timeout - (time.monotonic() - started)
+            done, pending = wait(pending, timeout=max(remaining, 0) + 1, return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f"no answer within {timeout:.1f}s")
+            for future in done:
+                if future.exception() is None:
+                    for slower in pending:
+                        slower.cancel()
+                    if future is not futures[0]:
+                        self._increment("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _ahedged(self, afunc, timeout):
+        started = time.monotonic()
+        first = asyncio.ensure_future(afunc(timeout))
+        tasks = {first}
+        done, _pending = await asyncio.wait(tasks, timeout=min(self.hedge_after, timeout))
+        if not done and self._should_hedge():
+            tasks.add(asyncio.ensure_future(afunc(timeout - (time.monotonic() - started))))
+
+        error = None
+        try:
+            while tasks:
+                remaining = timeout - (time.monotonic() - started)
+                done, tasks = await asyncio.wait(tasks, timeout=max(remaining, 0) + 1,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise DeadlineExceeded(f"no answer within {timeout:.1f}s")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self._increment("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for slower in tasks:
+                slower.cancel()
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                "calls": self.calls,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "unhedged": self.unhedged,
+            }
+        return {
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.opened,
+            **counters,
+            "retry_budget": round(self.budget.tokens, 2),
+        }
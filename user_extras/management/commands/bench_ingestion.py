@@ -0,0 +1,77 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user_extras.benchmarks.ingestion import STAGES, compare_results, load_results, run_ingestion_benchmark, save_results
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark each PDF ingestion stage on a synthetic book, fully offline. "
+        "Reports pages/s, chunks/s, peak RSS and allocations per stage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=200, help="Pages in the synthetic PDF")
+        parser.add_argument("--lines-per-page", type=int, default=45)
+        parser.add_argument("--words-per-line", type=int, default=12)
+        parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage (best is reported)")
+        parser.add_argument("--batch-size", type=int, default=100, help="Chunks per embedding/upsert batch")
+        parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+        parser.add_argument(
+            "--embedder", choices=("hashing", "model"), default="hashing",
+            help="'hashing' needs no weights; 'model' uses the configured HuggingFace model (must be cached locally)",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the results as JSON to this path")
+        parser.add_argument("--baseline", help="Compare against a previous JSON result")
+        parser.add_argument("--tolerance", type=float, default=0.10,
+                            help="Allowed throughput drop against the baseline (0.10 = 10%%)")
+
+    def handle(self, *args, **options):
+        embedder = None
+        if options["embedder"] == "model":
+            os.environ.setdefault("HF_HUB_OFFLINE", "1")
+            from user_extras.chatbot_core import HF_MODEL_NAME
+            from user_extras.embeddings import get_embedder
+            embedder = get_embedder(HF_MODEL_NAME)
+
+        results = run_ingestion_benchmark(
+            pages=options["pages"],
+            lines_per_page=options["lines_per_page"],
+            words_per_line=options["words_per_line"],
+            repeat=options["repeat"],
+            batch_size=options["batch_size"],
+            embedder=embedder,
+            stages=options["stages"],
+            seed=options["seed"],
+            log=self.stdout.write,
+        )
+
+        self.stdout.write("")
+        self.stdout.write(f"{'stage':<10}{'seconds':>10}{'pages/s':>12}{'chunks/s':>12}{'peak RSS MB':>13}{'alloc MB':>10}")
+        for stage, stats in results["stages"].items():
+            pages_rate = f"{stats['pages_per_second']:.1f}" if "pages_per_second" in stats else "-"
+            chunks_rate = f"{stats['chunks_per_second']:.1f}" if "chunks_per_second" in stats else "-"
+            self.stdout.write(
+                f"{stage:<10}{stats['seconds_best']:>10.4f}{pages_rate:>12}{chunks_rate:>12}"
+                f"{stats['rss_peak_bytes'] / 2**20:>13.1f}{stats['alloc_peak_bytes'] / 2**20:>10.1f}"
+            )
+
+        if options["output"]:
+            save_results(results, options["output"])
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options["baseline"]:
+            rows = compare_results(results, load_results(options["baseline"]), options["tolerance"])
+            regressions = []
+            self.stdout.write("")
+            for stage, metric, before, after, change, regressed in rows:
+                line = f"{stage:<10}{metric:<20}{before:>12.1f} -> {after:>12.1f} ({change:+.1%})"
+                if regressed:
+                    regressions.append(stage)
+                    self.stdout.write(self.style.ERROR(line))
+                else:
+                    self.stdout.write(line)
+            if regressions:
+                raise CommandError(f"Throughput regressed beyond {options['tolerance']:.0%} in: {', '.join(regressions)}")
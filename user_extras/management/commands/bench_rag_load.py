@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from user_extras.benchmarks.ingestion import load_results, save_results
+from user_extras.benchmarks.rag_load import MODES, PATHS, compare_results, run_rag_load_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the chatbot query endpoints end to end, fully offline: the app runs in gunicorn "
+        "against a fake Groq API, a local embedding server and a local vector store. Reports "
+        "throughput and p50/p95/p99 latency and time to first token per concurrency level, "
+        "for the sync (WSGI) and async (ASGI) paths."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 32],
+                            help="Concurrent clients to measure")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per level")
+        parser.add_argument("--warmup", type=float, default=3.0, help="Unrecorded seconds before each path and mode")
+        parser.add_argument("--paths", nargs="+", choices=list(PATHS), default=list(PATHS))
+        parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+        parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+        parser.add_argument("--threads", type=int, default=8, help="Threads per WSGI (gthread) worker")
+        parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake LLM seconds to first token")
+        parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Fake LLM generation speed")
+        parser.add_argument("--completion-tokens", type=int, default=64, help="Tokens in every fake answer")
+        parser.add_argument("--vector-latency-ms", type=float, default=20.0,
+                            help="Simulated vector store round trip (stands in for Pinecone)")
+        parser.add_argument("--pages", type=int, default=50, help="Pages in the synthetic book")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the results as JSON to this path")
+        parser.add_argument("--baseline", help="Compare against a previous JSON result")
+        parser.add_argument("--tolerance", type=float, default=0.10,
+                            help="Allowed throughput drop or p95 latency rise against the baseline (0.10 = 10%%)")
+
+    def handle(self, *args, **options):
+        results = run_rag_load_benchmark(
+            levels=options["levels"],
+            duration=options["duration"],
+            warmup=options["warmup"],
+            paths=options["paths"],
+            modes=options["modes"],
+            workers=options["workers"],
+            threads=options["threads"],
+            llm_latency=options["llm_latency"],
+            tokens_per_second=options["tokens_per_second"],
+            completion_tokens=options["completion_tokens"],
+            vector_latency_ms=options["vector_latency_ms"],
+            pages=options["pages"],
+            seed=options["seed"],
+            log=self.stdout.write,
+        )
+        if not results["runs"]:
+            raise CommandError("No path could be run; install gunicorn and uvicorn-worker")
+
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'run':<14}{'clients':>8}{'requests':>10}{'errors':>8}{'req/s':>9}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttft p50':>10}{'ttft p95':>10}{'ttft p99':>10}"
+        )
+        for run, levels in results["runs"].items():
+            for level in levels:
+                latency = level["latency_ms"] or {}
+                ttft = level["ttft_ms"] or {}
+                self.stdout.write(
+                    f"{run:<14}{level['concurrency']:>8}{level['requests']:>10}{level['errors']:>8}"
+                    f"{level['requests_per_second']:>9.1f}"
+                    + "".join(f"{latency.get(p, float('nan')):>9.1f}" for p in ("p50", "p95", "p99"))
+                    + "".join(f"{ttft[p]:>10.1f}" if ttft else f"{'-':>10}" for p in ("p50", "p95", "p99"))
+                )
+
+        if options["output"]:
+            save_results(results, options["output"])
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options["baseline"]:
+            rows = compare_results(results, load_results(options["baseline"]), options["tolerance"])
+            regressions = []
+            self.stdout.write("")
+            for run, metric, before, after, change, regressed in rows:
+                line = f"{run:<18}{metric:<22}{before:>12.1f} -> {after:>12.1f} ({change:+.1%})"
+                if regressed:
+                    regressions.append(run)
+                    self.stdout.write(self.style.ERROR(line))
+                else:
+                    self.stdout.write(line)
+            if regressions:
+                raise CommandError(f"Regressed beyond {options['tolerance']:.0%} in: {', '.join(sorted(set(regressions)))}")
@@ -0,0 +1,48 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from user_extras.embedding_server import make_server, parse_address
+from user_extras.embeddings import BatchingEmbedder, build_embedder
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the embedding model to the web workers over a Unix socket or local HTTP, "
+        "so it is loaded once per host. Point CHATBOT_EMBEDDING_SERVER at the same address."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--address",
+            default=settings.CHATBOT_EMBEDDING_SERVER or "unix:/tmp/elevate-embeddings.sock",
+            help="unix:/path/to.sock or http://127.0.0.1:8765 (default: CHATBOT_EMBEDDING_SERVER)",
+        )
+        parser.add_argument("--model", default=settings.CHATBOT_EMBEDDING_MODEL)
+        parser.add_argument("--verbose-requests", action="store_true", help="Log every request")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Loading embedding model: {options['model']} ({settings.CHATBOT_EMBEDDING_BACKEND})")
+        embedder = build_embedder(options["model"])
+        query_embedder = None
+        if settings.CHATBOT_QUERY_BATCH_MAX_SIZE > 1:
+            query_embedder = BatchingEmbedder(
+                embedder,
+                max_batch=settings.CHATBOT_QUERY_BATCH_MAX_SIZE,
+                max_wait=settings.CHATBOT_QUERY_BATCH_MAX_WAIT_MS / 1000,
+            )
+        server = make_server(options["address"], embedder, verbose=options["verbose_requests"],
+                             query_embedder=query_embedder)
+        self.stdout.write(self.style.SUCCESS(
+            f"Serving {embedder.model_name} ({embedder.dimension} dimensions) on {options['address']}"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            kind, target = parse_address(options["address"])
+            if kind == "unix" and os.path.exists(target):
+                os.remove(target)
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from user_extras.ingestion import run_queued_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued PDF ingestion jobs. With --poll, keep running them as they are queued: "
+        "the dedicated job runner when CHATBOT_INGEST_IN_PROCESS is off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--poll", action="store_true", help="Keep polling for queued jobs")
+        parser.add_argument("--interval", type=float, default=settings.CHATBOT_INGEST_POLL_INTERVAL,
+                            help="Seconds between polls (default: CHATBOT_INGEST_POLL_INTERVAL)")
+
+    def handle(self, *args, **options):
+        if not options["poll"]:
+            count = run_queued_jobs()
+            self.stdout.write(self.style.SUCCESS(f"Processed {count} queued ingestion job(s)."))
+            return
+
+        self.stdout.write(f"Polling for queued ingestion jobs every {options['interval']:.0f}s")
+        try:
+            while True:
+                close_old_connections()  # Don't reuse a connection the database has dropped
+                count = run_queued_jobs()
+                if count:
+                    self.stdout.write(f"Processed {count} queued ingestion job(s).")
+                else:
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0001_initial'),
+        ('user_extras', '0006_chatmessage_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='file_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.CreateModel(
+            name='IngestedBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=255, unique=True)),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('file_name', models.CharField(blank=True, max_length=255)),
+                ('file_hash', models.CharField(db_index=True, max_length=64)),
+                ('file_size', models.BigIntegerField(default=0)),
+                ('chunk_count', models.IntegerField(default=0)),
+                ('chunks_added', models.IntegerField(default=0)),
+                ('chunks_removed', models.IntegerField(default=0)),
+                ('embedding_model', models.CharField(max_length=255)),
+                ('embedding_dimension', models.IntegerField()),
+                ('timings', models.JSONField(blank=True, default=dict)),
+                ('ingest_seconds', models.FloatField(default=0)),
+                ('ingested_at', models.DateTimeField(auto_now=True)),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ingested_books', to='content.course')),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='user_extras.ingestionjob')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 05:14
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_extras', '0007_ingestedbook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCacheGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=255, unique=True)),
+                ('generation', models.UUIDField(default=uuid.uuid4)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
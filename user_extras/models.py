@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.conf import settings
 from content.models import Flashcard, Course  # Import from content app
@@ -30,5 +32,88 @@ class ChatMessage(models.Model):
     is_from_user = models.BooleanField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Serves the keyset-paginated history in ChatMessageViewSet.by_course
+            models.Index(fields=['user', 'course', 'timestamp', 'id'], name='chatmessage_history_idx'),
+        ]
+
+    def __str__(self):
+        return self.content[:50]
+
+class IngestionJob(models.Model):
+    """A PDF ingestion submitted through AdminProcessPDFView and run in the background."""
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    submitted_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='ingestion_jobs')
+    namespace = models.CharField(max_length=255)
+    file_name = models.CharField(max_length=255, blank=True)
+    file_path = models.CharField(max_length=1024)
+    file_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of the upload
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    stage = models.CharField(max_length=32, blank=True)
+    pages_total = models.IntegerField(default=0)
+    pages_extracted = models.IntegerField(default=0)
+    chunks_total = models.IntegerField(default=0)
+    chunks_embedded = models.IntegerField(default=0)
+    batches_total = models.IntegerField(default=0)
+    batches_upserted = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)  # Times a runner has claimed the job
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Last sign of life of the runner
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Ingestion of {self.file_name or self.file_path} into {self.namespace} ({self.status})"
+
+class IngestedBook(models.Model):
+    """Catalog entry for the book a vector-store namespace currently holds.
+
+    Written by ``process_pdf_book`` after every ingestion; an upload whose hash,
+    namespace and embedding model match an entry is not embedded again.
+    """
+    namespace = models.CharField(max_length=255, unique=True)
+    course = models.ForeignKey(Course, on_delete=models.SET_NULL, null=True, blank=True, related_name='ingested_books')
+    title = models.CharField(max_length=255, blank=True)
+    file_name = models.CharField(max_length=255, blank=True)
+    file_hash = models.CharField(max_length=64, db_index=True)
+    file_size = models.BigIntegerField(default=0)
+    chunk_count = models.IntegerField(default=0)
+    chunks_added = models.IntegerField(default=0)
+    chunks_removed = models.IntegerField(default=0)
+    embedding_model = models.CharField(max_length=255)
+    embedding_dimension = models.IntegerField()
+    timings = models.JSONField(default=dict, blank=True)  # Seconds per ingestion phase
+    ingest_seconds = models.FloatField(default=0)
+    job = models.ForeignKey(IngestionJob, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    ingested_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.title or self.file_name} in {self.namespace} ({self.chunk_count} chunks)"
+
+
+class AnswerCacheGeneration(models.Model):
+    """Answer-cache generation of a vector-store namespace.
+
+    A new generation is written whenever the namespace is re-ingested or
+    deleted; every worker's ``SemanticAnswerCache`` drops its answers for the
+    namespace once it sees the change.
+    """
+    namespace = models.CharField(max_length=255, unique=True)
+    generation = models.UUIDField(default=uuid.uuid4)
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
-        return self.content[:50]
\ No newline at end of file
+        return f"{self.namespace}: {self.generation}"
@@ -0,0 +1,80 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ChatHistoryPagination(BasePagination):
+    """Keyset pagination of chat messages on ``(timestamp, id)``, newest page first.
+
+    The first request returns the latest ``limit`` messages; ``older`` is the URL
+    of the page before it. Each page is fetched with an index range scan on
+    ``(user, course, timestamp, id)`` instead of an OFFSET, so every page costs
+    the same however long the history is. Messages within a page are in
+    chronological order, ready to render.
+    """
+
+    cursor_query_param = 'before'
+    limit_query_param = 'limit'
+    max_limit = 200
+
+    def encode_cursor(self, message):
+        position = json.dumps({'t': message.timestamp.isoformat(), 'i': message.id})
+        return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            timestamp = parse_datetime(position['t'])
+            message_id = int(position['i'])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound('Invalid cursor')
+        if timestamp is None:
+            raise NotFound('Invalid cursor')
+        return timestamp, message_id
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get(self.limit_query_param, settings.CHATBOT_HISTORY_PAGE_SIZE))
+        except ValueError:
+            limit = settings.CHATBOT_HISTORY_PAGE_SIZE
+        return max(1, min(limit, self.max_limit))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = self.get_limit(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            timestamp, message_id = self.decode_cursor(cursor)
+            # The redundant ``timestamp <= t`` bounds the index range scan
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id),
+                timestamp__lte=timestamp,
+            )
+
+        # One extra row tells whether an older page exists
+        page = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+        self.has_more = len(page) > limit
+        page = page[:limit]
+        self.oldest = page[-1] if page else None
+        page.reverse()
+        return page
+
+    def get_older_link(self):
+        if not self.has_more:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.oldest))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'older': self.get_older_link(),
+            'has_more': self.has_more,
+            'results': data,
+        })
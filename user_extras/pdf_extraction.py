@@ -0,0 +1,63 @@
+import re
+
+import PyPDF2
+
+# Page-level PDF helpers. Kept free of Django and the ML stack so that the
+# worker processes used for parallel extraction start quickly.
+
+def clean_text(text):
+    """Clean and preprocess English text by removing irrelevant content."""
+    # Remove page numbers
+    text = re.sub(r'\n\s*\d+\s*\n', '\n', text)
+
+    # Remove headers and footers (common patterns in books)
+    text = re.sub(r'\n\s*[A-Z\s]+\s*\n', '\n', text)
+
+    # Remove references to index, table of contents sections
+    text = re.sub(r'(?i)index\s+\d+', '', text)
+    text = re.sub(r'(?i)table\s+of\s+contents', '', text)
+
+    # Remove extra whitespace
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+
+    # Remove non-alphabetic characters except punctuation
+    text = re.sub(r'[^\w\s.,;:!?\'"-]', '', text)
+
+    return text.strip()
+
+def is_likely_index_or_toc(text):
+    """Detect if a page is likely an index or table of contents."""
+    # Check for patterns that suggest index or TOC
+    if re.search(r'(?i)index|contents|appendix', text):
+        return True
+
+    # Check for patterns like "Topic........123" which are common in TOCs
+    if re.search(r'\w+\s*\.{3,}\s*\d+', text):
+        return True
+
+    # Check for dense number patterns typical in indexes
+    if len(re.findall(r'\d+', text)) > len(text.split()) / 5:  # If >20% of tokens are numbers
+        return True
+
+    return False
+
+
+def iter_page_texts(pdf_reader, start, stop):
+    """Yield ``(page_number, cleaned_text)`` for pages ``[start, stop)``.
+
+    ``cleaned_text`` is None for pages that are empty or look like an
+    index/table of contents, so callers can report them as skipped.
+    """
+    for page_num in range(start, stop):
+        text = pdf_reader.pages[page_num].extract_text()
+
+        if text and not is_likely_index_or_toc(text):
+            yield page_num + 1, clean_text(text)
+        else:
+            yield page_num + 1, None
+
+
+def extract_page_range(pdf_path, start, stop):
+    """Extract and clean pages ``[start, stop)``; run in a worker process."""
+    return list(iter_page_texts(PyPDF2.PdfReader(pdf_path), start, stop))
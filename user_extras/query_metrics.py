@@ -0,0 +1,186 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger("user_extras.chatbot")
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is unbounded)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_current = contextvars.ContextVar("chatbot_query_timings", default=None)
+
+
+class QueryTimings:
+    """Stage durations (ms) and counters of one chatbot request.
+
+    While activated, ``span()`` and ``count()`` calls anywhere in the request
+    (e.g. inside ``chatbot_core``) record into it; ``finish()`` logs the request
+    and adds it to the process-wide ``metrics``.
+    """
+
+    def __init__(self, endpoint, namespace):
+        self.endpoint = endpoint
+        self.namespace = str(namespace)
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.finished = False
+
+    def add(self, stage, ms):
+        self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, 1000 * (time.perf_counter() - start))
+
+    @contextmanager
+    def activate(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def timed_tokens(self, tokens):
+        """Wrap a token iterator, recording ``llm_ttft`` and ``llm`` as it is consumed."""
+        token = _current.set(self)  # The stream is consumed after the view has returned
+        start = time.perf_counter()
+        try:
+            for i, text in enumerate(tokens):
+                if i == 0:
+                    self.add("llm_ttft", 1000 * (time.perf_counter() - start))
+                yield text
+        finally:
+            self.add("llm", 1000 * (time.perf_counter() - start))
+            _reset(token)
+
+    async def atimed_tokens(self, tokens):
+        """Async ``timed_tokens``."""
+        token = _current.set(self)
+        start = time.perf_counter()
+        try:
+            first = True
+            async for text in tokens:
+                if first:
+                    self.add("llm_ttft", 1000 * (time.perf_counter() - start))
+                    first = False
+                yield text
+        finally:
+            self.add("llm", 1000 * (time.perf_counter() - start))
+            _reset(token)
+
+    def server_timing(self):
+        """``Server-Timing`` header value for the stages recorded so far."""
+        stages = {**self.stages, "total": 1000 * (time.perf_counter() - self.started)}
+        return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in stages.items())
+
+    def as_dict(self):
+        return {
+            "stages_ms": {stage: round(ms, 2) for stage, ms in self.stages.items()},
+            **self.counters,
+        }
+
+    def finish(self, **fields):
+        """Record total time, log the request and add it to ``metrics`` (once)."""
+        if self.finished:
+            return
+        self.finished = True
+        self.stages["total"] = 1000 * (time.perf_counter() - self.started)
+        metrics.observe(self.namespace, self.stages, self.counters)
+        logger.info(json.dumps({
+            "event": "chatbot_query",
+            "endpoint": self.endpoint,
+            "namespace": self.namespace,
+            **fields,
+            **self.as_dict(),
+        }))
+
+
+def _reset(token):
+    try:
+        _current.reset(token)
+    except ValueError:
+        pass  # Generator closed from another context (e.g. garbage-collected)
+
+
+@contextmanager
+def span(stage):
+    """Time a stage of the current request; a no-op outside one."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.span(stage):
+        yield
+
+
+def count(name, value=1):
+    """Add to a counter of the current request, if any."""
+    timings = _current.get()
+    if timings is not None:
+        timings.count(name, value)
+
+
+class QueryMetrics:
+    """Per-namespace latency histograms and counter totals of this process."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (stage, namespace) -> [bucket counts..., +Inf count], sum
+        self._histograms = {}
+        self._counters = defaultdict(int)  # (name, namespace) -> total
+        self._requests = defaultdict(int)
+
+    def observe(self, namespace, stages, counters):
+        with self._lock:
+            self._requests[namespace] += 1
+            for stage, ms in stages.items():
+                histogram = self._histograms.get((stage, namespace))
+                if histogram is None:
+                    histogram = self._histograms[(stage, namespace)] = [[0] * (len(self.buckets) + 1), 0.0]
+                bucket = next((i for i, bound in enumerate(self.buckets) if ms <= bound), len(self.buckets))
+                histogram[0][bucket] += 1
+                histogram[1] += ms
+            for name, value in counters.items():
+                self._counters[(name, namespace)] += value
+
+    def snapshot(self):
+        """Cumulative bucket counts (Prometheus style) per stage and namespace."""
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        with self._lock:
+            histograms = defaultdict(dict)
+            for (stage, namespace), (counts, total) in self._histograms.items():
+                cumulative, running = {}, 0
+                for bound, n in zip(bounds, counts):
+                    running += n
+                    cumulative[bound] = running
+                histograms[stage][namespace] = {"count": running, "sum_ms": round(total, 2), "buckets": cumulative}
+            counters = defaultdict(dict)
+            for (name, namespace), value in self._counters.items():
+                counters[name][namespace] = value
+            return {
+                "requests": dict(self._requests),
+                "latency_ms": dict(histograms),
+                "counters": dict(counters),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._requests.clear()
+
+
+metrics = QueryMetrics()
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Favorite, Notification, ChatMessage
+from .models import Favorite, Notification, ChatMessage, IngestionJob, IngestedBook
 
 class FavoriteSerializer(serializers.ModelSerializer):
     class Meta:
@@ -14,4 +14,23 @@ class NotificationSerializer(serializers.ModelSerializer):
 class ChatMessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatMessage
-        fields = ['id', 'course', 'content', 'is_from_user', 'timestamp']
\ No newline at end of file
+        fields = ['id', 'course', 'content', 'is_from_user', 'timestamp']
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestionJob
+        fields = [
+            'id', 'namespace', 'file_name', 'status', 'stage',
+            'pages_total', 'pages_extracted', 'chunks_total', 'chunks_embedded',
+            'batches_total', 'batches_upserted', 'error', 'attempts',
+            'created_at', 'started_at', 'heartbeat_at', 'finished_at',
+        ]
+
+class IngestedBookSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestedBook
+        fields = [
+            'namespace', 'course', 'title', 'file_name', 'file_hash', 'file_size',
+            'chunk_count', 'chunks_added', 'chunks_removed',
+            'embedding_model', 'embedding_dimension', 'timings', 'ingest_seconds', 'ingested_at',
+        ]
@@ -1,3 +1,824 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from langchain_core.documents import Document
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from content.models import Course, Domain
+from user_extras.chatbot_cache import QueryEmbeddingCache, SemanticAnswerCache
+from user_extras.context_packer import PASSAGE_SEPARATOR, pack_context
+from user_extras import embeddings
+from user_extras.embedding_server import EmbeddingServerError, RemoteEmbedder
+from user_extras.llm_resilience import (
+    CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, ResilientCaller, RetryBudget,
+)
+from user_extras.models import ChatMessage, IngestedBook
+from user_extras.vector_backends import EmbeddingMismatchError, LocalVectorBackend
+from user_extras.views import AdminDeleteNamespaceView, ChatbotQueryView
+
+# Modules of the chatbot's ML/LLM stack; each costs from tens of milliseconds to
+# seconds and tens to hundreds of MB when imported
+HEAVY_MODULES = {
+    'user_extras.chatbot_core',
+    'torch',
+    'transformers',
+    'sentence_transformers',
+    'onnxruntime',
+    'langchain_core',
+    'langchain_text_splitters',
+    'langchain_huggingface',
+    'PyPDF2',
+    'pinecone',
+    'groq',
+    'tiktoken',
+}
+
+
+class ImportBudgetTests(SimpleTestCase):
+    """Loading the URL conf must not import the chatbot subsystem."""
+
+    def test_urlconf_import_leaves_chatbot_stack_unloaded(self):
+        # A fresh interpreter: this test process may already have imported anything
+        script = (
+            "import json, sys, django; django.setup(); import elevate.urls; "
+            "print(json.dumps(sorted(sys.modules)))"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'elevate.settings')},
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        loaded = set(json.loads(result.stdout.splitlines()[-1]))
+        heavy = sorted(name for name in loaded if name.split('.')[0] in HEAVY_MODULES or name in HEAVY_MODULES)
+        self.assertEqual(heavy, [], "imported while loading the URL conf")
+
+
+@override_settings(CHATBOT_ANSWER_CACHE_ENABLED=False)
+class ChatbotQueryStreamTests(SimpleTestCase):
+    """``Accept: text/event-stream`` streams the answer instead of failing content negotiation."""
+
+    def post(self, data, **extra):
+        request = APIRequestFactory().post('/query/', data, format='json', **extra)
+        force_authenticate(request, user=get_user_model()(email='reader@example.com'))
+        return ChatbotQueryView.as_view()(request)
+
+    def test_accept_header_streams_answer(self):
+        chatbot_core = SimpleNamespace(
+            answer_cache=None,
+            search_book=lambda query, namespace, top_k: [
+                SimpleNamespace(page_content='Cells divide.', metadata={'page': 3}),
+            ],
+            llm_stream_chain=SimpleNamespace(stream=lambda inputs: iter(['Cells ', 'divide.'])),
+        )
+        with mock.patch('user_extras.views.chatbot', return_value=chatbot_core), \
+                mock.patch('user_extras.views.pack_context', return_value='Cells divide.'):
+            response = self.post({'course_id': '1', 'query': 'How do cells divide?'},
+                                 HTTP_ACCEPT='text/event-stream')
+            body = b''.join(response.streaming_content).decode()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('event: metadata\ndata: {"sources": [{"page": 3}], "cached": false}', body)
+        self.assertIn('event: token\ndata: {"token": "Cells "}', body)
+        self.assertIn('event: done\ndata: {"response": "Cells divide."', body)
+
+    def test_accept_header_error_is_an_event(self):
+        response = self.post({'course_id': '1'}, HTTP_ACCEPT='text/event-stream')
+        response.render()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.content.startswith(b'event: error\ndata: '))
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+    def test_hits_misses_and_evictions_are_counted(self):
+        cache = QueryEmbeddingCache(max_size=2, ttl=60)
+        self.assertIsNone(cache.get('what is a cell?', 'model'))
+        cache.set('what is a cell?', 'model', [1.0, 0.0])
+        cache.set('what is DNA?', 'model', [0.0, 1.0])
+        self.assertEqual(list(cache.get('  What is a CELL? ', 'model')), [1.0, 0.0])
+        cache.set('what is RNA?', 'model', [0.5, 0.5])  # Evicts the least recently used (DNA)
+
+        self.assertIsNone(cache.get('what is DNA?', 'model'))
+        self.assertIsNotNone(cache.get('what is a cell?', 'model'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']), (2, 2, 1, 2))
+
+    def test_entries_expire_after_ttl(self):
+        cache = QueryEmbeddingCache(ttl=10)
+        with mock.patch('user_extras.chatbot_cache.time.monotonic', return_value=100.0):
+            cache.set('q', 'model', [1.0])
+        with mock.patch('user_extras.chatbot_cache.time.monotonic', return_value=109.0):
+            self.assertIsNotNone(cache.get('q', 'model'))
+        with mock.patch('user_extras.chatbot_cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('q', 'model'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_key_includes_model_and_dimension(self):
+        from user_extras.chatbot_core import query_cache_model
+
+        cache = QueryEmbeddingCache()
+        with override_settings(CHATBOT_EMBEDDING_DIMENSION=0):
+            full = query_cache_model('bge')
+        with override_settings(CHATBOT_EMBEDDING_DIMENSION=256):
+            truncated = query_cache_model('bge')
+        cache.set('q', full, [1.0, 0.0])
+
+        self.assertNotEqual(full, truncated)
+        self.assertIsNone(cache.get('q', truncated))
+        self.assertIsNone(cache.get('q', 'other-model'))
+        self.assertIsNotNone(cache.get('q', full))
+
+
+class SemanticAnswerCacheTests(TestCase):
+    def test_similar_query_hits_and_dissimilar_misses(self):
+        cache = SemanticAnswerCache(threshold=0.95)
+        cache.store('1', [1.0, 0.0, 0.0], 'Mitosis.')
+
+        self.assertEqual(cache.lookup('1', [0.99, 0.05, 0.0]), 'Mitosis.')
+        self.assertIsNone(cache.lookup('1', [0.6, 0.8, 0.0]))
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 1))
+
+    def test_namespaces_are_isolated(self):
+        cache = SemanticAnswerCache()
+        cache.store('1', [1.0, 0.0], 'Course one.')
+
+        self.assertIsNone(cache.lookup('2', [1.0, 0.0]))
+        self.assertEqual(cache.lookup('1', [1.0, 0.0]), 'Course one.')
+
+    def test_invalidate_drops_answers_in_every_worker(self):
+        # Two caches stand in for two worker processes sharing the database
+        worker, other_worker = SemanticAnswerCache(generation_ttl=0), SemanticAnswerCache(generation_ttl=0)
+        worker.store('1', [1.0, 0.0], 'Old answer.')
+        other_worker.store('1', [1.0, 0.0], 'Old answer.')
+        worker.store('2', [1.0, 0.0], 'Other course.')
+
+        worker.invalidate('1')
+
+        self.assertIsNone(worker.lookup('1', [1.0, 0.0]))
+        self.assertIsNone(other_worker.lookup('1', [1.0, 0.0]))
+        self.assertEqual(worker.lookup('2', [1.0, 0.0]), 'Other course.')
+        worker.store('1', [1.0, 0.0], 'New answer.')
+        self.assertEqual(worker.lookup('1', [1.0, 0.0]), 'New answer.')
+
+
+class LocalVectorBackendTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        self.backend = LocalVectorBackend(self.root)
+
+    def upsert(self, backend, ids, vectors):
+        backend.upsert('ns', ids, vectors, [f'text {i}' for i in ids], [{'id': i} for i in ids])
+
+    def test_upsert_query_delete_and_list_ids(self):
+        self.upsert(self.backend, ['a', 'b', 'c'], [[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+        self.upsert(self.backend, ['b'], [[0.9, 0.1, 0]])  # Replaces b
+
+        results = self.backend.query('ns', [1, 0, 0], top_k=2)
+        self.assertEqual([doc.metadata['id'] for doc, _score in results], ['a', 'b'])
+        self.assertEqual(results[0][0].page_content, 'text a')
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
+
+        self.backend.delete('ns', ['a'])
+        self.assertEqual(sorted(self.backend.list_ids('ns')), ['b', 'c'])
+        self.assertEqual(self.backend.query('other', [1, 0, 0]), [])
+
+    def test_batch_commits_one_generation(self):
+        with mock.patch.object(self.backend, '_write', wraps=self.backend._write) as write:
+            with self.backend.batch('ns'):
+                self.upsert(self.backend, ['a'], [[1, 0]])
+                self.upsert(self.backend, ['b'], [[0, 1]])
+                self.backend.delete('ns', ['a'])
+                self.assertEqual(self.backend.list_ids('ns'), [])  # Nothing visible before the end
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(self.backend.list_ids('ns'), ['b'])
+
+    def test_failed_batch_writes_nothing(self):
+        self.upsert(self.backend, ['a'], [[1, 0]])
+        with self.assertRaises(RuntimeError):
+            with self.backend.batch('ns'):
+                self.upsert(self.backend, ['b'], [[0, 1]])
+                self.backend.delete('ns', ['a'])
+                raise RuntimeError('ingestion failed')
+        self.assertEqual(self.backend.list_ids('ns'), ['a'])
+
+    def test_dimension_mismatch_is_rejected(self):
+        self.upsert(self.backend, ['a'], [[1, 0, 0]])
+        with self.assertRaises(EmbeddingMismatchError):
+            self.upsert(self.backend, ['b'], [[1, 0]])
+        with self.assertRaises(EmbeddingMismatchError):
+            self.backend.query('ns', [1, 0])
+
+    def test_update_metadata_keeps_vectors_and_text(self):
+        self.upsert(self.backend, ['a', 'b'], [[1, 0], [0, 1]])
+        self.backend.update_metadata('ns', {'a': {'id': 'a', 'page_start': 7}})
+
+        self.assertEqual(self.backend.fetch_metadata('ns', ['a', 'b']),
+                         {'a': {'id': 'a', 'page_start': 7}, 'b': {'id': 'b'}})
+        doc, score = self.backend.query('ns', [1, 0], top_k=1)[0]
+        self.assertEqual((doc.page_content, doc.metadata['page_start']), ('text a', 7))
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+    def test_writes_from_another_backend_instance_are_seen(self):
+        # Another process sharing the store directory
+        self.upsert(LocalVectorBackend(self.root), ['a'], [[1, 0]])
+        self.upsert(self.backend, ['b'], [[0, 1]])
+        self.assertEqual(sorted(LocalVectorBackend(self.root).list_ids('ns')), ['a', 'b'])
+
+    def test_ivf_search_above_ann_threshold(self):
+        vectors = np.random.default_rng(0).normal(size=(400, 16))
+        backend = LocalVectorBackend(self.root, ann_threshold=100, nprobe=100)  # Probes every list
+        self.upsert(backend, [str(i) for i in range(400)], vectors)
+
+        for i in (0, 123, 399):
+            results = backend.query('ns', vectors[i], top_k=3)
+            self.assertEqual(results[0][0].metadata['id'], str(i))
+        current = backend._load('ns')
+        self.assertIsNotNone(current.ivf)
+        self.assertTrue(os.path.exists(os.path.join(current.path, 'ivf.npz')))
+
+
+class FlakyBackend:
+    """Vector backend whose upserts fail with the queued errors before succeeding."""
+
+    def __init__(self, errors=(), delay=0.0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.attempts = 0
+        self.upserted = []
+
+    def ensure_index(self, dimension):
+        pass
+
+    def upsert(self, namespace, ids, vectors, texts, metadatas):
+        self.attempts += 1
+        time.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        self.upserted.extend(ids)
+
+
+class CountingEmbedder:
+    model_name = 'test-model'
+    dimension = 2
+
+    def __init__(self):
+        self.batches = 0
+
+    def embed_documents(self, texts):
+        self.batches += 1
+        return [[1.0, 0.0] for _ in texts]
+
+
+class StatusError(Exception):
+    def __init__(self, status):
+        super().__init__(f'HTTP {status}')
+        self.status = status
+
+
+class EmbedAndUpsertTests(SimpleTestCase):
+    def setUp(self):
+        from user_extras import chatbot_core
+
+        self.chatbot_core = chatbot_core
+        # Don't sleep between retries
+        patcher = mock.patch.object(chatbot_core._upsert_batch.retry, 'sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def embed(self, backend, embedder, chunks=5, batch_size=2):
+        docs = ({'id': f'chunk-{i}', 'content': f'text {i}', 'metadata': {}} for i in range(chunks))
+        return self.chatbot_core.embed_documents_in_pinecone(
+            docs, 'index', 'ns', batch_size=batch_size, upsert_workers=1,
+            embedder=embedder, vector_backend=backend,
+        )
+
+    def test_transient_failure_is_retried_without_re_embedding(self):
+        backend, embedder = FlakyBackend([ConnectionError('reset'), StatusError(503)]), CountingEmbedder()
+        self.embed(backend, embedder)
+
+        self.assertEqual(sorted(backend.upserted), [f'chunk-{i}' for i in range(5)])
+        self.assertEqual(backend.attempts, 5)  # 3 batches + 2 retries
+        self.assertEqual(embedder.batches, 3)
+
+    def test_client_errors_are_not_retried(self):
+        for error in (StatusError(400), EmbeddingMismatchError('other model')):
+            with self.subTest(error=error):
+                backend = FlakyBackend([error])
+                with self.assertRaises(type(error)):
+                    self.embed(backend, CountingEmbedder(), chunks=2)  # One batch
+                self.assertEqual(backend.attempts, 1)
+
+    @override_settings(CHATBOT_UPSERT_MAX_PENDING=2)
+    def test_embedding_waits_for_slow_upserts(self):
+        backend, embedder = FlakyBackend(delay=0.02), CountingEmbedder()
+        ahead = []
+        embed_documents = embedder.embed_documents
+
+        def embed_and_count(texts):
+            ahead.append(embedder.batches - len(backend.upserted))  # Batches embedded but not yet upserted
+            return embed_documents(texts)
+
+        embedder.embed_documents = embed_and_count
+        self.embed(backend, embedder, chunks=20, batch_size=1)
+
+        self.assertEqual(len(backend.upserted), 20)
+        self.assertLessEqual(max(ahead), 3)  # At most 2 waiting for upload plus 1 uploading
+
+
+def words(prefix, count):
+    return ' '.join(f'{prefix}{i}' for i in range(count))
+
+
+def chunk(text, source='book.pdf'):
+    return SimpleNamespace(page_content=text, metadata={'source': source})
+
+
+# Count ~4 characters per token instead of loading a tiktoken encoding
+@mock.patch('user_extras.context_packer._encoding', False)
+class PackContextTests(SimpleTestCase):
+    def test_contained_chunks_are_dropped(self):
+        inner = words('cell', 20)
+        outer = f'{words("intro", 10)} {inner} {words("outro", 10)}'
+
+        self.assertEqual(pack_context([chunk(outer), chunk(inner)], token_budget=1000), outer)
+        self.assertEqual(pack_context([chunk(inner), chunk(outer)], token_budget=1000), outer)
+        # The same text in another book is kept
+        self.assertEqual(pack_context([chunk(outer), chunk(inner, 'other.pdf')], token_budget=1000),
+                         f'{outer}{PASSAGE_SEPARATOR}{inner}')
+
+    def test_overlapping_chunks_are_merged(self):
+        first, shared, second = words('alpha', 15), words('shared', 10), words('omega', 15)
+
+        packed = pack_context([chunk(f'{shared} {second}'), chunk(f'{first} {shared}')], token_budget=1000)
+
+        self.assertEqual(packed, f'{first} {shared} {second}')
+
+    def test_passages_are_ordered_by_best_rank(self):
+        best, other, joins_best = words('best', 20), words('other', 20), words('before', 20)
+        shared = words('shared', 10)
+        docs = [chunk(f'{shared} {best}'), chunk(other, 'other.pdf'), chunk(f'{joins_best} {shared}')]
+
+        passages = pack_context(docs, token_budget=1000).split(PASSAGE_SEPARATOR)
+
+        self.assertEqual(passages, [f'{joins_best} {shared} {best}', other])
+
+    def test_packing_stops_at_the_token_budget(self):
+        first, second, third = words('first', 40), words('second', 100), words('third', 40)
+        docs = [chunk(first), chunk(second, 'b.pdf'), chunk(third, 'c.pdf')]
+
+        passages = pack_context(docs, token_budget=250).split(PASSAGE_SEPARATOR)
+
+        self.assertEqual(passages[0], first)
+        self.assertEqual(len(passages), 2)  # The second passage is cut, the third never sent
+        self.assertTrue(second.startswith(passages[1]) and len(passages[1]) < len(second))
+        self.assertFalse(passages[1].endswith(' '))
+        # Nothing is sent when only a fragment of under 50 tokens would fit
+        self.assertEqual(pack_context([chunk(second)], token_budget=40), '')
+
+
+class ChatHistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='reader@example.com', name='Reader', password='secret')
+        self.course = Course.objects.create(domain=Domain.objects.create(name='Biology'), name='Cells')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/chat_messages/course/{self.course.id}/'
+
+    def add_messages(self, count, timestamp=None):
+        messages = ChatMessage.objects.bulk_create(
+            ChatMessage(user=self.user, course=self.course, content=f'message {i}', is_from_user=i % 2 == 0)
+            for i in range(count)
+        )
+        if timestamp is not None:
+            ChatMessage.objects.filter(pk__in=[message.pk for message in messages]).update(timestamp=timestamp)
+        else:
+            # Distinct, increasing timestamps
+            start = timezone.now()
+            for i, message in enumerate(messages):
+                ChatMessage.objects.filter(pk=message.pk).update(timestamp=start + timezone.timedelta(seconds=i))
+        return [message.pk for message in messages]
+
+    def pages(self, limit):
+        """Follow ``older`` links from the latest page; returns each page's message ids."""
+        pages, url = [], f'{self.url}?limit={limit}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([message['id'] for message in response.data['results']])
+            self.assertEqual(response.data['has_more'], response.data['older'] is not None)
+            url = response.data['older']
+        return pages
+
+    def test_cursor_walks_back_through_history(self):
+        ids = self.add_messages(5)
+
+        self.assertEqual(self.pages(limit=2), [ids[3:5], ids[1:3], ids[0:1]])
+
+    def test_identical_timestamps_are_ordered_by_id(self):
+        ids = self.add_messages(7, timestamp=timezone.now())
+
+        pages = self.pages(limit=3)
+
+        self.assertEqual(pages, [ids[4:7], ids[1:4], ids[0:1]])
+
+    def test_limit_is_capped(self):
+        self.add_messages(205, timestamp=timezone.now())
+
+        response = self.client.get(f'{self.url}?limit=1000')
+
+        self.assertEqual(len(response.data['results']), 200)
+        self.assertTrue(response.data['has_more'])
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ('not-a-cursor', 'eyJ0IjogIm5vdCBhIGRhdGUiLCAiaSI6IDF9'):  # The second is {"t": "not a date", "i": 1}
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'{self.url}?before={cursor}')
+                self.assertEqual(response.status_code, 404)
+
+
+class RemoteEmbedderDimensionTests(SimpleTestCase):
+    def embedder(self, fallback):
+        build_local = mock.Mock(return_value=SimpleNamespace(dimension=384))
+        embedder = RemoteEmbedder('model', 'http://127.0.0.1:1', build_local, fallback=fallback)
+        embedder.client = mock.Mock()
+        return embedder, build_local
+
+    def test_without_fallback_raises_when_server_was_never_seen(self):
+        embedder, build_local = self.embedder(fallback=False)
+        embedder.client.health.side_effect = EmbeddingServerError('down')
+
+        with self.assertRaises(EmbeddingServerError):
+            embedder.dimension
+        build_local.assert_not_called()
+
+    def test_without_fallback_reports_last_server_dimension(self):
+        embedder, build_local = self.embedder(fallback=False)
+        embedder.client.health.return_value = {'model': 'model', 'dimension': 768}
+        self.assertEqual(embedder.dimension, 768)
+
+        embedder._mark_down(EmbeddingServerError('down'))
+
+        self.assertEqual(embedder.dimension, 768)
+        build_local.assert_not_called()
+
+    def test_with_fallback_uses_local_model(self):
+        embedder, build_local = self.embedder(fallback=True)
+        embedder.client.health.side_effect = EmbeddingServerError('down')
+
+        self.assertEqual(embedder.dimension, 384)
+        build_local.assert_called_once_with('model')
+
+
+class RecordingQueryEmbedder:
+    """Embeds each text as ``[len(text)]``; ``embed_queries`` waits for ``release`` once ``started``."""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def embed_queries(self, texts):
+        self.calls.append(list(texts))
+        self.started.set()
+        self.release.wait(5)
+        return [[float(len(text))] for text in texts]
+
+
+class BatchingEmbedderTests(SimpleTestCase):
+    def test_concurrent_queries_share_one_batch(self):
+        embedder = RecordingQueryEmbedder()
+        batcher = embeddings.BatchingEmbedder(embedder, max_batch=4, max_wait=5)
+        texts = ['a', 'bb', 'ccc', 'dddd']
+        results = {}
+
+        threads = [threading.Thread(target=lambda t=text: results.update({t: batcher.embed_query(t)})) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(embedder.calls), 1)
+        self.assertCountEqual(embedder.calls[0], texts)
+        self.assertEqual(results, {text: [float(len(text))] for text in texts})
+        self.assertEqual(batcher.stats()['batch_sizes'], {4: 1})
+
+    def test_cancelled_requests_are_skipped(self):
+        embedder = RecordingQueryEmbedder()
+        embedder.release.clear()
+        batcher = embeddings.BatchingEmbedder(embedder, max_batch=8, max_wait=0)
+        first = batcher.submit('first')
+        self.assertTrue(embedder.started.wait(5))  # The worker is now busy with 'first'
+        cancelled, kept = batcher.submit('cancelled'), batcher.submit('kept')
+
+        self.assertTrue(cancelled.cancel())
+        embedder.release.set()
+
+        self.assertEqual(kept.result(5), [4.0])
+        self.assertEqual(first.result(5), [5.0])
+        self.assertEqual(embedder.calls, [['first'], ['kept']])
+
+    def test_batch_size_one_returns_the_plain_embedder(self):
+        plain = RecordingQueryEmbedder()
+        with mock.patch.object(embeddings, 'get_embedder', return_value=plain), \
+                mock.patch.object(embeddings, '_query_embedders', {}):
+            with override_settings(CHATBOT_QUERY_BATCH_MAX_SIZE=1):
+                self.assertIs(embeddings.get_query_embedder('model'), plain)
+            with override_settings(CHATBOT_QUERY_BATCH_MAX_SIZE=8):
+                batcher = embeddings.get_query_embedder('model')
+        self.assertIsInstance(batcher, embeddings.BatchingEmbedder)
+        self.assertIs(batcher.embedder, plain)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('user_extras.llm_resilience.time', SimpleNamespace(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('llm', failure_rate=0.5, min_calls=4, window=60, cooldown=10)
+
+    def test_opens_on_failure_rate(self):
+        for succeeded in (True, False, True):
+            self.breaker.record(succeeded)
+        self.breaker.allow()  # 1 of 3 failed, below min_calls anyway
+
+        self.breaker.record(False)
+
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.breaker.opened, 1)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()
+
+    def test_old_failures_leave_the_window(self):
+        for _ in range(3):
+            self.breaker.record(False)
+        self.now += 61
+
+        self.breaker.record(False)
+
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_single_probe_after_cooldown(self):
+        for _ in range(4):
+            self.breaker.record(False)
+        self.now += 10
+        self.assertEqual(self.breaker.state, 'half-open')
+
+        self.breaker.allow()  # The probe
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()
+        self.breaker.record(True)
+
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.allow()
+
+    def test_failed_probe_reopens(self):
+        for _ in range(4):
+            self.breaker.record(False)
+        self.now += 10
+        self.breaker.allow()
+
+        self.breaker.record(False)
+
+        self.assertEqual(self.breaker.state, 'open')
+        self.now += 9
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()
+
+
+class ResilientCallerTests(SimpleTestCase):
+    def caller(self, budget=None, **kwargs):
+        breaker = CircuitBreaker('llm', min_calls=1000)
+        kwargs.setdefault('backoff_initial', 0)
+        kwargs.setdefault('backoff_max', 0)
+        return ResilientCaller(breaker, budget or RetryBudget(), **kwargs)
+
+    def test_retries_transient_errors(self):
+        caller = self.caller(attempts=3)
+        func = mock.Mock(side_effect=[StatusError(503), 'answer'])
+
+        self.assertEqual(caller.call(func), 'answer')
+        self.assertEqual(caller.stats()['retries'], 1)
+
+    def test_retry_budget_cuts_off_retries(self):
+        caller = self.caller(budget=RetryBudget(ratio=0, burst=1), attempts=5)
+        func = mock.Mock(side_effect=StatusError(503))
+
+        with self.assertRaises(StatusError):
+            caller.call(func)
+
+        self.assertEqual(func.call_count, 2)  # The burst allowed a single retry
+        with self.assertRaises(StatusError):
+            caller.call(func)
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(caller.stats()['retries'], 1)
+
+    def test_client_errors_are_not_retried(self):
+        caller = self.caller(attempts=3)
+        func = mock.Mock(side_effect=StatusError(400))
+
+        with self.assertRaises(StatusError):
+            caller.call(func)
+
+        self.assertEqual(func.call_count, 1)
+
+    def test_expired_deadline_raises_before_the_call(self):
+        caller = self.caller()
+        func = mock.Mock(return_value='answer')
+        deadline = Deadline(30)
+        deadline.expires_at = time.monotonic() - 1
+
+        with deadline.activate(), self.assertRaises(DeadlineExceeded):
+            caller.call(func)
+
+        func.assert_not_called()
+
+    def test_timeout_is_capped_by_the_deadline(self):
+        caller = self.caller(timeout=20)
+        func = mock.Mock(return_value='answer')
+
+        with Deadline(2).activate():
+            caller.call(func)
+
+        self.assertLessEqual(func.call_args.args[0], 2)
+
+    def test_hedge_answers_when_the_first_call_is_slow(self):
+        caller = self.caller(attempts=1, hedge_after=0.05, hedge_workers=2)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = iter(['slow', 'fast'])
+
+        def func(timeout):
+            if next(calls) == 'slow':
+                release.wait(5)
+                return 'slow'
+            return 'fast'
+
+        self.assertEqual(caller.call(func), 'fast')
+        stats = caller.stats()
+        self.assertEqual((stats['hedges'], stats['hedge_wins']), (1, 1))
+
+    def test_no_hedge_when_the_first_call_is_fast(self):
+        caller = self.caller(attempts=1, hedge_after=1, hedge_workers=2)
+        func = mock.Mock(return_value='answer')
+
+        self.assertEqual(caller.call(func), 'answer')
+
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(caller.stats()['hedges'], 0)
+
+    def test_async_hedge_answers_when_the_first_call_is_slow(self):
+        caller = self.caller(attempts=1, hedge_after=0.05)
+        calls = iter([5, 0])
+
+        async def afunc(timeout):
+            delay = next(calls)
+            await asyncio.sleep(delay)
+            return 'slow' if delay else 'fast'
+
+        self.assertEqual(asyncio.run(caller.acall(afunc)), 'fast')
+        self.assertEqual(caller.stats()['hedge_wins'], 1)
+
+
+class MultiNamespaceBackend:
+    """Per-namespace canned hits; 'slow' never answers in time and 'broken' raises."""
+
+    def __init__(self, hits, model_name):
+        self.release = threading.Event()
+        self.docs = {
+            namespace: [
+                (Document(page_content=f'{namespace} {score}', metadata={
+                    'source': namespace, 'embedding_model': model_name, 'embedding_dimension': 2,
+                }), score)
+                for score in scores
+            ]
+            for namespace, scores in hits.items()
+        }
+
+    def _answer(self, namespace, top_k):
+        if namespace == 'broken':
+            raise StatusError(500)
+        return self.docs[namespace][:top_k]
+
+    def query(self, namespace, vector, top_k=5):
+        if namespace == 'slow':
+            self.release.wait(5)
+        return self._answer(namespace, top_k)
+
+    async def aquery(self, namespace, vector, top_k=5):
+        if namespace == 'slow':
+            await asyncio.sleep(5)
+        return self._answer(namespace, top_k)
+
+
+class SearchNamespacesTests(SimpleTestCase):
+    def setUp(self):
+        from user_extras import chatbot_core
+
+        self.chatbot_core = chatbot_core
+        self.backend = MultiNamespaceBackend(
+            {'a': [0.9, 0.5, 0.1], 'b': [0.8, 0.7, 0.2], 'slow': [1.0], 'broken': [1.0]},
+            chatbot_core.HF_MODEL_NAME,
+        )
+        self.addCleanup(self.backend.release.set)
+        patcher = mock.patch.object(chatbot_core, 'get_vector_backend', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, namespaces, **kwargs):
+        return self.chatbot_core.search_namespaces('query', namespaces, query_vector=[1.0, 0.0], **kwargs)
+
+    def asearch(self, namespaces, **kwargs):
+        return asyncio.run(
+            self.chatbot_core.asearch_namespaces('query', namespaces, query_vector=[1.0, 0.0], **kwargs)
+        )
+
+    def test_merges_a_global_top_k(self):
+        for search in (self.search, self.asearch):
+            with self.subTest(search=search.__name__):
+                docs, skipped = search(['a', 'b', 'a'], top_k=3)
+
+                self.assertEqual([doc.page_content for doc in docs], ['a 0.9', 'b 0.8', 'b 0.7'])
+                self.assertEqual([doc.metadata['namespace'] for doc in docs], ['a', 'b', 'b'])
+                self.assertEqual(skipped, {})
+
+    def test_tags_copies_of_the_backend_documents(self):
+        self.search(['a', 'b'], top_k=3)
+
+        for hits in self.backend.docs.values():
+            for doc, _score in hits:
+                self.assertNotIn('namespace', doc.metadata)
+
+    def test_leaves_out_failing_and_slow_namespaces(self):
+        for search in (self.search, self.asearch):
+            with self.subTest(search=search.__name__):
+                docs, skipped = search(['a', 'slow', 'broken'], top_k=5, timeout=0.2)
+
+                self.assertEqual([doc.page_content for doc in docs], ['a 0.9', 'a 0.5', 'a 0.1'])
+                self.assertEqual(set(skipped), {'slow', 'broken'})
+                self.assertEqual(skipped['slow'], 'timeout')
+
+    def test_leaves_out_namespaces_embedded_with_another_model(self):
+        self.backend.docs['b'][0][0].metadata['embedding_model'] = 'another-model'
+
+        docs, skipped = self.search(['a', 'b'], top_k=5)
+
+        self.assertEqual({doc.metadata['namespace'] for doc in docs}, {'a'})
+        self.assertIn('another-model', skipped['b'])
+
+
+class DeleteNamespaceTests(TestCase):
+    def setUp(self):
+        from user_extras import chatbot_core
+
+        self.chatbot_core = chatbot_core
+        self.backend = mock.Mock()
+        for target, value in (('get_vector_backend', mock.Mock(return_value=self.backend)),
+                              ('answer_cache', mock.Mock())):
+            patcher = mock.patch.object(chatbot_core, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        IngestedBook.objects.create(namespace='cell-biology', file_hash='0' * 64,
+                                    embedding_model='model', embedding_dimension=2)
+
+    def delete(self, course_id):
+        request = APIRequestFactory().delete('/admin/delete_namespace/', {'course_id': course_id}, format='json')
+        force_authenticate(request, user=get_user_model()(email='admin@example.com'))
+        return AdminDeleteNamespaceView.as_view()(request)
+
+    def test_uses_the_normalized_namespace_throughout(self):
+        response = self.delete('Cell Biology')
+
+        self.assertEqual(response.status_code, 200)
+        self.backend.delete_namespace.assert_called_once_with('cell-biology')
+        self.chatbot_core.answer_cache.invalidate.assert_called_once_with('cell-biology')
+        self.assertFalse(IngestedBook.objects.exists())
+
+    def test_failure_is_reported(self):
+        self.backend.delete_namespace.side_effect = StatusError(503)
+
+        response = self.delete('Cell Biology')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data, {'error': 'HTTP 503'})
+        self.assertTrue(IngestedBook.objects.exists())  # The catalog still matches the vector store
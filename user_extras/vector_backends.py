@@ -0,0 +1,654 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within a process
+    fcntl = None
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+class EmbeddingMismatchError(ValueError):
+    """Vectors of a different model or dimension than the stored ones were used."""
+
+
+class VectorBackend:
+    """Storage and similarity search for chunk embeddings, grouped by namespace.
+
+    ``chatbot_core`` talks to a backend only through these methods, so the
+    Pinecone index and the local on-disk store are interchangeable.
+    """
+
+    def ensure_index(self, dimension):
+        """Create the underlying index if it does not exist yet.
+
+        Raises ``EmbeddingMismatchError`` if it exists with another dimension.
+        """
+
+    def upsert(self, namespace, ids, vectors, texts, metadatas):
+        """Insert or replace vectors (with their text and metadata) by id."""
+        raise NotImplementedError
+
+    def query(self, namespace, vector, top_k=5):
+        """Return the ``top_k`` most similar chunks as (Document, score) pairs."""
+        raise NotImplementedError
+
+    async def aquery(self, namespace, vector, top_k=5):
+        """Async ``query``; by default the sync query runs in a worker thread."""
+        return await asyncio.to_thread(self.query, namespace, vector, top_k)
+
+    def list_ids(self, namespace):
+        """Iterate over every vector id stored in ``namespace``."""
+        raise NotImplementedError
+
+    def fetch_metadata(self, namespace, ids):
+        """Return ``{id: metadata}`` for those of ``ids`` stored in ``namespace``."""
+        raise NotImplementedError
+
+    def update_metadata(self, namespace, metadatas):
+        """Replace the metadata of stored vectors from ``{id: metadata}``, keeping their vectors."""
+        raise NotImplementedError
+
+    def delete(self, namespace, ids):
+        """Delete the given vector ids from ``namespace``."""
+        raise NotImplementedError
+
+    def delete_namespace(self, namespace):
+        """Delete every vector in ``namespace``."""
+        raise NotImplementedError
+
+    @contextmanager
+    def batch(self, namespace):
+        """Group the writes to ``namespace`` made inside the block (e.g. one ingestion).
+
+        Backends that write per call (Pinecone) ignore it.
+        """
+        yield
+
+
+class PineconeVectorBackend(VectorBackend):
+    """Backend storing vectors in a Pinecone serverless index.
+
+    Chunk text is stored in the metadata under ``text_key``, the same layout
+    ``PineconeVectorStore`` used, so existing namespaces stay searchable.
+
+    One backend serves every namespace of the index for the life of the
+    process: the index client is created once, straight from the cached host
+    (so no ``describe_index`` call), and keeps up to ``pool_maxsize``
+    keep-alive connections. The index description (existence, host,
+    dimension) is cached for ``metadata_ttl`` seconds.
+    """
+
+    def __init__(self, client, index_name, cloud="aws", region="us-east-1",
+                 metric="cosine", text_key="content", upsert_batch_size=100,
+                 metadata_ttl=300, pool_threads=1, pool_maxsize=10):
+        self.client = client
+        self.index_name = index_name
+        self.cloud = cloud
+        self.region = region
+        self.metric = metric
+        self.text_key = text_key
+        self.upsert_batch_size = upsert_batch_size
+        self.metadata_ttl = metadata_ttl
+        self.pool_threads = pool_threads
+        self.pool_maxsize = pool_maxsize
+        self._index = None
+        self._index_lock = threading.Lock()
+        self._description = None
+        self._description_expires_at = 0.0
+        self._async_indexes = weakref.WeakKeyDictionary()  # event loop -> IndexAsyncio
+
+    def describe(self, refresh=False):
+        """Return the index description, or None if the index doesn't exist.
+
+        Served from a cache for ``metadata_ttl`` seconds unless ``refresh``.
+        """
+        now = time.monotonic()
+        if not refresh and now < self._description_expires_at:
+            return self._description
+        if self.client.has_index(self.index_name):
+            description = self.client.describe_index(self.index_name)
+        else:
+            description = None
+        self._description = description
+        self._description_expires_at = now + self.metadata_ttl
+        return description
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    description = self.describe()
+                    if description is None:
+                        raise ValueError(f"Pinecone index '{self.index_name}' does not exist")
+                    self._index = self.client.Index(
+                        host=description.host,
+                        pool_threads=self.pool_threads,
+                        connection_pool_maxsize=self.pool_maxsize,
+                    )
+        return self._index
+
+    def ensure_index(self, dimension):
+        # Imported here so the local backend works without the Pinecone client installed
+        from pinecone import ServerlessSpec
+
+        description = self.describe()
+        if description is None:
+            # Re-check before creating: another process may have created it since
+            description = self.describe(refresh=True)
+        if description is not None:
+            if description.dimension != dimension:
+                raise EmbeddingMismatchError(
+                    f"Pinecone index '{self.index_name}' has dimension {description.dimension}, "
+                    f"but the embedding model produces {dimension}; use another index name"
+                )
+            return
+
+        print(f"Creating new Pinecone index: {self.index_name}")
+        self.client.create_index(
+            name=self.index_name,
+            dimension=dimension,
+            metric=self.metric,
+            spec=ServerlessSpec(cloud=self.cloud, region=self.region),
+        )
+
+        # Wait for index to be ready
+        while not self.describe(refresh=True).status["ready"]:
+            time.sleep(1)
+
+    def upsert(self, namespace, ids, vectors, texts, metadatas):
+        records = [
+            {
+                "id": vector_id,
+                "values": [float(value) for value in vector],
+                "metadata": {**metadata, self.text_key: text},
+            }
+            for vector_id, vector, text, metadata in zip(ids, vectors, texts, metadatas)
+        ]
+        for start in range(0, len(records), self.upsert_batch_size):
+            self.index.upsert(vectors=records[start:start + self.upsert_batch_size], namespace=namespace)
+
+    def query(self, namespace, vector, top_k=5):
+        response = self.index.query(
+            vector=[float(value) for value in vector],
+            top_k=top_k,
+            include_metadata=True,
+            namespace=namespace,
+        )
+        return self._to_results(response)
+
+    async def aquery(self, namespace, vector, top_k=5):
+        index = await self._get_async_index()
+        response = await index.query(
+            vector=[float(value) for value in vector],
+            top_k=top_k,
+            include_metadata=True,
+            namespace=namespace,
+        )
+        return self._to_results(response)
+
+    async def _get_async_index(self):
+        """Return the asyncio index client bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        index = self._async_indexes.get(loop)
+        if index is None:
+            description = await asyncio.to_thread(self.describe)
+            if description is None:
+                raise ValueError(f"Pinecone index '{self.index_name}' does not exist")
+            index = self.client.IndexAsyncio(host=description.host)
+            self._async_indexes[loop] = index
+        return index
+
+    def _to_results(self, response):
+        results = []
+        for match in response.matches:
+            metadata = dict(match.metadata or {})
+            text = metadata.pop(self.text_key, "")
+            results.append((Document(page_content=text, metadata=metadata), match.score))
+        return results
+
+    def list_ids(self, namespace):
+        if self.describe() is None:
+            return  # No index yet (first ingestion): nothing is stored
+        # Paginated listing; only available on serverless indexes
+        for ids in self.index.list(namespace=namespace or ""):
+            yield from ids
+
+    def fetch_metadata(self, namespace, ids):
+        if self.describe() is None:
+            return {}
+        response = self.index.fetch(ids=list(ids), namespace=namespace or "")
+        metadatas = {}
+        for vector_id, vector in response.vectors.items():
+            metadata = dict(vector.metadata or {})
+            metadata.pop(self.text_key, None)  # The chunk text, stored alongside
+            metadatas[vector_id] = metadata
+        return metadatas
+
+    def update_metadata(self, namespace, metadatas):
+        # One request per vector; set_metadata merges into what is stored, so the text is kept
+        def update(item):
+            self.index.update(id=item[0], set_metadata=item[1], namespace=namespace or "")
+
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix="pinecone-update") as pool:
+            list(pool.map(update, metadatas.items()))
+
+    def delete(self, namespace, ids):
+        ids = list(ids)
+        # Pinecone accepts at most 1000 ids per delete request
+        for start in range(0, len(ids), 1000):
+            self.index.delete(ids=ids[start:start + 1000], namespace=namespace)
+
+    def delete_namespace(self, namespace):
+        if self.describe() is None:
+            return
+        self.index.delete(delete_all=True, namespace=namespace)
+
+
+def _normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores, top_k):
+    """Indices of the ``top_k`` highest scores, best first."""
+    if len(scores) <= top_k:
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, top_k)[:top_k]
+    return best[np.argsort(-scores[best])]
+
+
+def build_ivf_index(vectors, n_lists, iterations=10, sample_per_list=64, seed=0, block_size=8192):
+    """Cluster unit vectors with spherical k-means for inverted-file (IVF) search.
+
+    Returns ``(centroids, order, offsets)`` where ``order[offsets[c]:offsets[c + 1]]``
+    are the row indices assigned to list ``c``.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample_size = min(n, n_lists * sample_per_list)
+    sample = np.asarray(vectors[np.sort(rng.choice(n, size=sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = sample[assignments == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids = _normalize_rows(centroids)
+
+    assignments = np.empty(n, dtype=np.int32)
+    for start in range(0, n, block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+    order = np.argsort(assignments, kind="stable").astype(np.int64)
+    offsets = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+    return centroids, order, offsets
+
+
+class _LocalNamespace:
+    """One immutable generation of a namespace, with its vectors memory-mapped."""
+
+    def __init__(self, path, generation):
+        self.path = path
+        self.generation = generation
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        with open(os.path.join(path, "records.json"), "r") as f:
+            records = json.load(f)
+        self.ids = records["ids"]
+        self.texts = records["texts"]
+        self.metadatas = records["metadatas"]
+        self.ivf = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class _PendingWrites:
+    """Writes buffered by an open ``LocalVectorBackend.batch``."""
+
+    def __init__(self):
+        self.operations = []
+        self.depth = 0
+        self.failed = False
+
+
+class LocalVectorBackend(VectorBackend):
+    """Backend keeping each namespace as a memory-mapped matrix on local disk.
+
+    Vectors are L2-normalized on write so the inner product is the cosine
+    similarity. Namespaces smaller than ``ann_threshold`` are searched exactly;
+    larger ones get an IVF index (built lazily on the first query and stored
+    next to the vectors) and only the ``nprobe`` closest lists are scanned.
+
+    Every write produces a new generation directory and then atomically swaps
+    the namespace's ``CURRENT`` pointer, so readers in other processes never
+    see a half-written namespace. The generation it replaced is kept until the
+    next write, for readers that have just read the old pointer. Writers hold
+    an ``flock`` on ``<namespace>.lock``, so processes sharing the store (web
+    workers, the job runner) don't lose each other's writes. Inside
+    ``batch()`` writes are buffered and committed as a single generation when
+    the block ends.
+
+    ``latency`` (seconds) is slept before every query to mimic a remote
+    store's round trip in load tests.
+    """
+
+    def __init__(self, root, dtype="float32", ann_threshold=20000, nprobe=10, block_size=8192, latency=0.0):
+        self.root = str(root)
+        self.dtype = np.dtype(dtype)
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self.block_size = block_size
+        self.latency = latency
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self._write_locks = {}
+        self._batches = {}  # namespace -> _PendingWrites
+
+    # -- layout ---------------------------------------------------------------
+
+    def _namespace_dir(self, namespace):
+        namespace = namespace or "__default__"
+        safe = re.sub(r'[^A-Za-z0-9._-]', '_', namespace)[:64]
+        if safe != namespace:
+            safe = f"{safe}-{hashlib.sha1(namespace.encode('utf-8')).hexdigest()[:8]}"
+        return os.path.join(self.root, safe)
+
+    def _current_generation(self, namespace):
+        try:
+            with open(os.path.join(self._namespace_dir(namespace), "CURRENT"), "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _load(self, namespace):
+        """Return the current generation of ``namespace`` or None if it is empty."""
+        generation = self._current_generation(namespace)
+        if generation is None:
+            return None
+        with self._lock:
+            loaded = self._loaded.get(namespace)
+            if loaded is not None and loaded.generation == generation:
+                return loaded
+        try:
+            loaded = _LocalNamespace(os.path.join(self._namespace_dir(namespace), generation), generation)
+        except FileNotFoundError:
+            # Removed by writers in another process since CURRENT was read; read it again
+            generation = self._current_generation(namespace)
+            if generation is None:
+                return None
+            loaded = _LocalNamespace(os.path.join(self._namespace_dir(namespace), generation), generation)
+        with self._lock:
+            self._loaded[namespace] = loaded
+        return loaded
+
+    @contextmanager
+    def _write_lock(self, namespace):
+        """Serialize writers of ``namespace``: threads with a lock, processes with ``flock``."""
+        with self._lock:
+            thread_lock = self._write_locks.setdefault(namespace, threading.Lock())
+        with thread_lock:
+            if fcntl is None:
+                yield
+                return
+            # Next to the namespace directory rather than in it: deleting a namespace removes the directory
+            os.makedirs(self.root, exist_ok=True)
+            with open(f"{self._namespace_dir(namespace)}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, namespace, vectors, ids, texts, metadatas):
+        ns_dir = self._namespace_dir(namespace)
+        generation = uuid.uuid4().hex
+        gen_dir = os.path.join(ns_dir, generation)
+        os.makedirs(gen_dir)
+
+        np.save(os.path.join(gen_dir, "vectors.npy"), vectors.astype(self.dtype, copy=False))
+        with open(os.path.join(gen_dir, "records.json"), "w") as f:
+            json.dump({"ids": ids, "texts": texts, "metadatas": metadatas}, f)
+
+        # Swap the pointer atomically, then drop the generations before the one it replaced;
+        # that one stays for readers that loaded the old pointer just before the swap
+        previous = self._current_generation(namespace)
+        pointer_tmp = os.path.join(ns_dir, f"CURRENT.{generation}")
+        with open(pointer_tmp, "w") as f:
+            f.write(generation)
+        os.replace(pointer_tmp, os.path.join(ns_dir, "CURRENT"))
+
+        for entry in os.listdir(ns_dir):
+            entry_path = os.path.join(ns_dir, entry)
+            if entry not in (generation, previous) and os.path.isdir(entry_path):
+                shutil.rmtree(entry_path, ignore_errors=True)
+
+    # -- VectorBackend ----------------------------------------------------------
+
+    def upsert(self, namespace, ids, vectors, texts, metadatas):
+        new_vectors = _normalize_rows(vectors)
+        operation = ("upsert", list(ids), new_vectors, list(texts), list(metadatas))
+        if not self._buffer(namespace, operation):
+            self._apply(namespace, [operation])
+
+    def query(self, namespace, vector, top_k=5):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._search(namespace, vector, top_k)
+
+    async def aquery(self, namespace, vector, top_k=5):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        # A local search takes well under a millisecond; not worth a thread hop
+        return self._search(namespace, vector, top_k)
+
+    def _search(self, namespace, vector, top_k):
+        current = self._load(namespace)
+        if current is None or not len(current):
+            return []
+
+        query = _normalize_rows(vector)[0]
+        if len(query) != current.vectors.shape[1]:
+            raise EmbeddingMismatchError(
+                f"Namespace '{namespace}' holds {current.vectors.shape[1]}-dimensional vectors, "
+                f"got a {len(query)}-dimensional query"
+            )
+        if len(current) >= self.ann_threshold:
+            rows = self._ivf_candidates(current, query)
+        else:
+            rows = None
+
+        if rows is None:
+            scores = np.empty(len(current), dtype=np.float32)
+            for start in range(0, len(current), self.block_size):
+                block = np.asarray(current.vectors[start:start + self.block_size], dtype=np.float32)
+                scores[start:start + len(block)] = block @ query
+            best = _top_k(scores, top_k)
+            rows, best_scores = best, scores[best]
+        else:
+            candidate_scores = np.asarray(current.vectors[rows], dtype=np.float32) @ query
+            best = _top_k(candidate_scores, top_k)
+            rows, best_scores = rows[best], candidate_scores[best]
+
+        return [
+            (Document(page_content=current.texts[row], metadata=dict(current.metadatas[row])), float(score))
+            for row, score in zip(rows, best_scores)
+        ]
+
+    def _ivf_candidates(self, current, query):
+        """Row indices in the ``nprobe`` IVF lists closest to ``query``."""
+        with current.lock:
+            if current.ivf is None:
+                current.ivf = self._load_or_build_ivf(current)
+        centroids, order, offsets = current.ivf
+        nprobe = min(self.nprobe, len(centroids))
+        lists = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in lists])
+        # Sorted rows keep reads from the memory map sequential
+        return np.sort(rows)
+
+    def _load_or_build_ivf(self, current):
+        ivf_path = os.path.join(current.path, "ivf.npz")
+        try:
+            with np.load(ivf_path) as ivf:
+                return ivf["centroids"], ivf["order"], ivf["offsets"]
+        except FileNotFoundError:
+            pass
+
+        n_lists = max(1, int(np.sqrt(len(current))))
+        print(f"Building IVF index with {n_lists} lists over {len(current)} vectors...")
+        centroids, order, offsets = build_ivf_index(current.vectors, n_lists, block_size=self.block_size)
+        tmp_path = os.path.join(current.path, f"ivf.{uuid.uuid4().hex}.npz")
+        try:
+            np.savez(tmp_path, centroids=centroids, order=order, offsets=offsets)
+            os.replace(tmp_path, ivf_path)
+        except FileNotFoundError:
+            pass  # The generation was replaced and removed meanwhile; use the index unsaved
+        return centroids, order, offsets
+
+    def list_ids(self, namespace):
+        current = self._load(namespace)
+        return list(current.ids) if current is not None else []
+
+    def fetch_metadata(self, namespace, ids):
+        current = self._load(namespace)
+        if current is None:
+            return {}
+        wanted = set(ids)
+        return {
+            vector_id: dict(metadata)
+            for vector_id, metadata in zip(current.ids, current.metadatas)
+            if vector_id in wanted
+        }
+
+    def update_metadata(self, namespace, metadatas):
+        operation = ("metadata", dict(metadatas))
+        if metadatas and not self._buffer(namespace, operation):
+            self._apply(namespace, [operation])
+
+    def delete(self, namespace, ids):
+        ids = set(ids)
+        if ids and not self._buffer(namespace, ("delete", ids)):
+            self._apply(namespace, [("delete", ids)])
+
+    def delete_namespace(self, namespace):
+        with self._write_lock(namespace):
+            self._remove_namespace(namespace)
+
+    def _remove_namespace(self, namespace):
+        shutil.rmtree(self._namespace_dir(namespace), ignore_errors=True)
+        with self._lock:
+            self._loaded.pop(namespace, None)
+
+    @contextmanager
+    def batch(self, namespace):
+        """Buffer the writes (upserts, metadata updates, deletes) of ``namespace`` until the block ends.
+
+        Writes from any thread are kept in memory and applied as one new
+        generation on exit, so an ingestion rewrites the namespace once rather
+        than once per upsert batch. If the block raises, nothing is written.
+        Nested batches of a namespace commit when the outermost one ends.
+        """
+        with self._lock:
+            pending = self._batches.setdefault(namespace, _PendingWrites())
+            pending.depth += 1
+        try:
+            yield
+        except BaseException:
+            pending.failed = True
+            raise
+        finally:
+            with self._lock:
+                pending.depth -= 1
+                outermost = pending.depth == 0
+                if outermost:
+                    del self._batches[namespace]
+            if outermost and not pending.failed and pending.operations:
+                self._apply(namespace, pending.operations)
+
+    def _buffer(self, namespace, operation):
+        """Add ``operation`` to the namespace's open batch; False if there is none."""
+        with self._lock:
+            pending = self._batches.get(namespace)
+            if pending is None:
+                return False
+            pending.operations.append(operation)
+            return True
+
+    def _apply(self, namespace, operations):
+        """Apply ``("upsert", ids, vectors, texts, metadatas)``, ``("metadata", {id: metadata})``
+        and ``("delete", ids)`` operations in order."""
+        with self._write_lock(namespace):
+            current = self._load(namespace)
+            if current is None:
+                rows, ids, texts, metadatas = [], [], [], []
+            else:
+                rows = list(current.vectors)  # Row views into the memory map; copied once, by _write
+                ids, texts, metadatas = list(current.ids), list(current.texts), list(current.metadatas)
+
+            changed = False
+            for operation in operations:
+                if operation[0] == "delete":
+                    keep = [i for i, vector_id in enumerate(ids) if vector_id not in operation[1]]
+                    if len(keep) != len(ids):
+                        rows = [rows[i] for i in keep]
+                        ids = [ids[i] for i in keep]
+                        texts = [texts[i] for i in keep]
+                        metadatas = [metadatas[i] for i in keep]
+                        changed = True
+                    continue
+                if operation[0] == "metadata":
+                    for i, vector_id in enumerate(ids):
+                        if vector_id in operation[1]:
+                            metadatas[i] = operation[1][vector_id]
+                            changed = True
+                    continue
+
+                _kind, new_ids, new_vectors, new_texts, new_metadatas = operation
+                if rows and len(rows[0]) != new_vectors.shape[1]:
+                    raise EmbeddingMismatchError(
+                        f"Namespace '{namespace}' holds {len(rows[0])}-dimensional vectors, "
+                        f"got {new_vectors.shape[1]}"
+                    )
+                positions = {vector_id: i for i, vector_id in enumerate(ids)}
+                for row, (vector_id, text, metadata) in enumerate(zip(new_ids, new_texts, new_metadatas)):
+                    position = positions.get(vector_id)
+                    if position is None:
+                        positions[vector_id] = len(ids)
+                        rows.append(new_vectors[row])
+                        ids.append(vector_id)
+                        texts.append(text)
+                        metadatas.append(metadata)
+                    else:
+                        rows[position] = new_vectors[row]
+                        texts[position] = text
+                        metadatas[position] = metadata
+                changed = True
+
+            if not changed:
+                return
+            if not ids:
+                self._remove_namespace(namespace)
+                return
+            self._write(namespace, np.asarray(np.stack(rows), dtype=np.float32), ids, texts, metadatas)
@@ -1,15 +1,44 @@
 from rest_framework import viewsets, permissions
-from .models import Favorite, Notification, ChatMessage
-from content.models import Flashcard
-from .serializers import FavoriteSerializer, NotificationSerializer, ChatMessageSerializer
+from .models import Favorite, Notification, ChatMessage, IngestionJob
+from content.models import Course, Flashcard
+from .serializers import FavoriteSerializer, NotificationSerializer, ChatMessageSerializer, IngestionJobSerializer, IngestedBookSerializer
 from content.serializers import FlashcardSerializer
-import tempfile
+import json
+import os
+import sys
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
 from rest_framework.decorators import action
+from rest_framework.reverse import reverse
 from rest_framework.response import Response
-from .chatbot_core import process_pdf_book, delete_namespace, search_book, llm_chain, INDEX_NAME
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from django.shortcuts import get_object_or_404
+from .ingestion import find_active_job, find_ingested, reclaim_stale_jobs, save_upload, submit_ingestion_job
+from .context_packer import pack_context
+from .chat_history import save_chat_turn, asave_chat_turn, call_after_response
+from .pagination import ChatHistoryPagination
+from .query_metrics import QueryTimings, metrics as query_metrics
+from .llm_resilience import CircuitOpenError, Deadline, DeadlineExceeded, current_deadline
+
+def chatbot():
+    """Return ``chatbot_core``, importing it (and its ML/LLM stack) on first use.
+
+    Kept out of module scope so that loading the URL conf, e.g. for
+    ``migrate`` or workers that never serve chat, doesn't import torch,
+    langchain or the vector-store and Groq clients.
+    """
+    from . import chatbot_core
+    return chatbot_core
 
 class FavoriteViewSet(viewsets.ModelViewSet):
     serializer_class = FavoriteSerializer
@@ -53,12 +82,27 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
     # 👇 Custom action to get messages for a specific course
     @action(detail=False, methods=['get'], url_path='course/(?P<course_id>[^/.]+)')
     def by_course(self, request, course_id=None):
-        """Return all chat messages for the given course belonging to the logged-in user"""
-        messages = ChatMessage.objects.filter(user=request.user, course_id=course_id).order_by('timestamp')
+        """Return the logged-in user's chat messages for the given course, newest page first.
+
+        Pass ``limit`` to size the page and follow ``older`` (a ``before`` cursor) to load earlier messages.
+        """
+        paginator = ChatHistoryPagination()
+        messages = paginator.paginate_queryset(
+            ChatMessage.objects.filter(user=request.user, course_id=course_id), request, view=self
+        )
         serializer = self.get_serializer(messages, many=True)
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
 class AdminProcessPDFView(APIView):
+    """Queue a PDF for ingestion into a course namespace.
+
+    The upload is hashed while it is written to a temporary file. If the
+    namespace already holds that exact file (per the ingestion catalog) the
+    response is ``200`` with ``status: unchanged``; if a job for it is already
+    queued or running, that job is returned. Otherwise a new job is queued
+    (``202``), which removes the temporary file when it finishes. Jobs whose
+    runner died are reclaimed first (see ``ingestion.reclaim_stale_jobs``).
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
@@ -67,15 +111,50 @@ class AdminProcessPDFView(APIView):
         if not pdf_file or not namespace:
             return Response({'error': 'pdf and course_id are required.'},
                             status=status.HTTP_400_BAD_REQUEST)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            for chunk in pdf_file.chunks():
-                tmp.write(chunk)
-            pdf_path = tmp.name
+        pdf_path, file_hash = save_upload(pdf_file)
+        job = None
         try:
-            process_pdf_book(pdf_path, namespace)
-            return Response({'status': f'Processed successfully for {namespace}'})
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            book = find_ingested(namespace, file_hash)
+            if book is not None:
+                return Response({
+                    'job_id': None,
+                    'status': 'unchanged',
+                    'book': IngestedBookSerializer(book).data,
+                })
+            reclaim_stale_jobs()
+            job = find_active_job(namespace, file_hash)
+            if job is not None:
+                return self.job_response(request, job)
+
+            # Ingestion takes minutes for a textbook, so run it as a background job
+            job = IngestionJob.objects.create(
+                submitted_by=request.user,
+                namespace=namespace,
+                file_name=pdf_file.name,
+                file_path=pdf_path,
+                file_hash=file_hash,
+            )
+            submit_ingestion_job(job)
+            return self.job_response(request, job)
+        finally:
+            # Only a newly queued job takes ownership of the file
+            if job is None or job.file_path != pdf_path:
+                os.remove(pdf_path)
+
+    def job_response(self, request, job):
+        return Response({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': reverse('process_pdf_status', kwargs={'job_id': job.id}, request=request),
+        }, status=status.HTTP_202_ACCEPTED)
+
+class AdminProcessPDFStatusView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id):
+        """Return the stage and progress counters of an ingestion job"""
+        job = get_object_or_404(IngestionJob, pk=job_id)
+        return Response(IngestionJobSerializer(job).data)
 
 class AdminDeleteNamespaceView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -85,25 +164,361 @@ class AdminDeleteNamespaceView(APIView):
             return Response({'error': 'course_id is required.'},
                             status=status.HTTP_400_BAD_REQUEST)
         try:
-            delete_namespace(INDEX_NAME, namespace)
+            chatbot_core = chatbot()
+            chatbot_core.delete_namespace(chatbot_core.INDEX_NAME, namespace)
             return Response({'status': f'Namespace {namespace} deleted successfully.'})
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class ChatbotStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        """Cache and query-batching counters of this worker process"""
+        # Only report what is already loaded; a stats call must not load the model
+        chatbot_core = sys.modules.get('user_extras.chatbot_core')
+        embeddings = sys.modules.get('user_extras.embeddings')
+        return Response({
+            'pid': os.getpid(),
+            'query_cache': chatbot_core.query_embedding_cache.stats() if chatbot_core else None,
+            'answer_cache': chatbot_core.answer_cache.stats() if chatbot_core else None,
+            'llm': chatbot_core.llm_caller.stats() if chatbot_core else None,
+            'query_batching': embeddings.query_batching_stats() if embeddings else {},
+            'queries': query_metrics.snapshot(),
+        })
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class EventStreamRenderer(BaseRenderer):
+    """Accepts ``Accept: text/event-stream`` in content negotiation.
+
+    Streamed answers are ``StreamingHttpResponse``s and skip rendering; any
+    other response (an error, or an answer without an LLM call) is sent as a
+    single ``done`` or ``error`` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        event = 'done' if isinstance(data, dict) and 'response' in data else 'error'
+        return sse_event(event, data).encode(self.charset)
+
+def is_true(value):
+    return str(value).lower() in ('1', 'true')
+
+def with_timings(response, timings):
+    """Add the ``Server-Timing`` header; timings of a non-streamed response are finished here."""
+    if settings.CHATBOT_SERVER_TIMING_HEADER:
+        response['Server-Timing'] = timings.server_timing()
+    if not response.streaming:
+        timings.finish(status='ok' if response.status_code < 400 else 'error', http_status=response.status_code)
+    return response
+
+def domain_namespaces(domain_id):
+    """Vector-store namespaces of every course in a domain (courses are ingested under their id)."""
+    return [str(pk) for pk in Course.objects.filter(domain_id=domain_id).order_by('id').values_list('id', flat=True)]
+
+def query_target(data):
+    """``(namespace, namespaces, error)`` of a query request.
+
+    A ``course_id`` searches that course's namespace. A ``domain_id`` searches
+    the namespaces of all the domain's courses (``namespaces``) and is labelled
+    ``domain-<id>`` in timings; it can't be combined with ``save_messages``.
+    """
+    if data.get('course_id'):
+        return data.get('course_id'), None, None
+    domain_id = data.get('domain_id')
+    if not domain_id:
+        return None, None, 'course_id (or domain_id) and query are required.'
+    if is_true(data.get('save_messages', '')):
+        return None, None, 'save_messages needs a course_id.'
+    if not str(domain_id).isdigit():
+        return None, None, 'domain_id must be an integer.'
+    return f'domain-{domain_id}', int(domain_id), None
+
+def upstream_error(error):
+    """Status code and headers for a request that ran out of time or hit an open circuit."""
+    if isinstance(error, CircuitOpenError):
+        return status.HTTP_503_SERVICE_UNAVAILABLE, {'Retry-After': f'{error.retry_after:.0f}'}
+    return status.HTTP_504_GATEWAY_TIMEOUT, None
+
 class ChatbotQueryView(APIView):
+    """Answer a question about a course, or with ``domain_id`` about all courses of a domain.
+
+    Domain questions search the courses' namespaces concurrently (see
+    ``chatbot_core.search_namespaces``) and skip the answer cache.
+
+    With ``save_messages: true`` the question and the answer are also stored as
+    ChatMessages in one INSERT and their ids returned as ``message_ids``. When
+    ``CHATBOT_DEFER_MESSAGE_SAVE`` is on, a non-streamed answer is sent first and
+    saved afterwards, so ``message_ids`` is null; streamed answers are saved once
+    the last token has been sent and the ids arrive in the ``done`` event.
+
+    Stage timings are returned in a ``Server-Timing`` header (streams only carry
+    the stages before the first token; the rest is in the ``done`` event),
+    logged to ``user_extras.chatbot`` and added to the per-namespace metrics.
+
+    The whole request runs under ``CHATBOT_REQUEST_DEADLINE``: running out of
+    time returns 504, and an open LLM circuit breaker returns 503.
+    """
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer]
+
+    def wants_stream(self, request):
+        """Stream when asked for with ``stream: true`` or an ``Accept: text/event-stream`` header"""
+        if is_true(request.data.get('stream', '')):
+            return True
+        return 'text/event-stream' in request.META.get('HTTP_ACCEPT', '')
+
     def post(self, request):
-        namespace = request.data.get('course_id')
+        namespace, domain_id, error = query_target(request.data)
         query = request.data.get('query')
-        if not namespace or not query:
-            return Response({'error': 'course_id and query are required.'},
+        if error or not query:
+            return Response({'error': error or 'course_id (or domain_id) and query are required.'},
                             status=status.HTTP_400_BAD_REQUEST)
+        stream = self.wants_stream(request)
+        save_messages = is_true(request.data.get('save_messages', ''))
+        timings = QueryTimings('query', namespace)
+        with timings.activate(), Deadline(settings.CHATBOT_REQUEST_DEADLINE).activate():
+            response = self.answer(request, namespace, query, stream, save_messages, timings, domain_id)
+        return with_timings(response, timings)
+
+    def answer(self, request, namespace, query, stream, save_messages, timings, domain_id=None):
         try:
-            results = search_book(query, namespace)
+            chatbot_core = chatbot()
+            answer_cache = chatbot_core.answer_cache
+            use_answer_cache = settings.CHATBOT_ANSWER_CACHE_ENABLED and domain_id is None
+            query_vector = None
+
+            def on_complete(response, store_in_cache=True):
+                """Cache and save a streamed answer; returns extra ``done`` event fields."""
+                if store_in_cache and use_answer_cache:
+                    answer_cache.store(namespace, query_vector, response)
+                if save_messages:
+                    return {'message_ids': save_chat_turn(request.user, namespace, query, response)}
+                return {}
+
+            if use_answer_cache:
+                query_vector = chatbot_core.embed_query(query)
+                with timings.span('answer_cache'):
+                    cached = answer_cache.lookup(namespace, query_vector)
+                if cached is not None:
+                    timings.count('answer_cache_hits')
+                    if stream:
+                        return self.stream_response(iter([cached]), sources=[], cached=True,
+                                                    on_complete=lambda response: on_complete(response, False),
+                                                    timings=timings)
+                    return self.reply(request, namespace, query, cached, save_messages, cached=True)
+
+            if domain_id is None:
+                results = chatbot_core.search_book(query, namespace, top_k=settings.CHATBOT_RETRIEVAL_TOP_K)
+            else:
+                results, _skipped = chatbot_core.search_namespaces(
+                    query, domain_namespaces(domain_id), top_k=settings.CHATBOT_RETRIEVAL_TOP_K
+                )
             if not results:
-                return Response({'response': "No relevant info found."})
-            context = [doc.page_content for doc in results]
-            response = llm_chain.invoke({"context": context, "question": query})
-            return Response({'response': response})
+                return self.reply(request, namespace, query, "No relevant info found.", save_messages)
+            with timings.span('context'):
+                context = pack_context(results)
+            if stream:
+                tokens = chatbot_core.llm_stream_chain.stream({"context": context, "question": query})
+                return self.stream_response(tokens, sources=[doc.metadata for doc in results],
+                                            on_complete=on_complete, timings=timings)
+            with timings.span('llm'):
+                response = chatbot_core.llm_chain.invoke({"context": context, "question": query})
+            if use_answer_cache:
+                answer_cache.store(namespace, query_vector, response)
+            return self.reply(request, namespace, query, response, save_messages)
+        except (DeadlineExceeded, CircuitOpenError) as e:
+            status_code, headers = upstream_error(e)
+            return Response({'error': str(e)}, status=status_code, headers=headers)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def reply(self, request, namespace, query, response, save_messages, **extra):
+        """JSON answer, saving the question/answer pair now or after sending it."""
+        data = {'response': response, **extra}
+        if not save_messages:
+            return Response(data)
+        if settings.CHATBOT_DEFER_MESSAGE_SAVE:
+            return call_after_response(Response({**data, 'message_ids': None}),
+                                       save_chat_turn, request.user, namespace, query, response)
+        return Response({**data, 'message_ids': save_chat_turn(request.user, namespace, query, response)})
+
+    def stream_response(self, tokens, sources, cached=False, on_complete=None, timings=None):
+        """Send retrieval metadata, then each token, then the full text as SSE.
+
+        ``on_complete`` is called with the final text once the stream finishes,
+        e.g. to cache or persist the answer; a dict it returns is added to the
+        ``done`` event. ``timings`` are finished when the stream ends.
+        """
+        if timings is not None and not cached:
+            tokens = timings.timed_tokens(current_deadline().iterate(tokens))
+
+        def events():
+            yield sse_event('metadata', {'sources': sources, 'cached': cached})
+            parts = []
+            try:
+                for token in tokens:
+                    parts.append(token)
+                    yield sse_event('token', {'token': token})
+            except Exception as e:
+                if timings is not None:
+                    timings.finish(status='error', cached=cached, stream=True)
+                yield sse_event('error', {'error': str(e)})
+                return
+            response = "".join(parts)
+            extra = on_complete(response) if on_complete else None
+            if timings is not None:
+                timings.finish(status='ok', cached=cached, stream=True)
+                extra = {**(extra or {}), 'timings': timings.as_dict()}
+            yield sse_event('done', {'response': response, **(extra or {})})
+
+        http_response = StreamingHttpResponse(events(), content_type='text/event-stream')
+        http_response['Cache-Control'] = 'no-cache'
+        http_response['X-Accel-Buffering'] = 'no'  # Don't let a proxy buffer the stream
+        return http_response
+
+
+@csrf_exempt
+@require_POST
+async def chatbot_query_async(request):
+    """Async twin of ChatbotQueryView for ASGI (uvicorn) workers.
+
+    Same request and response format, but the vector query and the Groq call
+    are awaited instead of holding a thread, and the query embedding runs on
+    chatbot_core's dedicated embedding executor.
+
+    Under WSGI every request would run in a fresh event loop, and the async
+    Groq and Pinecone clients are bound to the loop that created them, so
+    there the request is answered by ChatbotQueryView instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        return await sync_to_async(ChatbotQueryView.as_view())(request)
+    try:
+        auth = await sync_to_async(TokenAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    if auth is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        data = json.loads(request.body) if request.content_type == 'application/json' else request.POST
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body.'}, status=status.HTTP_400_BAD_REQUEST)
+    namespace, domain_id, error = query_target(data)
+    query = data.get('query')
+    if error or not query:
+        return JsonResponse({'error': error or 'course_id (or domain_id) and query are required.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+    stream = (is_true(data.get('stream', ''))
+              or 'text/event-stream' in request.META.get('HTTP_ACCEPT', ''))
+    save_messages = is_true(data.get('save_messages', ''))
+    user = auth[0]
+    timings = QueryTimings('query_async', namespace)
+    with timings.activate(), Deadline(settings.CHATBOT_REQUEST_DEADLINE).activate():
+        response = await _answer_async(user, namespace, query, stream, save_messages, timings, domain_id)
+    return with_timings(response, timings)
+
+async def _answer_async(user, namespace, query, stream, save_messages, timings, domain_id=None):
+    """Body of ``chatbot_query_async`` once the request is authenticated and parsed."""
+
+    async def on_complete(response, store_in_cache=True):
+        if store_in_cache and use_answer_cache:
+            await sync_to_async(answer_cache.store, thread_sensitive=False)(namespace, query_vector, response)
+        if save_messages:
+            return {'message_ids': await asave_chat_turn(user, namespace, query, response)}
+        return {}
+
+    async def reply(response, **extra):
+        data = {'response': response, **extra}
+        if not save_messages:
+            return JsonResponse(data)
+        if settings.CHATBOT_DEFER_MESSAGE_SAVE:
+            # Response closers run synchronously (in a thread under ASGI)
+            return call_after_response(JsonResponse({**data, 'message_ids': None}),
+                                       save_chat_turn, user, namespace, query, response)
+        return JsonResponse({**data, 'message_ids': await asave_chat_turn(user, namespace, query, response)})
+
+    try:
+        # The first import takes seconds; keep it off the event loop
+        chatbot_core = await sync_to_async(chatbot, thread_sensitive=False)()
+        answer_cache = chatbot_core.answer_cache
+        use_answer_cache = settings.CHATBOT_ANSWER_CACHE_ENABLED and domain_id is None
+        query_vector = await chatbot_core.aembed_query(query)
+        if use_answer_cache:
+            with timings.span('answer_cache'):
+                cached = await sync_to_async(answer_cache.lookup, thread_sensitive=False)(namespace, query_vector)
+            if cached is not None:
+                timings.count('answer_cache_hits')
+                if stream:
+                    return async_stream_response(_aiter([cached]), sources=[], cached=True,
+                                                 on_complete=lambda response: on_complete(response, False),
+                                                 timings=timings)
+                return await reply(cached, cached=True)
+
+        if domain_id is None:
+            results = await chatbot_core.asearch_book(query, namespace, top_k=settings.CHATBOT_RETRIEVAL_TOP_K,
+                                         query_vector=query_vector)
+        else:
+            namespaces = await sync_to_async(domain_namespaces)(domain_id)
+            results, _skipped = await chatbot_core.asearch_namespaces(
+                query, namespaces, top_k=settings.CHATBOT_RETRIEVAL_TOP_K, query_vector=query_vector
+            )
+        if not results:
+            return await reply("No relevant info found.")
+        with timings.span('context'):
+            context = pack_context(results)
+        if stream:
+            tokens = chatbot_core.llm_stream_chain.astream({"context": context, "question": query})
+            return async_stream_response(tokens, sources=[doc.metadata for doc in results],
+                                         on_complete=on_complete, timings=timings)
+        with timings.span('llm'):
+            response = await chatbot_core.llm_chain.ainvoke({"context": context, "question": query})
+        if use_answer_cache:
+            await sync_to_async(answer_cache.store, thread_sensitive=False)(namespace, query_vector, response)
+        return await reply(response)
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        status_code, headers = upstream_error(e)
+        return JsonResponse({'error': str(e)}, status=status_code, headers=headers)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+def async_stream_response(tokens, sources, cached=False, on_complete=None, timings=None):
+    """Async-iterator version of ChatbotQueryView.stream_response; ``on_complete`` is a coroutine function."""
+    if timings is not None and not cached:
+        tokens = timings.atimed_tokens(current_deadline().aiterate(tokens))
+
+    async def events():
+        yield sse_event('metadata', {'sources': sources, 'cached': cached})
+        parts = []
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield sse_event('token', {'token': token})
+        except Exception as e:
+            if timings is not None:
+                timings.finish(status='error', cached=cached, stream=True)
+            yield sse_event('error', {'error': str(e)})
+            return
+        response = "".join(parts)
+        extra = await on_complete(response) if on_complete else None
+        if timings is not None:
+            timings.finish(status='ok', cached=cached, stream=True)
+            extra = {**(extra or {}), 'timings': timings.as_dict()}
+        yield sse_event('done', {'response': response, **(extra or {})})
+
+    http_response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    http_response['Cache-Control'] = 'no-cache'
+    http_response['X-Accel-Buffering'] = 'no'
+    return http_response